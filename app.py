@@ -1,12 +1,20 @@
+"""Command line entry point of a wrap.
+
+The heavy dependencies (pandas, matplotlib, networkx, moviepy, OpenCV) are imported
+by the stage that needs them, so printing the help, validating the arguments or
+computing only the stats doesn't pay for the libraries of the other stages.
+"""
+
+from __future__ import annotations
+
 import argparse
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from functools import partial
-from typing import List
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-import matplotlib.pyplot as plt
-import pandas as pd
-from PIL import Image
 from tzlocal import get_localzone_name
 
 from wrapy.constants import (
@@ -14,100 +22,90 @@ from wrapy.constants import (
     COVER_BG_IMAGE_PATH,
     DAYS_WEEK_MAP,
     DAYS_WEEK_MAP_EN,
+    DEFAULT_DATA_DIR,
     DEFAULT_OUTPUT_PATH,
+    DEFAULT_VIDEO_BACKEND,
     END_LOCAL_TIME_COL_NAME,
+    HISTORY_CHUNK_SIZE,
+    INCREMENTAL_OUTPUT_PATH,
     K_TOP_SONGS,
     K_TOP_SONGS_GRAPH,
     LIMIT_DATE_FORMAT,
+    PROFILERS,
     REPO_URL,
+    SKIP_MS_TOLERANCE,
+    STATE_FILE_NAME,
+    VIDEO_BACKENDS,
     VIDEO_DIMENSIONS,
 )
-from wrapy.core import (
-    calculate_human_total_play,
-    compute_unique_values,
-    count_song_skips,
-    create_and_save_text_card,
-    create_and_save_title_card,
-    create_bar_graph,
-    create_polar_graph,
-    create_simple_plot,
-    gen_top_k_graph,
-    generate_n_star_viz,
-    generate_plays_to_x_map,
-    get_average_plays_per_day,
-    get_period,
-    get_top_artists,
-    get_top_songs,
-    get_top_songs_for_each_hour,
-)
 from wrapy.custom_exceptions import ValidationError
-from wrapy.lang import EnLocale, EsLocale
-from wrapy.logger_ import load_logger
-from wrapy.utils import (
-    convert_column_utc_datetime_to_local_time,
-    filter_data_by_dates,
-    load_streaming_history_data,
-    map_int_day_to_weekday_name,
-    parse_str_to_date,
-    separate_di_tuples_in_two_lists,
-    write_text_lines_in_new_text_file,
+from wrapy.instrumentation import (
+    Instrumentation,
+    instrumented,
+    save_instrumentation,
+    span,
 )
-from wrapy.video.maker import VideoMaker
+from wrapy.lang import EnLocale, EsLocale, Locale
+from wrapy.logger_ import load_logger
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+    from wrapy.aggregates import WrapSummary
+    from wrapy.core import WrapStats
+    from wrapy.render import RenderJob
+    from wrapy.utils import Period
+
+logger = logging.getLogger("wrapy")
 
 
 def setup_matplotlib(dark_theme: bool = True):
+    import matplotlib.pyplot as plt
+
     if dark_theme:
         plt.style.use("dark_background")
 
 
-def setup(lang: str):
+def setup():
     setup_matplotlib()
+    load_logger()
 
-    global logger
-    logger = load_logger()
 
-    global locale
-    locale = EnLocale() if lang == "english" else EsLocale()
+def get_locale(lang: str) -> Locale:
+    return EnLocale() if lang == "english" else EsLocale()
 
 
-def generate_and_save_stats(data: pd.DataFrame, output_path: str) -> list:
-    total_plays = data.shape[0]
+def generate_and_save_stats(stats: WrapStats, output_path: str, locale: Locale) -> list:
+    from wrapy.utils import write_text_lines_in_new_text_file
 
-    song_skips_dict = count_song_skips(data)
-    avg_plays_per_day = get_average_plays_per_day(data)
-    avg_plays_per_day = str(round(avg_plays_per_day))
-    total_song_skips = song_skips_dict.get("total", "ERROR")
-    percentage_song_skips = song_skips_dict.get("percentage", "ERROR")
+    total_song_skips = stats.skips[SKIP_MS_TOLERANCE]
+    percentage_song_skips = "{:.2f}".format(stats.skip_percentage()) + "%"
+    avg_plays_per_day = str(round(stats.avg_plays_per_day()))
 
-    start_date = data[END_LOCAL_TIME_COL_NAME].min().strftime("%Y/%m/%d")
-    end_date = data[END_LOCAL_TIME_COL_NAME].max().strftime("%Y/%m/%d")
+    start_date = stats.start.strftime("%Y/%m/%d")
+    end_date = stats.end.strftime("%Y/%m/%d")
     time_period = f"{start_date} - {end_date}"
 
-    if percentage_song_skips != "ERROR":
-        percentage_song_skips = "{:.2f}".format(percentage_song_skips) + "%"
-
-    human_total_play = calculate_human_total_play(data)
+    human_total_play = stats.human_total_play
     played_days = human_total_play["days"]
     played_hours = human_total_play["hours"]
     played_minutes = human_total_play["minutes"]
 
-    different_artists_listened = compute_unique_values(data, column_name="artistName")
-    different_songs_played = compute_unique_values(data, column_name="trackName")
-
     is_plural = lambda unity: int(unity) > 1
 
     text_stats = [
-        f"{locale.get_attr('total_play')}: {total_plays}",
+        f"{locale.get_attr('total_play')}: {stats.total_plays}",
         f"{locale.get_attr('song_skips')}: {total_song_skips}, {percentage_song_skips}",
         f"{locale.get_attr('avg_plays_per_day')}: {avg_plays_per_day}",
-        f"{locale.get_attr('different_songs_listened')}: {different_songs_played}",
+        f"{locale.get_attr('different_songs_listened')}: {stats.unique_songs}",
         (
             f"{locale.get_attr('total_play_listened')}:"
             f" {played_days} {locale.get_attr('day', is_plural(played_days))},"
             f" {played_hours} {locale.get_attr('hour', is_plural(played_hours))},"
             f" {played_minutes} {locale.get_attr('minute', is_plural(played_minutes))}"
         ),
-        f"{locale.get_attr('different_artists_listened')}: {different_artists_listened}",
+        f"{locale.get_attr('different_artists_listened')}: {stats.unique_artists}",
         f"{locale.get_attr('time_period')}: {time_period}",
     ]
 
@@ -116,6 +114,20 @@ def generate_and_save_stats(data: pd.DataFrame, output_path: str) -> list:
     return text_stats
 
 
+def parse_date_arg(date_str: str) -> date:
+    """Type of the date arguments, the utils are loaded only when a date is given."""
+    from wrapy.utils import parse_str_to_date
+
+    return parse_str_to_date(date_str)
+
+
+def parse_period_arg(period_str: str) -> Period:
+    """Type of the period arguments, see `wrapy.utils.parse_period`."""
+    from wrapy.utils import parse_period
+
+    return parse_period(period_str)
+
+
 def validate_dates(start_date: date, end_date: date):
     if not (start_date and end_date):
         return
@@ -131,223 +143,753 @@ def validate_dates(start_date: date, end_date: date):
     logger.info(f"start-date given: {start_date}, end-date given: {end_date}")
 
 
-def make_video(output_path_dir: str, text_stats: List[str], period: str) -> None:
-    # create card for intro
-    intro_card_path = os.path.join(output_path_dir, "00_intro.png")
-    create_and_save_title_card(
-        f"My Spotify Wrapy \n\n{period}",
-        intro_card_path,
-        CARD_IMG_SIZE,
-        font_size=30,
-        background_img=Image.open(COVER_BG_IMAGE_PATH).convert("RGB"),
+def make_video(
+    output_path_dir: str,
+    text_stats: List[str],
+    period: str,
+    locale: Locale,
+    video_backend: str = DEFAULT_VIDEO_BACKEND,
+    frames: Optional[Dict[str, np.ndarray]] = None,
+) -> None:
+    """Make the video from the images of the output dir, sorted by name.
+
+    When `frames` is given, the charts and cards already rendered in memory are
+    taken from it, keyed by their image paths, and the cards of the video are
+    rendered in memory too. Their PNG images are written in background threads
+    while the video is made.
+    """
+    from wrapy.core import create_and_save_text_card, create_and_save_title_card
+    from wrapy.render import RenderJob, run_render_jobs, write_frames
+    from wrapy.video.maker import VideoMaker
+
+    card_jobs = [
+        # card for intro
+        RenderJob(
+            "intro",
+            create_and_save_title_card,
+            dict(
+                title=f"My Spotify Wrapy \n\n{period}",
+                save_path=os.path.join(output_path_dir, "00_intro.png"),
+                img_size=CARD_IMG_SIZE,
+                font_size=30,
+                background_img=COVER_BG_IMAGE_PATH,
+            ),
+        ),
+        # card for stats
+        RenderJob(
+            "stats",
+            create_and_save_text_card,
+            dict(
+                title="Stats",
+                text_lines=text_stats,
+                img_size=CARD_IMG_SIZE,
+                save_path=os.path.join(output_path_dir, "05_stats.png"),
+                title_font_size=30,
+                content_font_size=18,
+            ),
+        ),
+        # card for credits
+        RenderJob(
+            "credits",
+            create_and_save_title_card,
+            dict(
+                title=f"{locale.get_attr('download_from')}\n\n{REPO_URL}\n\n\n+)",
+                save_path=os.path.join(output_path_dir, "z10_credits.png"),
+                img_size=CARD_IMG_SIZE,
+                font_size=26,
+            ),
+        ),
+    ]
+    with span("cards"):
+        card_frames = run_render_jobs(
+            card_jobs, serial=True, as_arrays=frames is not None
+        )
+
+    images = {
+        os.path.join(output_path_dir, f): os.path.join(output_path_dir, f)
+        for f in os.listdir(output_path_dir)
+        if f.endswith(".png")
+    }
+    video_path = os.path.join(output_path_dir, "my_wrapy.mp4")
+
+    if frames is None:
+        with span("encode"):
+            VideoMaker(sorted(images), VIDEO_DIMENSIONS).make(
+                output_path=video_path, backend=video_backend
+            )
+        return
+
+    frames = dict(frames)
+    frames.update((job.save_path, frame) for job, frame in zip(card_jobs, card_frames))
+    # the images not rendered in this run are read from the output dir
+    images.update(frames)
+
+    with ThreadPoolExecutor() as png_writers:
+        pending_writes = write_frames(frames, png_writers)
+
+        with span("encode"):
+            VideoMaker(
+                [images[path] for path in sorted(images)], VIDEO_DIMENSIONS
+            ).make(output_path=video_path, backend=video_backend)
+
+        # the time to finish writing the PNG images after the video
+        with span("write_images"):
+            for pending_write in pending_writes:
+                pending_write.result()
+
+
+def load_history(
+    local_timezone: str, use_cache: bool = True, data_dir: str = DEFAULT_DATA_DIR
+) -> pd.DataFrame:
+    """Load the streaming history with the local time column, sorted by it, reusing
+    the parsed history from the cache when the source files and timezone are
+    unchanged."""
+    from wrapy.cache import HistoryCache, build_cache_key
+    from wrapy.utils import (
+        add_local_calendar_columns,
+        convert_column_utc_datetime_to_local_time,
+        find_streaming_history_files,
+        load_streaming_history_data,
+        sort_data_by_time,
     )
-    # create card for stats
-    stats_card_path = os.path.join(output_path_dir, "05_stats.png")
-    create_and_save_text_card(
-        "Stats",
-        text_stats,
-        CARD_IMG_SIZE,
-        stats_card_path,
-        title_font_size=30,
-        content_font_size=18,
+
+    file_paths = find_streaming_history_files(data_dir)
+
+    if use_cache:
+        cache = HistoryCache()
+        fingerprints = cache.fingerprints(file_paths)
+        cache_key = build_cache_key(fingerprints, local_timezone)
+
+        with span("read_cache"):
+            data = cache.get(cache_key)
+
+        if data is not None:
+            logger.info("Streaming history loaded from cache")
+            return data
+
+    with span("parse"):
+        data = load_streaming_history_data(file_paths=file_paths)
+
+    with span("tz_convert"):
+        data = convert_column_utc_datetime_to_local_time(
+            data=data,
+            new_tz=local_timezone,
+            column_name="endTime",
+            new_column_name=END_LOCAL_TIME_COL_NAME,
+        )
+
+    with span("calendar"):
+        data = add_local_calendar_columns(data)
+
+    # the date windows of the wraps are then found with binary searches
+    with span("sort"):
+        data = sort_data_by_time(data)
+
+    if use_cache:
+        with span("write_cache"):
+            cache.put(cache_key, data, fingerprints, local_timezone)
+
+    return data
+
+
+def plan_render_jobs(
+    summary: WrapSummary, output_path_dir: str, locale: Locale
+) -> List[RenderJob]:
+    """List the charts and cards of a wrap with the aggregated inputs of each one."""
+    from wrapy.core import (
+        create_and_save_text_card,
+        create_bar_graph,
+        create_polar_graph,
+        create_simple_plot,
+        draw_transition_graph,
+        generate_n_star_viz,
+        pick_top_songs_for_top_hours,
     )
-    # create card for credits
-    credits_card_path = os.path.join(output_path_dir, "z10_credits.png")
-    create_and_save_title_card(
-        f"{locale.get_attr('download_from')}\n\n{REPO_URL}\n\n\n+)",
-        credits_card_path,
-        CARD_IMG_SIZE,
-        font_size=26,
+    from wrapy.render import RenderJob
+    from wrapy.utils import map_int_day_to_weekday_name, separate_di_tuples_in_two_lists
+
+    plays_per_groups = summary.plays_per_groups
+    plays_per_hour = plays_per_groups["hour"]
+
+    # top songs
+    top_5_songs = summary.top_songs.head(5).to_dict(orient="records")
+
+    # top songs for each hour (from a top 5)
+    top_songs_for_top_hours = pick_top_songs_for_top_hours(
+        summary.top_songs_per_hour, plays_per_hour, 5, join_word=locale.get_attr("by")
     )
+    top_songs_for_top_hours = dict(sorted(top_songs_for_top_hours.items()))
 
-    image_paths = [
-        os.path.join(output_path_dir, f)
-        for f in os.listdir(output_path_dir)
-        if f.endswith(".png")
+    # accumulated plays per day of the week
+    days_week_map = DAYS_WEEK_MAP_EN if isinstance(locale, EnLocale) else DAYS_WEEK_MAP
+
+    x_hours, y_hour_values = separate_di_tuples_in_two_lists(plays_per_hour)
+    x_months, y_month_value = separate_di_tuples_in_two_lists(plays_per_groups["month"])
+
+    return [
+        RenderJob(
+            "top_songs",
+            create_and_save_text_card,
+            dict(
+                title=locale.get_attr("top_songs_card_title"),
+                text_lines=[
+                    f"{song['trackName'][:35]} - {song['artistName'][:35]}:"
+                    f" {song['plays']}"
+                    for song in top_5_songs
+                ],
+                img_size=CARD_IMG_SIZE,
+                save_path=os.path.join(output_path_dir, "06_top_songs.png"),
+                title_font_size=25,
+                content_font_size=18,
+            ),
+        ),
+        RenderJob(
+            "top_songs_for_top_hours",
+            create_and_save_text_card,
+            dict(
+                title=locale.get_attr("top_songs_for_top_hours_card_title"),
+                text_lines=[
+                    f"{song} {locale.get_attr('at_time')} {hour}h"
+                    for hour, song in top_songs_for_top_hours.items()
+                ],
+                img_size=CARD_IMG_SIZE,
+                save_path=os.path.join(
+                    output_path_dir, "09_top_songs_for_top_hours.png"
+                ),
+                title_font_size=25,
+                content_font_size=18,
+            ),
+        ),
+        RenderJob(
+            "top_artists",
+            create_and_save_text_card,
+            dict(
+                title=locale.get_attr("top_artists_card_title"),
+                text_lines=[
+                    f"{artist}: {plays} {locale.get_attr('play')}"
+                    for artist, plays in summary.top_artists.items()
+                ],
+                img_size=CARD_IMG_SIZE,
+                save_path=os.path.join(output_path_dir, "07_top_artists.png"),
+                title_font_size=24,
+                content_font_size=21,
+            ),
+        ),
+        RenderJob(
+            "plays_per_weekday",
+            create_polar_graph,
+            dict(
+                data=plays_per_groups["weekday"],
+                plot_title=locale.get_attr("plays_per_weekday_plot_title"),
+                label_map_fn=partial(map_int_day_to_weekday_name, days_week_map),
+                save_path=os.path.join(output_path_dir, "03_plays_per_weekday.png"),
+                title_font_size=20,
+            ),
+        ),
+        # accumulated plays per hour
+        RenderJob(
+            "plays_per_hour",
+            create_bar_graph,
+            dict(
+                x=x_hours,
+                y=y_hour_values,
+                plot_title=locale.get_attr("plays_per_hour_plot_title"),
+                x_label=locale.get_attr("hour"),
+                save_path=os.path.join(output_path_dir, "01_plays_per_hour.png"),
+                title_font_size=20,
+            ),
+        ),
+        # accumulated plays per month - simple plot
+        RenderJob(
+            "plays_per_month",
+            create_simple_plot,
+            dict(
+                x=x_months,
+                y=y_month_value,
+                plot_title=locale.get_attr("plays_per_month_plot_title"),
+                x_label=locale.get_attr("month"),
+                save_path=os.path.join(output_path_dir, "02_plays_per_month.png"),
+                title_font_size=20,
+            ),
+        ),
+        RenderJob(
+            "star_with_artists_color_coded_from_top_songs",
+            generate_n_star_viz,
+            dict(
+                data=summary.top_songs,
+                img_size=CARD_IMG_SIZE[::-1],
+                title=locale.get_attr("artists_color_coded_from_top_songs").format(
+                    K=K_TOP_SONGS
+                ),
+                save_path=os.path.join(
+                    output_path_dir,
+                    "04_star_with_artists_color_coded_from_top_songs.png",
+                ),
+            ),
+        ),
+        RenderJob(
+            "top_songs_history_graph",
+            draw_transition_graph,
+            dict(
+                transitions=summary.transitions,
+                img_size=CARD_IMG_SIZE,
+                title=locale.get_attr("play_history_from_top_songs").format(
+                    K=K_TOP_SONGS_GRAPH
+                ),
+                save_path=os.path.join(
+                    output_path_dir, "08_top_songs_history_graph.png"
+                ),
+            ),
+        ),
     ]
 
-    image_paths.sort()
 
-    VideoMaker(image_paths, VIDEO_DIMENSIONS).make(
-        output_path=os.path.join(output_path_dir, "my_wrapy.mp4")
-    )
+def render_wrap(
+    summary: WrapSummary,
+    output_path_dir: str,
+    locale: Locale,
+    create_video: bool = True,
+    previous_digests: Optional[Dict[str, str]] = None,
+    serial_render: bool = False,
+    video_backend: str = DEFAULT_VIDEO_BACKEND,
+) -> Dict[str, str]:
+    """Write the stats, charts and cards of a wrap (and the video) in the output dir.
+    The charts and cards are rendered in parallel unless `serial_render` is set.
+
+    When `previous_digests` is given, the outputs whose inputs didn't change since
+    they were rendered are kept as they are. Returns the digests of the inputs of
+    every output.
+    """
+    from wrapy.render import run_render_jobs
+
+    with span("stats"):
+        text_stats = generate_and_save_stats(
+            summary.stats, os.path.join(output_path_dir, "stats.txt"), locale
+        )
+    logger.info("Stats generated")
+
+    digests = dict()
+    pending_jobs = []
+    jobs = plan_render_jobs(summary, output_path_dir, locale)
+
+    for job in jobs:
+        digests[job.name] = job.digest()
+
+        if (
+            previous_digests is not None
+            and previous_digests.get(job.name) == digests[job.name]
+            and os.path.exists(job.save_path)
+        ):
+            continue
+
+        pending_jobs.append(job)
+
+    # the images are handed to the video in memory, their PNG files are written
+    # meanwhile
+    with span("render"):
+        frames = run_render_jobs(
+            pending_jobs,
+            serial=serial_render,
+            initializer=setup_matplotlib,
+            as_arrays=create_video,
+        )
+    rendered_jobs = len(pending_jobs)
+
+    logger.info(f"Plots and cards generated: {rendered_jobs} of {len(jobs)}")
+
+    video_path = os.path.join(output_path_dir, "my_wrapy.mp4")
+
+    if create_video and (rendered_jobs > 0 or not os.path.exists(video_path)):
+        logger.info("Generating video...")
+        with span("video"):
+            make_video(
+                output_path_dir=output_path_dir,
+                text_stats=text_stats,
+                period=summary.stats.period,
+                locale=locale,
+                video_backend=video_backend,
+                frames={
+                    job.save_path: frame for job, frame in zip(pending_jobs, frames)
+                },
+            )
+
+    return digests
 
 
 def run(
     local_timezone: str,
+    locale: Locale,
     start_date: date = None,
     end_date: date = None,
     create_video: bool = True,
+    use_cache: bool = True,
+    data_dir: str = DEFAULT_DATA_DIR,
+    output_path_dir: Optional[str] = None,
+    serial_render: bool = False,
+    video_backend: str = DEFAULT_VIDEO_BACKEND,
+    stats_only: bool = False,
+    chunk_size: Optional[int] = None,
 ):
-    data = load_streaming_history_data()
+    """Generate the wrap of the streaming history in `data_dir`. With `stats_only`
+    only the stats are computed and written, no plotting library is loaded.
+
+    With `chunk_size` the history is never loaded at once, its plays are read and
+    aggregated `chunk_size` at a time (without the cache), see
+    `wrapy.aggregates.aggregate_history_in_chunks`.
 
-    data = convert_column_utc_datetime_to_local_time(
-        data=data,
-        new_tz=local_timezone,
-        column_name="endTime",
-        new_column_name=END_LOCAL_TIME_COL_NAME,
+    The stages are measured when an instrumentation is active, see
+    `wrapy.instrumentation`, and their timings are written next to the stats."""
+    if chunk_size:
+        run_in_chunks(
+            local_timezone,
+            locale,
+            chunk_size,
+            start_date,
+            end_date,
+            create_video=create_video,
+            data_dir=data_dir,
+            output_path_dir=output_path_dir,
+            serial_render=serial_render,
+            video_backend=video_backend,
+            stats_only=stats_only,
+        )
+        return
+
+    from wrapy.utils import filter_data_by_dates, get_memory_footprint
+
+    with span("load"):
+        data = load_history(local_timezone, use_cache, data_dir)
+    logger.info(
+        f"Loaded {data.shape[0]} plays,"
+        f" {get_memory_footprint(data) / 2**20:.1f} MiB in memory"
     )
 
     if start_date and end_date:
-        data = filter_data_by_dates(data, END_LOCAL_TIME_COL_NAME, start_date, end_date)
+        with span("filter"):
+            data = filter_data_by_dates(
+                data, END_LOCAL_TIME_COL_NAME, start_date, end_date
+            )
 
         if data.shape[0] < 2:
             logger.error("Too few records to generate stats")
-            exit(0)
+            raise ValidationError("Too few records to generate stats")
 
-    new_folder = datetime.now().strftime("%Y-%m-%d %H_%M")
-    output_path_dir = os.path.join(DEFAULT_OUTPUT_PATH, new_folder)
+    if not output_path_dir:
+        new_folder = datetime.now().strftime("%Y-%m-%d %H_%M")
+        output_path_dir = os.path.join(DEFAULT_OUTPUT_PATH, new_folder)
 
-    if not os.path.exists(output_path_dir):
-        os.mkdir(output_path_dir)
+    os.makedirs(output_path_dir, exist_ok=True)
 
-    # Stats
-    text_stats = generate_and_save_stats(
-        data, os.path.join(output_path_dir, "stats.txt")
-    )
-    logger.info("Stats generated")
+    if stats_only:
+        from wrapy.core import StatsEngine
 
-    # Text cards
-    plays_per_groups = generate_plays_to_x_map(
-        data=data,
-        target_names={"hour", "month", "weekday"},
-        column_name=END_LOCAL_TIME_COL_NAME,
-    )
-    plays_per_hour = plays_per_groups["hour"]
+        with span("stats"):
+            generate_and_save_stats(
+                StatsEngine().compute(data),
+                os.path.join(output_path_dir, "stats.txt"),
+                locale,
+            )
+        save_instrumentation(output_path_dir)
+        logger.info(f"Done, checkout the stats: {output_path_dir}/stats.txt")
+        return
 
-    # top songs
-    top_songs = get_top_songs(data, k_top=K_TOP_SONGS)
-    top_5_songs = top_songs.head(5).to_dict(orient="records")
-    create_and_save_text_card(
-        locale.get_attr("top_songs_card_title"),
-        [
-            f"{song['trackName'][:35]} - {song['artistName'][:35]}: {song['plays']}"
-            for song in top_5_songs
-        ],
-        CARD_IMG_SIZE,
-        os.path.join(output_path_dir, "06_top_songs.png"),
-        title_font_size=25,
-        content_font_size=18,
-    )
+    from wrapy.aggregates import summarize_history
 
-    # top songs for each hour (from a top 5)
-    top_songs_for_top_hours = get_top_songs_for_each_hour(
-        data, plays_per_hour, 5, "endLocalTime", join_word=locale.get_attr("by")
-    )
-    top_songs_for_top_hours = dict(sorted(top_songs_for_top_hours.items()))
-    create_and_save_text_card(
-        locale.get_attr("top_songs_for_top_hours_card_title"),
-        [
-            f"{song} {locale.get_attr('at_time')} {hour}h"
-            for hour, song in top_songs_for_top_hours.items()
-        ],
-        CARD_IMG_SIZE,
-        os.path.join(output_path_dir, "09_top_songs_for_top_hours.png"),
-        title_font_size=25,
-        content_font_size=18,
-    )
+    with span("summarize"):
+        summary = summarize_history(data)
 
-    # top artists
-    top_artists = get_top_artists(data, 5)
-    create_and_save_text_card(
-        locale.get_attr("top_artists_card_title"),
-        [
-            f"{artist}: {plays} {locale.get_attr('play')}"
-            for artist, plays in top_artists.items()
-        ],
-        CARD_IMG_SIZE,
-        os.path.join(output_path_dir, "07_top_artists.png"),
-        title_font_size=24,
-        content_font_size=21,
+    render_wrap(
+        summary,
+        output_path_dir,
+        locale,
+        create_video,
+        serial_render=serial_render,
+        video_backend=video_backend,
     )
+    save_instrumentation(output_path_dir)
 
-    logger.info("Text cards generated")
+    logger.info(f"Done, checkout the folder: {output_path_dir}/")
 
-    # Plots
 
-    # accumulated plays per day of the week
-    plays_per_weekday = plays_per_groups["weekday"]
-    days_week_map = DAYS_WEEK_MAP_EN if isinstance(locale, EnLocale) else DAYS_WEEK_MAP
+def run_periods(
+    local_timezone: str,
+    locale: Locale,
+    periods: List[Period],
+    create_video: bool = True,
+    use_cache: bool = True,
+    data_dir: str = DEFAULT_DATA_DIR,
+    output_path_dir: Optional[str] = None,
+    serial_render: bool = False,
+    video_backend: str = DEFAULT_VIDEO_BACKEND,
+    stats_only: bool = False,
+):
+    """Generate a wrap for each period of the streaming history in `data_dir`, each
+    one in a folder named after the period. The plays are loaded and counted once in
+    a `HistoryCube`, the wrap of each period is computed from the counts of its days.
+    The periods with too few plays are skipped."""
+    from wrapy.aggregates import HistoryCube
 
-    create_polar_graph(
-        data=plays_per_weekday,
-        plot_title=locale.get_attr("plays_per_weekday_plot_title"),
-        label_map_fn=partial(map_int_day_to_weekday_name, days_week_map),
-        save_path=os.path.join(output_path_dir, "03_plays_per_weekday.png"),
-        title_font_size=20,
-    )
-    # accumulated plays per hour
-    x_hours, y_hour_values = separate_di_tuples_in_two_lists(plays_per_hour)
-    create_bar_graph(
-        x=x_hours,
-        y=y_hour_values,
-        plot_title=locale.get_attr("plays_per_hour_plot_title"),
-        x_label=locale.get_attr("hour"),
-        save_path=os.path.join(output_path_dir, "01_plays_per_hour.png"),
-        title_font_size=20,
-    )
-    # accumulated plays per month - simple plot
-    plays_per_month = plays_per_groups["month"]
-    x_months, y_month_value = separate_di_tuples_in_two_lists(plays_per_month)
-    create_simple_plot(
-        x=x_months,
-        y=y_month_value,
-        plot_title=locale.get_attr("plays_per_month_plot_title"),
-        x_label=locale.get_attr("month"),
-        save_path=os.path.join(output_path_dir, "02_plays_per_month.png"),
-        title_font_size=20,
+    with span("load"):
+        data = load_history(local_timezone, use_cache, data_dir)
+    logger.info(f"Loaded {data.shape[0]} plays")
+
+    with span("cube"):
+        cube = HistoryCube(data)
+
+    if not output_path_dir:
+        new_folder = datetime.now().strftime("%Y-%m-%d %H_%M")
+        output_path_dir = os.path.join(DEFAULT_OUTPUT_PATH, new_folder)
+
+    generated_periods = 0
+
+    for period in periods:
+        if cube.count_plays(period.start_date, period.end_date) < 2:
+            logger.warning(f"Too few records to generate the wrap of {period.label}")
+            continue
+
+        period_path_dir = os.path.join(output_path_dir, period.label)
+        os.makedirs(period_path_dir, exist_ok=True)
+
+        with span(period.label):
+            if stats_only:
+                with span("stats"):
+                    generate_and_save_stats(
+                        cube.stats(period.start_date, period.end_date),
+                        os.path.join(period_path_dir, "stats.txt"),
+                        locale,
+                    )
+            else:
+                with span("summarize"):
+                    summary = cube.summarize(period.start_date, period.end_date)
+
+                render_wrap(
+                    summary,
+                    period_path_dir,
+                    locale,
+                    create_video,
+                    serial_render=serial_render,
+                    video_backend=video_backend,
+                )
+
+        generated_periods += 1
+        logger.info(f"Wrap of {period.label} generated")
+
+    if generated_periods == 0:
+        logger.error("Too few records to generate stats")
+        raise ValidationError("Too few records to generate stats")
+
+    save_instrumentation(output_path_dir)
+
+    logger.info(f"Done, checkout the folder: {output_path_dir}/")
+
+
+def run_in_chunks(
+    local_timezone: str,
+    locale: Locale,
+    chunk_size: int,
+    start_date: date = None,
+    end_date: date = None,
+    create_video: bool = True,
+    data_dir: str = DEFAULT_DATA_DIR,
+    output_path_dir: Optional[str] = None,
+    serial_render: bool = False,
+    video_backend: str = DEFAULT_VIDEO_BACKEND,
+    stats_only: bool = False,
+):
+    """Generate the wrap of the streaming history in `data_dir` from aggregates
+    folded `chunk_size` plays at a time, for histories too large to load at once."""
+    from wrapy.aggregates import (
+        aggregate_history_in_chunks,
+        count_transitions_in_chunks,
     )
+    from wrapy.utils import find_streaming_history_files
 
-    generate_n_star_viz(
-        top_songs,
-        img_size=CARD_IMG_SIZE[::-1],
-        title=locale.get_attr("artists_color_coded_from_top_songs").format(
-            K=K_TOP_SONGS
-        ),
-        save_path=os.path.join(
-            output_path_dir, "04_star_with_artists_color_coded_from_top_songs.png"
-        ),
+    file_paths = find_streaming_history_files(data_dir)
+
+    with span("aggregate"):
+        aggregates = aggregate_history_in_chunks(
+            file_paths,
+            local_timezone,
+            chunk_size,
+            start_date,
+            end_date,
+        )
+    logger.info(f"Aggregated {aggregates.total_plays} plays in chunks of {chunk_size}")
+
+    if aggregates.total_plays < 2:
+        logger.error("Too few records to generate stats")
+        raise ValidationError("Too few records to generate stats")
+
+    if not output_path_dir:
+        new_folder = datetime.now().strftime("%Y-%m-%d %H_%M")
+        output_path_dir = os.path.join(DEFAULT_OUTPUT_PATH, new_folder)
+
+    os.makedirs(output_path_dir, exist_ok=True)
+
+    if stats_only:
+        with span("stats"):
+            generate_and_save_stats(
+                aggregates.stats(),
+                os.path.join(output_path_dir, "stats.txt"),
+                locale,
+            )
+        save_instrumentation(output_path_dir)
+        logger.info(f"Done, checkout the stats: {output_path_dir}/stats.txt")
+        return
+
+    with span("transitions"):
+        transitions = count_transitions_in_chunks(
+            file_paths,
+            aggregates.transition_songs(),
+            local_timezone,
+            chunk_size,
+            start_date,
+            end_date,
+        )
+
+    with span("summarize"):
+        summary = aggregates.summarize(transitions)
+
+    render_wrap(
+        summary,
+        output_path_dir,
+        locale,
+        create_video,
+        serial_render=serial_render,
+        video_backend=video_backend,
     )
+    save_instrumentation(output_path_dir)
 
-    gen_top_k_graph(
-        data=data,
-        img_size=CARD_IMG_SIZE,
-        title=locale.get_attr("play_history_from_top_songs").format(
-            K=K_TOP_SONGS_GRAPH
-        ),
-        save_path=os.path.join(output_path_dir, "08_top_songs_history_graph.png"),
-        k_top=K_TOP_SONGS_GRAPH,
+    logger.info(f"Done, checkout the folder: {output_path_dir}/")
+
+
+def run_incremental(
+    local_timezone: str,
+    locale: Locale,
+    create_video: bool = True,
+    data_dir: str = DEFAULT_DATA_DIR,
+    output_path_dir: str = INCREMENTAL_OUTPUT_PATH,
+    serial_render: bool = False,
+    video_backend: str = DEFAULT_VIDEO_BACKEND,
+):
+    """Update the wrap kept in `output_path_dir` with the plays of the streaming
+    history files not seen in previous runs. Only the plays not folded yet are
+    taken, so overlapping exports are not counted twice (see `WrapState.fold`), and
+    only the outputs whose inputs changed are rendered again."""
+    from wrapy.aggregates import WrapState
+    from wrapy.cache import indexed_fingerprints
+    from wrapy.utils import (
+        add_local_calendar_columns,
+        convert_column_utc_datetime_to_local_time,
+        find_streaming_history_files,
+        load_streaming_history_data,
     )
 
-    logger.info("Plots generated")
+    os.makedirs(output_path_dir, exist_ok=True)
+    state_path = os.path.join(output_path_dir, STATE_FILE_NAME)
+    state = WrapState.load(state_path, local_timezone)
 
-    if create_video:
-        logger.info("Generating video...")
-        make_video(
-            output_path_dir=output_path_dir,
-            text_stats=text_stats,
-            period=get_period(data, "endLocalTime"),
+    # only the files whose size or modification time changed are hashed again
+    file_paths = find_streaming_history_files(data_dir)
+    fingerprints, _ = indexed_fingerprints(file_paths, state.fingerprints)
+    state.fingerprints = {
+        fingerprint["path"]: fingerprint for fingerprint in fingerprints
+    }
+    file_hashes = {
+        file_path: fingerprint["hash"]
+        for file_path, fingerprint in zip(file_paths, fingerprints)
+    }
+    new_file_paths = [
+        file_path
+        for file_path in file_paths
+        if file_hashes[file_path] not in state.source_hashes
+    ]
+
+    def load_files(file_paths: List[str]) -> pd.DataFrame:
+        data = load_streaming_history_data(file_paths=file_paths)
+        data = convert_column_utc_datetime_to_local_time(
+            data=data,
+            new_tz=local_timezone,
+            column_name="endTime",
+            new_column_name=END_LOCAL_TIME_COL_NAME,
         )
 
+        return add_local_calendar_columns(data)
+
+    def load_sources(source_hashes: List[str]) -> Optional[pd.DataFrame]:
+        """The plays of the files with the content hashes, None if some of them are
+        not in the data folder anymore."""
+        source_paths = [
+            file_path
+            for file_path in file_paths
+            if file_hashes[file_path] in source_hashes
+        ]
+        found_hashes = {file_hashes[file_path] for file_path in source_paths}
+
+        if found_hashes != set(source_hashes):
+            return None
+
+        return load_files(source_paths)
+
+    if new_file_paths:
+        with span("load"):
+            data = load_files(new_file_paths)
+
+        with span("fold"):
+            data = state.fold(
+                data,
+                {file_hashes[file_path] for file_path in new_file_paths},
+                load_sources,
+            )
+        logger.info(
+            f"Folded {data.shape[0]} new plays from {len(new_file_paths)} new files"
+        )
+    else:
+        logger.info("No new streaming history files")
+
+    if state.aggregates.total_plays < 2:
+        logger.error("Too few records to generate stats")
+        raise ValidationError("Too few records to generate stats")
+
+    with span("summarize"):
+        summary = state.aggregates.summarize(state.transitions)
+
+    state.output_digests = render_wrap(
+        summary,
+        output_path_dir,
+        locale,
+        create_video,
+        previous_digests=state.output_digests,
+        serial_render=serial_render,
+        video_backend=video_backend,
+    )
+    state.save(state_path)
+    save_instrumentation(output_path_dir)
+
     logger.info(f"Done, checkout the folder: {output_path_dir}/")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
+    # argparse formats the help with %
+    date_format_help = LIMIT_DATE_FORMAT.replace("%", "%%")
     parser.add_argument("--tz", type=str, required=False, default=get_localzone_name())
     parser.add_argument(
         "--start-date",
-        type=parse_str_to_date,
+        type=parse_date_arg,
         required=False,
         default=None,
-        help=f"Format to use: {LIMIT_DATE_FORMAT}",
+        help=f"first day of the wrap. Format to use: {date_format_help}",
     )
     parser.add_argument(
         "--end-date",
-        type=parse_str_to_date,
+        type=parse_date_arg,
         required=False,
         default=None,
-        help=f"Format to use: {LIMIT_DATE_FORMAT}",
+        help=(
+            "last day of the wrap, the whole day is included, as in --periods."
+            f" Format to use: {date_format_help}"
+        ),
     )
     parser.add_argument(
         "--lang",
@@ -357,10 +899,105 @@ if __name__ == "__main__":
         help="Language to use for the stats and plots",
     )
     parser.add_argument("--no-video", action="store_false", help="no generate video")
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        help="always parse the streaming history instead of using the cache",
+    )
+    parser.add_argument(
+        "--video-backend",
+        choices=VIDEO_BACKENDS,
+        default=DEFAULT_VIDEO_BACKEND,
+        help="encoder used to make the video",
+    )
+    parser.add_argument(
+        "--serial-render",
+        action="store_true",
+        help="render the plots and cards one after another, useful for debugging",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="write the time of every stage in timings.json, next to the stats",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="also measure the peak of memory of every stage, slower (implies --timings)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        metavar="STAGE",
+        help=(
+            "profile a stage, e.g. render or video.encode, see the names in"
+            " timings.json (implies --timings and --serial-render)"
+        ),
+    )
+    parser.add_argument(
+        "--profiler",
+        choices=PROFILERS,
+        default=PROFILERS[0],
+        help="profiler of --profile, pyinstrument must be installed to use it",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        metavar="PLAYS",
+        help=(
+            "read and aggregate the streaming history this many plays at a time"
+            f" (e.g. {HISTORY_CHUNK_SIZE}), to bound the memory used by very long"
+            " histories"
+        ),
+    )
+    parser.add_argument(
+        "--periods",
+        type=parse_period_arg,
+        nargs="+",
+        default=None,
+        metavar="PERIOD",
+        help=(
+            "generate a wrap for each period, in a folder named after it: a year"
+            " (2023), a quarter (2023-Q1), a month (2023-03) or a range of days"
+            " (2023-03-15:2023-04-15), both days included"
+        ),
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--incremental",
+        action="store_true",
+        help=(
+            f"update the wrap kept in {INCREMENTAL_OUTPUT_PATH} with the new"
+            " streaming history files only"
+        ),
+    )
+    mode.add_argument(
+        "--stats-only",
+        action="store_true",
+        help="only compute the stats, without plots, cards or video",
+    )
     args = parser.parse_args()
     timezone_name = args.tz
 
-    setup(args.lang)
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error("--chunk-size must be a positive number of plays")
+    if args.chunk_size and args.incremental:
+        parser.error("--chunk-size can't be used with --incremental")
+    if args.periods and (
+        args.incremental or args.chunk_size or args.start_date or args.end_date
+    ):
+        parser.error(
+            "--periods can't be used with --incremental, --chunk-size or the dates"
+        )
+
+    if args.stats_only:
+        # the plots are not made, don't load matplotlib
+        load_logger()
+    else:
+        setup()
+    locale = get_locale(args.lang)
 
     if not timezone_name:
         logger.warning(
@@ -371,9 +1008,46 @@ if __name__ == "__main__":
 
     validate_dates(args.start_date, args.end_date)
 
-    run(
-        local_timezone=timezone_name,
-        start_date=args.start_date,
-        end_date=args.end_date,
-        create_video=args.no_video,
-    )
+    instrumentation = None
+    if args.timings or args.trace_memory or args.profile:
+        instrumentation = Instrumentation(
+            trace_memory=args.trace_memory,
+            profile_stage=args.profile,
+            profiler=args.profiler,
+        )
+    # the render jobs are profiled in this process only
+    serial_render = args.serial_render or args.profile is not None
+
+    with instrumented(instrumentation):
+        if args.periods:
+            run_periods(
+                local_timezone=timezone_name,
+                locale=locale,
+                periods=args.periods,
+                create_video=args.no_video,
+                use_cache=args.no_cache,
+                serial_render=serial_render,
+                video_backend=args.video_backend,
+                stats_only=args.stats_only,
+            )
+        elif args.incremental:
+            run_incremental(
+                local_timezone=timezone_name,
+                locale=locale,
+                create_video=args.no_video,
+                serial_render=serial_render,
+                video_backend=args.video_backend,
+            )
+        else:
+            run(
+                local_timezone=timezone_name,
+                locale=locale,
+                start_date=args.start_date,
+                end_date=args.end_date,
+                create_video=args.no_video,
+                use_cache=args.no_cache,
+                serial_render=serial_render,
+                video_backend=args.video_backend,
+                stats_only=args.stats_only,
+                chunk_size=args.chunk_size,
+            )
@@ -0,0 +1,274 @@
+import argparse
+import json
+import logging
+import os
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, NamedTuple, Optional
+
+from tzlocal import get_localzone_name
+
+from app import get_locale, parse_date_arg, run, setup, validate_dates
+from wrapy.constants import (
+    BATCH_OUTPUT_PATH,
+    BATCH_REPORT_FILE_NAME,
+    BATCH_TASKS_PER_WORKER,
+)
+from wrapy.logger_ import load_logger
+
+logger = logging.getLogger("wrapy")
+
+
+class UserExport(NamedTuple):
+    """Streaming history export of a user and the settings of their wrap."""
+
+    user_id: str
+    data_dir: str
+    output_path_dir: str
+    lang: str
+    timezone: str
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    create_video: bool = True
+
+
+def discover_user_exports(
+    root_dir: str, output_path: str, lang: str, timezone: str, create_video: bool
+) -> List[UserExport]:
+    """Every directory inside `root_dir` is the export of a user, named after it."""
+    return [
+        UserExport(
+            user_id=user_id,
+            data_dir=os.path.join(root_dir, user_id),
+            output_path_dir=os.path.join(output_path, user_id),
+            lang=lang,
+            timezone=timezone,
+            create_video=create_video,
+        )
+        for user_id in sorted(os.listdir(root_dir))
+        if os.path.isdir(os.path.join(root_dir, user_id))
+    ]
+
+
+def load_manifest(
+    manifest_path: str, output_path: str, lang: str, timezone: str, create_video: bool
+) -> List[UserExport]:
+    """Load the user exports listed in a JSON manifest, a list of objects with the
+    keys `user_id` and `data_dir`, and optionally `lang`, `tz`, `start_date` and
+    `end_date`. The relative data dirs are resolved from the manifest location."""
+    with open(manifest_path) as manifest_file:
+        entries = json.load(manifest_file)
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    return [
+        UserExport(
+            user_id=entry["user_id"],
+            data_dir=os.path.join(manifest_dir, entry["data_dir"]),
+            output_path_dir=os.path.join(output_path, entry["user_id"]),
+            lang=entry.get("lang", lang),
+            timezone=entry.get("tz", timezone),
+            start_date=entry.get("start_date"),
+            end_date=entry.get("end_date"),
+            create_video=create_video,
+        )
+        for entry in entries
+    ]
+
+
+def _wrap_result(export: UserExport, started_at: float, error: Optional[str]) -> dict:
+    return {
+        "user_id": export.user_id,
+        "status": "failed" if error else "done",
+        "seconds": round(time.perf_counter() - started_at, 3),
+        "output_path_dir": export.output_path_dir,
+        "error": error,
+    }
+
+
+def generate_user_wrap(export: UserExport) -> dict:
+    """Generate the wrap of a user, any error is reported instead of raised so a
+    failing export doesn't stop the batch."""
+    started_at = time.perf_counter()
+    error = None
+
+    try:
+        start_date = parse_date_arg(export.start_date) if export.start_date else None
+        end_date = parse_date_arg(export.end_date) if export.end_date else None
+        validate_dates(start_date, end_date)
+
+        run(
+            local_timezone=export.timezone,
+            locale=get_locale(export.lang),
+            start_date=start_date,
+            end_date=end_date,
+            create_video=export.create_video,
+            # the workers would race on the shared cache, and every export is
+            # loaded once anyway
+            use_cache=False,
+            data_dir=export.data_dir,
+            output_path_dir=export.output_path_dir,
+            # pool workers can't start processes of their own
+            serial_render=True,
+        )
+    except Exception:
+        error = traceback.format_exc()
+        logger.error(f"Wrap of user {export.user_id} failed:\n{error}")
+
+    return _wrap_result(export, started_at, error)
+
+
+def generate_user_wrap_alone(export: UserExport) -> dict:
+    """Generate the wrap of a user in a worker process of its own. If the worker
+    dies (killed for running out of memory, a crash of a native library), the
+    export of the user is the cause and the wrap is reported as failed."""
+    started_at = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=1, initializer=setup) as executor:
+        try:
+            return executor.submit(generate_user_wrap, export).result()
+        except BrokenProcessPool:
+            error = "The worker process died, e.g. killed for running out of memory"
+
+    logger.error(f"Wrap of user {export.user_id} failed: {error}")
+
+    return _wrap_result(export, started_at, error)
+
+
+def run_batch(
+    exports: List[UserExport],
+    workers: Optional[int] = None,
+    tasks_per_worker: int = BATCH_TASKS_PER_WORKER,
+) -> List[dict]:
+    """Generate the wraps of the user exports in a pool of processes, with at most
+    one wrap per worker at once. The pool is replaced by a fresh one after
+    `tasks_per_worker` wraps per worker, so the memory held by the rendering
+    libraries doesn't grow for the whole batch.
+
+    When a worker dies the pool breaks and the wraps it was running fail, without
+    knowing which one killed it. Those wraps are generated again one by one in a
+    worker of their own, see `generate_user_wrap_alone`, and the batch goes on in
+    a new pool."""
+    workers = workers or os.cpu_count() or 1
+    pending = deque(exports)
+    results = []
+
+    def add_result(result: dict):
+        logger.info(
+            f"[{len(results) + 1}/{len(exports)}] {result['user_id']}:"
+            f" {result['status']} in {result['seconds']}s"
+        )
+        results.append(result)
+
+    while pending:
+        pool_exports = deque(
+            pending.popleft()
+            for _ in range(min(len(pending), workers * tasks_per_worker))
+        )
+        running = dict()
+        broken_exports = []
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=setup) as executor:
+            while (pool_exports or running) and not broken_exports:
+                while pool_exports and len(running) < workers:
+                    export = pool_exports.popleft()
+                    running[executor.submit(generate_user_wrap, export)] = export
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    export = running.pop(future)
+                    try:
+                        add_result(future.result())
+                    except BrokenProcessPool:
+                        broken_exports.append(export)
+
+            # a broken pool fails the wraps still running too
+            for future, export in running.items():
+                try:
+                    add_result(future.result())
+                except BrokenProcessPool:
+                    broken_exports.append(export)
+
+        for export in broken_exports:
+            add_result(generate_user_wrap_alone(export))
+
+        # the wraps not started yet go to the next pool
+        pending.extendleft(reversed(pool_exports))
+
+    return results
+
+
+def write_report(results: List[dict], report_path: str, total_seconds: float):
+    failed = [result for result in results if result["status"] == "failed"]
+    report = {
+        "total": len(results),
+        "done": len(results) - len(failed),
+        "failed": len(failed),
+        "seconds": round(total_seconds, 3),
+        "users": sorted(results, key=lambda result: result["user_id"]),
+    }
+
+    with open(report_path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate the wraps of many users in parallel."
+    )
+    parser.add_argument(
+        "source",
+        type=str,
+        help=(
+            "directory with one streaming history directory per user, or a JSON"
+            " manifest listing the user exports"
+        ),
+    )
+    parser.add_argument("--output", type=str, default=BATCH_OUTPUT_PATH)
+    parser.add_argument("--tz", type=str, required=False, default=get_localzone_name())
+    parser.add_argument(
+        "--lang",
+        choices=["spanish", "english"],
+        required=False,
+        default="english",
+        help="Language to use when the user export doesn't set one",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--tasks-per-worker",
+        type=int,
+        default=BATCH_TASKS_PER_WORKER,
+        help="wraps generated by a worker before it's replaced by a new one",
+    )
+    parser.add_argument("--no-video", action="store_false", help="no generate video")
+    args = parser.parse_args()
+
+    load_logger()
+
+    if os.path.isdir(args.source):
+        exports = discover_user_exports(
+            args.source, args.output, args.lang, args.tz, args.no_video
+        )
+    else:
+        exports = load_manifest(
+            args.source, args.output, args.lang, args.tz, args.no_video
+        )
+
+    os.makedirs(args.output, exist_ok=True)
+    logger.info(f"Generating {len(exports)} wraps")
+
+    started_at = time.perf_counter()
+    results = run_batch(exports, args.workers, args.tasks_per_worker)
+    report_path = os.path.join(args.output, BATCH_REPORT_FILE_NAME)
+    write_report(results, report_path, time.perf_counter() - started_at)
+
+    logger.info(f"Done, checkout the report: {report_path}")
@@ -0,0 +1,307 @@
+"""Time the stages of a wrap over synthetic streaming histories.
+
+For each size a synthetic history is generated (see `synthetic_history.py`) and
+every stage runs on it: loading the JSON files, converting the timezone, adding
+the local calendar columns, sorting by time, the plays per hour / month / weekday,
+the tops, the stats, each chart and card, and the video. A stage runs `--repeat`
+times and its best wall time is kept, then once more under `tracemalloc` to
+measure its peak of allocated memory, which includes the arrays of numpy and
+pandas.
+
+The results are written as JSON with the commit and the versions of the main
+libraries, so runs of different commits can be compared with `--compare`.
+
+Usage:
+    python benchmarks/stages.py [--plays 10000 100000] [--output results.json]
+        [--compare previous.json] [--no-video]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from importlib.metadata import PackageNotFoundError, version
+from typing import Callable, Dict, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import matplotlib  # noqa: E402
+
+matplotlib.use("Agg")
+
+from synthetic_history import generate_history  # noqa: E402
+
+import app  # noqa: E402
+from wrapy.aggregates import WRAP_X_TARGETS, summarize_history  # noqa: E402
+from wrapy.constants import (  # noqa: E402
+    DEFAULT_VIDEO_BACKEND,
+    END_LOCAL_TIME_COL_NAME,
+    K_TOP_ARTISTS,
+    K_TOP_SONGS,
+    K_TOP_SONGS_GRAPH,
+    VIDEO_BACKENDS,
+    VIDEO_DIMENSIONS,
+)
+from wrapy.core import (  # noqa: E402
+    StatsEngine,
+    generate_plays_to_x_map,
+    get_top_artists,
+    get_top_songs,
+    get_top_songs_per_hour,
+    get_transition_counts,
+)
+from wrapy.utils import (  # noqa: E402
+    add_local_calendar_columns,
+    convert_column_utc_datetime_to_local_time,
+    find_streaming_history_files,
+    load_streaming_history_data,
+    sort_data_by_time,
+)
+from wrapy.video.maker import VideoMaker  # noqa: E402
+
+DEFAULT_PLAYS = [10_000, 100_000]
+TIMEZONE = "America/Mexico_City"
+LIBRARIES = ["numpy", "pandas", "matplotlib", "networkx", "Pillow", "moviepy"]
+
+
+def measure(function: Callable, repeat: int) -> dict:
+    """Best wall time in seconds of calling the function `repeat` times, and the
+    peak of memory allocated by one more call."""
+    timings = []
+
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": min(timings), "runs": timings, "peak_bytes": peak_bytes}
+
+
+def run_stages(
+    data_dir: str, work_dir: str, repeat: int, video_backend: Optional[str]
+) -> Dict[str, dict]:
+    """Measure every stage of a wrap over the streaming history of the data dir."""
+    results = dict()
+
+    def stage(name: str, function: Callable, times: int = repeat):
+        results[name] = measure(function, times)
+        print(
+            f"  {name:52} {results[name]['seconds']:8.3f}s"
+            f" {results[name]['peak_bytes'] / 2**20:9.1f} MiB",
+            flush=True,
+        )
+
+    file_paths = find_streaming_history_files(data_dir)
+    stage("load", lambda: load_streaming_history_data(file_paths=file_paths))
+
+    data = load_streaming_history_data(file_paths=file_paths)
+    stage(
+        "tz_convert",
+        lambda: convert_column_utc_datetime_to_local_time(
+            data, TIMEZONE, "endTime", END_LOCAL_TIME_COL_NAME
+        ),
+    )
+
+    # the columns are added to `data`, the next stages take the fields from them
+    stage("calendar", lambda: add_local_calendar_columns(data))
+    stage("sort", lambda: sort_data_by_time(data))
+    data = sort_data_by_time(data)
+
+    stage(
+        "plays_to_x_map",
+        lambda: generate_plays_to_x_map(data, WRAP_X_TARGETS, END_LOCAL_TIME_COL_NAME),
+    )
+    stage("top_songs", lambda: get_top_songs(data, K_TOP_SONGS))
+    stage("top_artists", lambda: get_top_artists(data, K_TOP_ARTISTS))
+    stage(
+        "top_songs_per_hour",
+        lambda: get_top_songs_per_hour(data, 1, END_LOCAL_TIME_COL_NAME),
+    )
+    stage(
+        "transitions",
+        lambda: get_transition_counts(data, K_TOP_SONGS_GRAPH, END_LOCAL_TIME_COL_NAME),
+    )
+    stage(
+        "stats",
+        lambda: StatsEngine(timestamp_column=END_LOCAL_TIME_COL_NAME).compute(data),
+    )
+
+    app.setup_matplotlib()
+    summary = summarize_history(data)
+    jobs = app.plan_render_jobs(summary, work_dir, app.get_locale("english"))
+
+    for job in jobs:
+        stage(f"render.{job.name}", job.run)
+
+    if video_backend is None:
+        return results
+
+    images = sorted(job.save_path for job in jobs)
+    video_path = os.path.join(work_dir, "wrap.mp4")
+    stage(
+        f"video.{video_backend}",
+        lambda: VideoMaker(images, VIDEO_DIMENSIONS).make(
+            output_path=video_path, backend=video_backend
+        ),
+        times=1,
+    )
+
+    return results
+
+
+def library_versions() -> Dict[str, Optional[str]]:
+    versions = dict()
+
+    for library in LIBRARIES:
+        try:
+            versions[library] = version(library)
+        except PackageNotFoundError:
+            versions[library] = None
+
+    return versions
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_DIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, previous: dict):
+    """Print the ratio of the time and memory of every stage to a previous run."""
+    previous_runs = {run["plays"]: run["stages"] for run in previous["runs"]}
+    print(f"\ncompared with {previous.get('commit')}, new / previous:")
+
+    for run in results["runs"]:
+        previous_stages = previous_runs.get(run["plays"])
+
+        if previous_stages is None:
+            continue
+
+        print(f"{run['plays']} plays")
+        for name, stage in run["stages"].items():
+            if name not in previous_stages:
+                continue
+
+            old = previous_stages[name]
+            print(
+                f"  {name:52} time x{stage['seconds'] / old['seconds']:6.2f}"
+                f"  memory x{stage['peak_bytes'] / max(old['peak_bytes'], 1):6.2f}"
+            )
+
+
+def main(
+    plays: List[int],
+    repeat: int,
+    video_backend: Optional[str],
+    seed: int,
+    output_path: str,
+    data_dir: Optional[str] = None,
+) -> dict:
+    results = {
+        "commit": current_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "libraries": library_versions(),
+        "repeat": repeat,
+        "seed": seed,
+        # the history benchmarked when it's not a synthetic one
+        "data_dir": data_dir,
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_plays in plays:
+            history_dir = data_dir or os.path.join(tmp_dir, f"history_{n_plays}")
+            work_dir = os.path.join(tmp_dir, f"wrap_{n_plays}")
+            os.makedirs(work_dir)
+
+            if data_dir is None:
+                generate_history(history_dir, plays=n_plays, seed=seed)
+
+            print(f"{n_plays} plays", flush=True)
+            results["runs"].append(
+                {
+                    "plays": n_plays,
+                    "stages": run_stages(history_dir, work_dir, repeat, video_backend),
+                }
+            )
+
+    with open(output_path, "w") as json_file:
+        json.dump(results, json_file, indent=2)
+
+    print(f"results written to {output_path}")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--plays",
+        type=int,
+        nargs="+",
+        default=DEFAULT_PLAYS,
+        help="sizes of the synthetic histories, from 10k to 10M plays",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=None,
+        help="benchmark a real streaming history instead of a synthetic one",
+    )
+    parser.add_argument(
+        "--video-backend",
+        type=str,
+        choices=VIDEO_BACKENDS,
+        default=DEFAULT_VIDEO_BACKEND,
+    )
+    parser.add_argument("--no-video", action="store_true")
+    parser.add_argument("--output", type=str, default="benchmark_results.json")
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="results of a previous run to compare with",
+    )
+    args = parser.parse_args()
+
+    results = main(
+        plays=args.plays if args.data_dir is None else [0],
+        repeat=args.repeat,
+        video_backend=None if args.no_video else args.video_backend,
+        seed=args.seed,
+        output_path=args.output,
+        data_dir=args.data_dir,
+    )
+
+    if args.compare:
+        with open(args.compare) as json_file:
+            compare(results, json.load(json_file))
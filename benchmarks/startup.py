@@ -0,0 +1,156 @@
+"""Measure the cold start time of the command line.
+
+Each command runs in a fresh interpreter several times and the best wall time is
+kept, the first run warms up the disk caches. The modules imported by each command
+are listed with `-X importtime`, so a heavy library that starts being imported too
+early is reported by name. Exits with an error if any command is slower than the
+limit, so it can run in CI.
+
+Usage:
+    python benchmarks/startup.py [--repeat 5] [--max-seconds 1.0]
+        [--data-dir spotify_data] [--max-stats-seconds 3.0]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that must not be imported to print the help or compute only the stats
+HEAVY_MODULES = ["matplotlib", "networkx", "cv2", "moviepy", "scipy", "PIL"]
+
+COMMANDS = {
+    "import app": [sys.executable, "-c", "import app"],
+    "app.py --help": [sys.executable, "app.py", "--help"],
+    "batch.py --help": [sys.executable, "batch.py", "--help"],
+}
+
+
+def time_command(command: List[str], repeat: int) -> float:
+    """Best wall time in seconds of running the command `repeat` times."""
+    timings = []
+
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        subprocess.run(
+            command,
+            cwd=REPO_DIR,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        timings.append(time.perf_counter() - started_at)
+
+    return min(timings)
+
+
+def imported_modules(command: List[str]) -> Dict[str, float]:
+    """Cumulative import time in seconds of each top level module imported by the
+    command."""
+    output = subprocess.run(
+        [command[0], "-X", "importtime"] + command[1:],
+        cwd=REPO_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    ).stderr
+
+    modules = dict()
+
+    for line in output.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)$", line)
+
+        # only the top level modules, they are not indented
+        if match:
+            modules[match.group(2)] = int(match.group(1)) / 1e6
+
+    return modules
+
+
+def main(
+    commands: Dict[str, List[str]],
+    repeat: int,
+    max_seconds: float,
+    command_max_seconds: Optional[Dict[str, float]] = None,
+) -> int:
+    """Time every command, `command_max_seconds` overrides the limit of some of
+    them."""
+    command_max_seconds = command_max_seconds or dict()
+    failures = 0
+
+    for name, command in commands.items():
+        seconds = time_command(command, repeat)
+        modules = imported_modules(command)
+        heavy = [module for module in HEAVY_MODULES if module in modules]
+        slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:3]
+
+        status = "ok"
+        if seconds > command_max_seconds.get(name, max_seconds) or heavy:
+            status = "FAIL"
+            failures += 1
+
+        print(f"{status:4} {name:20} {seconds:.3f}s")
+        print(
+            "     slowest imports: "
+            + ", ".join(f"{module} {secs:.3f}s" for module, secs in slowest)
+        )
+        if heavy:
+            print(f"     heavy modules imported: {', '.join(heavy)}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=1.0,
+        help="slowest cold start allowed for each command",
+    )
+    parser.add_argument(
+        "--max-stats-seconds",
+        type=float,
+        default=3.0,
+        help=(
+            "slowest --stats-only run allowed, it loads pandas and parses the"
+            " history of --data-dir"
+        ),
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=None,
+        help="also time a --stats-only run over the streaming history of this dir",
+    )
+    args = parser.parse_args()
+
+    commands = dict(COMMANDS)
+    if args.data_dir:
+        commands["app.py --stats-only"] = [
+            sys.executable,
+            "-c",
+            (
+                "import app;"
+                "app.load_logger();"
+                "app.run('UTC', app.get_locale('english'),"
+                f" data_dir={os.path.abspath(args.data_dir)!r}, use_cache=False,"
+                " output_path_dir=__import__('tempfile').mkdtemp(), stats_only=True)"
+            ),
+        ]
+
+    sys.exit(
+        main(
+            commands,
+            args.repeat,
+            args.max_seconds,
+            command_max_seconds={"app.py --stats-only": args.max_stats_seconds},
+        )
+    )
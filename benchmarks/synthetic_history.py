@@ -0,0 +1,131 @@
+"""Generate a synthetic Spotify streaming history to benchmark with.
+
+The plays follow a Zipf distribution over a catalog of tracks, and the tracks are
+assigned to artists with a Zipf distribution too, so a few artists and songs take
+most of the plays as in a real history. The plays are spread over a period of days
+with more plays in the afternoon and evening, and about a quarter of them are
+skipped after a few seconds. The same seed always gives the same files.
+
+The history is written as `StreamingHistory_music_<n>.json` files of
+`--plays-per-file` records, like the files of a Spotify export.
+
+Usage:
+    python benchmarks/synthetic_history.py path/to/dir [--plays 100000] [--seed 0]
+"""
+
+import argparse
+import json
+import os
+from datetime import date
+from typing import Optional
+
+import numpy as np
+
+PLAYS_PER_FILE = 10_000
+ZIPF_EXPONENT = 1.1
+# relative number of plays at each hour of the day, UTC
+HOUR_WEIGHTS = np.array(
+    [3, 2, 1, 1, 1, 1, 2, 4, 6, 7, 7, 8, 9, 9, 9, 10, 10, 11, 12, 12, 11, 9, 7, 5],
+    dtype=np.float64,
+)
+SKIP_RATIO = 0.25
+MIN_TRACK_MS, MAX_TRACK_MS = 120_000, 300_000
+MAX_SKIP_MS = 30_000
+
+
+def zipf_probabilities(size: int, exponent: float = ZIPF_EXPONENT) -> np.ndarray:
+    """Probability of each rank of a finite Zipf distribution, the first rank is the
+    most likely one."""
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+
+    return weights / weights.sum()
+
+
+def generate_history(
+    output_dir: str,
+    plays: int,
+    tracks: Optional[int] = None,
+    artists: Optional[int] = None,
+    days: int = 365,
+    start_date: date = date(2023, 1, 1),
+    seed: int = 0,
+    plays_per_file: int = PLAYS_PER_FILE,
+) -> int:
+    """Write a synthetic streaming history of `plays` plays in the output dir and
+    return the number of files written. By default the catalog has a track for
+    every 20 plays and an artist for every 8 tracks."""
+    rng = np.random.default_rng(seed)
+    tracks = tracks or max(200, plays // 20)
+    artists = artists or max(50, tracks // 8)
+
+    track_artists = rng.choice(artists, size=tracks, p=zipf_probabilities(artists))
+    track_lengths = rng.integers(MIN_TRACK_MS, MAX_TRACK_MS, size=tracks)
+
+    # minutes since the start date, sorted as in the exports
+    play_minutes = rng.integers(0, days, size=plays) * 24 * 60
+    play_minutes += rng.choice(24, size=plays, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum()) * 60
+    play_minutes += rng.integers(0, 60, size=plays)
+    play_minutes.sort()
+    end_times = np.datetime64(start_date, "m") + play_minutes
+
+    os.makedirs(output_dir, exist_ok=True)
+    track_probabilities = zipf_probabilities(tracks)
+    files = 0
+
+    for start in range(0, plays, plays_per_file):
+        file_end_times = np.datetime_as_string(
+            end_times[start : start + plays_per_file], unit="m"
+        )
+        size = len(file_end_times)
+        file_tracks = rng.choice(tracks, size=size, p=track_probabilities)
+        ms_played = np.where(
+            rng.random(size) < SKIP_RATIO,
+            rng.integers(500, MAX_SKIP_MS, size=size),
+            (track_lengths[file_tracks] * rng.uniform(0.6, 1.0, size=size)),
+        ).astype(np.int64)
+
+        records = [
+            {
+                "endTime": end_time.replace("T", " "),
+                "artistName": f"Artist {artist}",
+                "trackName": f"Track {track}",
+                "msPlayed": int(ms),
+            }
+            for end_time, artist, track, ms in zip(
+                file_end_times,
+                track_artists[file_tracks].tolist(),
+                file_tracks.tolist(),
+                ms_played.tolist(),
+            )
+        ]
+
+        file_path = os.path.join(output_dir, f"StreamingHistory_music_{files}.json")
+        with open(file_path, "w") as json_file:
+            json.dump(records, json_file)
+
+        files += 1
+
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("output_dir", type=str)
+    parser.add_argument("--plays", type=int, default=100_000)
+    parser.add_argument("--tracks", type=int, default=None)
+    parser.add_argument("--artists", type=int, default=None)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--plays-per-file", type=int, default=PLAYS_PER_FILE)
+    args = parser.parse_args()
+
+    files = generate_history(
+        args.output_dir,
+        plays=args.plays,
+        tracks=args.tracks,
+        artists=args.artists,
+        days=args.days,
+        seed=args.seed,
+        plays_per_file=args.plays_per_file,
+    )
+    print(f"{args.plays} plays written in {files} files to {args.output_dir}")
@@ -0,0 +1,78 @@
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from wrapy.constants import END_LOCAL_TIME_COL_NAME
+from wrapy.utils import (
+    add_local_calendar_columns,
+    convert_column_utc_datetime_to_local_time,
+    load_streaming_history_data,
+    sort_data_by_time,
+)
+
+TIMEZONE = "America/Mexico_City"
+
+
+def write_history(directory, records, name="StreamingHistory_music_0.json") -> str:
+    file_path = directory / name
+    file_path.write_text(json.dumps(records))
+
+    return str(file_path)
+
+
+def load_history(file_paths, timezone=TIMEZONE) -> pd.DataFrame:
+    """Load the files as `app.load_history` does, with the local time and calendar
+    columns, sorted by time."""
+    data = load_streaming_history_data(file_paths=file_paths)
+    data = convert_column_utc_datetime_to_local_time(
+        data=data,
+        new_tz=timezone,
+        column_name="endTime",
+        new_column_name=END_LOCAL_TIME_COL_NAME,
+    )
+    data = add_local_calendar_columns(data)
+
+    return sort_data_by_time(data, END_LOCAL_TIME_COL_NAME)
+
+
+def make_records(plays=600, tracks=25, artists=8, days=90, seed=0) -> list:
+    """Account schema records of a random history, a few songs take most of the
+    plays, about a third of the plays are short ones and some plays share the same
+    minute."""
+    rng = np.random.default_rng(seed)
+    track_artists = rng.integers(0, artists, size=tracks)
+    play_tracks = np.minimum(rng.geometric(0.15, size=plays) - 1, tracks - 1)
+    minutes = np.sort(rng.integers(0, days * 24 * 60, size=plays))
+    # repeat the minute of some plays, as in the exports with minute resolution
+    minutes[1::7] = minutes[0:-1:7]
+    ms_played = np.where(
+        rng.random(plays) < 0.35,
+        rng.integers(0, 30_000, size=plays),
+        rng.integers(60_000, 300_000, size=plays),
+    )
+    start = datetime(2023, 3, 1)
+
+    return [
+        {
+            "endTime": (start + timedelta(minutes=int(minute))).strftime(
+                "%Y-%m-%d %H:%M"
+            ),
+            "artistName": f"Artist {track_artists[track]}",
+            "trackName": f"Track {track}",
+            "msPlayed": int(ms),
+        }
+        for minute, track, ms in zip(minutes, play_tracks, ms_played)
+    ]
+
+
+@pytest.fixture
+def history_records() -> list:
+    return make_records()
+
+
+@pytest.fixture
+def history(tmp_path, history_records) -> pd.DataFrame:
+    return load_history([write_history(tmp_path, history_records)])
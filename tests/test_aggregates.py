@@ -0,0 +1,90 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+from conftest import TIMEZONE, load_history, write_history
+
+from wrapy.aggregates import (
+    HistoryCube,
+    aggregate_history_in_chunks,
+    count_transitions_in_chunks,
+    summarize_history,
+)
+from wrapy.constants import END_LOCAL_TIME_COL_NAME
+from wrapy.utils import Period, filter_data_by_dates, parse_period
+
+
+def assert_same_summary(summary, expected):
+    assert summary.stats == expected.stats
+    assert summary.plays_per_groups == expected.plays_per_groups
+    pd.testing.assert_frame_equal(summary.top_songs, expected.top_songs)
+    pd.testing.assert_series_equal(summary.top_artists, expected.top_artists)
+    pd.testing.assert_frame_equal(
+        summary.top_songs_per_hour, expected.top_songs_per_hour
+    )
+    pd.testing.assert_frame_equal(summary.transitions.songs, expected.transitions.songs)
+    pd.testing.assert_frame_equal(summary.transitions.edges, expected.transitions.edges)
+
+
+@pytest.fixture
+def history_files(tmp_path, history_records):
+    """The history split in files numbered as the exports, 10 after 2."""
+    return [
+        write_history(
+            tmp_path,
+            history_records[start : start + 200],
+            f"StreamingHistory_{number}.json",
+        )
+        for start, number in zip(range(0, len(history_records), 200), [1, 2, 10])
+    ]
+
+
+@pytest.mark.parametrize(
+    "dates", [(None, None), (date(2023, 3, 20), date(2023, 4, 30))]
+)
+def test_chunked_summary_matches_the_summary_of_the_whole_history(history_files, dates):
+    history = load_history(history_files)
+    if dates[0]:
+        history = filter_data_by_dates(history, END_LOCAL_TIME_COL_NAME, *dates)
+
+    aggregates = aggregate_history_in_chunks(history_files[::-1], TIMEZONE, 45, *dates)
+    transitions = count_transitions_in_chunks(
+        history_files, aggregates.transition_songs(), TIMEZONE, 45, *dates
+    )
+
+    assert_same_summary(aggregates.summarize(transitions), summarize_history(history))
+
+
+@pytest.mark.parametrize(
+    "period_str",
+    ["2023", "2023-03", "2023-q2", "2023-03-15:2023-04-15", "2023-04-02:2023-04-02"],
+)
+def test_cube_summary_of_a_period_matches_the_summary_of_its_plays(history, period_str):
+    period = parse_period(period_str)
+    plays = filter_data_by_dates(
+        history, END_LOCAL_TIME_COL_NAME, period.start_date, period.end_date
+    )
+
+    cube = HistoryCube(history)
+
+    assert cube.count_plays(period.start_date, period.end_date) == len(plays)
+    assert_same_summary(
+        cube.summarize(period.start_date, period.end_date), summarize_history(plays)
+    )
+
+
+def test_parse_period():
+    assert parse_period("2023") == Period("2023", date(2023, 1, 1), date(2023, 12, 31))
+    assert parse_period("2023-q1") == Period(
+        "2023-Q1", date(2023, 1, 1), date(2023, 3, 31)
+    )
+    assert parse_period("2024-02") == Period(
+        "2024-02", date(2024, 2, 1), date(2024, 2, 29)
+    )
+    assert parse_period("2023-03-15:2023-04-15") == Period(
+        "2023-03-15_2023-04-15", date(2023, 3, 15), date(2023, 4, 15)
+    )
+
+    for period_str in ["2023-13", "2023-Q5", "2023-04-15:2023-03-15"]:
+        with pytest.raises(ValueError):
+            parse_period(period_str)
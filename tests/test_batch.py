@@ -0,0 +1,41 @@
+import os
+import time
+
+import batch
+from batch import UserExport, run_batch
+
+
+def wrap_or_die(export: UserExport) -> dict:
+    """Stand-in for `generate_user_wrap` whose worker dies on the crashing users,
+    as when it's killed for running out of memory."""
+    if export.user_id.startswith("crash"):
+        os._exit(1)
+
+    return batch._wrap_result(export, time.perf_counter(), None)
+
+
+def make_exports(user_ids):
+    return [
+        UserExport(
+            user_id=user_id,
+            data_dir=user_id,
+            output_path_dir=user_id,
+            lang="english",
+            timezone="UTC",
+        )
+        for user_id in user_ids
+    ]
+
+
+def test_run_batch_reports_the_users_whose_worker_dies(monkeypatch):
+    monkeypatch.setattr(batch, "generate_user_wrap", wrap_or_die)
+    user_ids = ["user_0", "crash_0", "user_1", "user_2", "crash_1", "user_3"]
+
+    results = run_batch(make_exports(user_ids), workers=2, tasks_per_worker=2)
+
+    statuses = {result["user_id"]: result["status"] for result in results}
+    assert len(results) == len(user_ids)
+    assert statuses == {
+        user_id: "failed" if user_id.startswith("crash") else "done"
+        for user_id in user_ids
+    }
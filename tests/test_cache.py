@@ -0,0 +1,79 @@
+import os
+
+import pandas as pd
+from conftest import TIMEZONE, write_history
+
+from wrapy import cache
+from wrapy.cache import (
+    HistoryCache,
+    build_cache_key,
+    file_fingerprint,
+    indexed_fingerprints,
+)
+
+
+def test_indexed_fingerprints_hash_only_the_changed_files(tmp_path, monkeypatch):
+    file_paths = [
+        write_history(tmp_path, [{"msPlayed": number}], f"history_{number}.json")
+        for number in range(3)
+    ]
+    index = {}
+    fingerprints, index_changed = indexed_fingerprints(file_paths, index)
+
+    assert index_changed
+    assert fingerprints == [file_fingerprint(file_path) for file_path in file_paths]
+
+    hashed = []
+
+    def counted_fingerprint(file_path):
+        hashed.append(file_path)
+        return file_fingerprint(file_path)
+
+    monkeypatch.setattr(cache, "file_fingerprint", counted_fingerprint)
+    write_history(tmp_path, [{"msPlayed": 10}], "history_1.json")
+    os.utime(file_paths[1], ns=(0, 0))
+
+    fingerprints, index_changed = indexed_fingerprints(file_paths, index)
+
+    assert index_changed
+    assert hashed == [file_paths[1]]
+    assert fingerprints[1] == file_fingerprint(file_paths[1])
+    assert indexed_fingerprints(file_paths, index) == (fingerprints, False)
+
+
+def test_history_cache_gets_the_history_put_under_its_key(tmp_path, history):
+    cache = HistoryCache(str(tmp_path / "cache"))
+    file_path = write_history(tmp_path, [{"msPlayed": 1}])
+    fingerprints = cache.fingerprints([file_path])
+    key = build_cache_key(fingerprints, TIMEZONE)
+
+    assert cache.get(key) is None
+    cache.put(key, history, fingerprints, TIMEZONE)
+    pd.testing.assert_frame_equal(cache.get(key), history)
+
+    # a new content of the source makes a new key, which replaces the stale entry
+    write_history(tmp_path, [{"msPlayed": 2}])
+    os.utime(file_path, ns=(0, 0))
+    new_fingerprints = cache.fingerprints([file_path])
+    new_key = build_cache_key(new_fingerprints, TIMEZONE)
+    assert new_key != key
+    assert build_cache_key(new_fingerprints, "UTC") != new_key
+
+    cache.put(new_key, history.iloc[:10], new_fingerprints, TIMEZONE)
+    assert cache.get(key) is None
+    pd.testing.assert_frame_equal(cache.get(new_key), history.iloc[:10])
+
+
+def test_history_cache_evicts_the_old_entries_but_not_the_new_one(tmp_path, history):
+    cache = HistoryCache(str(tmp_path / "cache"), max_bytes=1)
+    keys = []
+
+    for number in range(3):
+        file_path = write_history(tmp_path, [{"msPlayed": number}], f"{number}.json")
+        fingerprints = cache.fingerprints([file_path])
+        keys.append(build_cache_key(fingerprints, TIMEZONE))
+        cache.put(keys[-1], history, fingerprints, TIMEZONE)
+
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[1]) is None
+    pd.testing.assert_frame_equal(cache.get(keys[2]), history)
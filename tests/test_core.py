@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from wrapy.constants import ALLOWED_X_TARGETS, END_LOCAL_TIME_COL_NAME
+from wrapy.core import (
+    StatsEngine,
+    _count_code_groups,
+    count_plays_per_x,
+    generate_plays_to_x_map,
+    get_top_artists,
+    get_top_songs,
+    get_top_songs_per_hour,
+    get_transition_counts,
+    top_k_indices,
+)
+
+
+def pandas_keys_per_x(data: pd.DataFrame) -> dict:
+    timestamps = data[END_LOCAL_TIME_COL_NAME].dt
+
+    return {
+        "hour": timestamps.hour,
+        "weekday": timestamps.weekday,
+        "month": timestamps.month,
+        "day_of_year": timestamps.dayofyear,
+        "hour_weekday": timestamps.weekday * 24 + timestamps.hour,
+    }
+
+
+def test_count_plays_per_x_matches_value_counts(history):
+    counts = count_plays_per_x(history, ALLOWED_X_TARGETS, END_LOCAL_TIME_COL_NAME)
+
+    for target_name, keys in pandas_keys_per_x(history).items():
+        target_counts = counts[target_name]
+        (present_keys,) = np.nonzero(target_counts)
+
+        assert dict(zip(present_keys, target_counts[present_keys])) == (
+            keys.value_counts().to_dict()
+        )
+
+
+def test_generate_plays_to_x_map_matches_value_counts(history):
+    groups = generate_plays_to_x_map(
+        history, {"hour", "weekday", "month"}, END_LOCAL_TIME_COL_NAME
+    )
+    keys_per_x = pandas_keys_per_x(history)
+
+    assert groups.keys() == {"hour", "weekday", "month"}
+    for target_name, plays in groups.items():
+        assert plays == sorted(keys_per_x[target_name].value_counts().items())
+
+
+SKIP_THRESHOLDS = [0, 10_000, 30_000, 60_000]
+
+
+def test_stats_engine_matches_pandas(history):
+    stats = StatsEngine(SKIP_THRESHOLDS, END_LOCAL_TIME_COL_NAME).compute(history)
+
+    assert stats.total_plays == len(history)
+    assert stats.total_ms == history["msPlayed"].sum()
+    assert stats.skips == {
+        threshold: (history["msPlayed"] < threshold).sum()
+        for threshold in SKIP_THRESHOLDS
+    }
+    assert stats.unique_songs == history["trackName"].nunique()
+    assert stats.unique_artists == history["artistName"].nunique()
+    assert stats.start == history[END_LOCAL_TIME_COL_NAME].min()
+    assert stats.end == history[END_LOCAL_TIME_COL_NAME].max()
+
+
+def test_stats_engine_counts_the_skipped_flags_when_known(history):
+    # the extended history flags some plays, the others are judged by time played
+    rng = np.random.default_rng(0)
+    flags = pd.Series(rng.random(len(history)) < 0.5, dtype="boolean")
+    flags[rng.random(len(history)) < 0.3] = pd.NA
+    history["skipped"] = flags.array
+
+    stats = StatsEngine(SKIP_THRESHOLDS, END_LOCAL_TIME_COL_NAME).compute(history)
+
+    assert stats.skips == {
+        threshold: flags.fillna(history["msPlayed"] < threshold).sum()
+        for threshold in SKIP_THRESHOLDS
+    }
+
+
+def pandas_group_counts(data: pd.DataFrame, columns: list) -> pd.Series:
+    """Plays of every group of the columns, in order of first appearance."""
+    return data[columns].astype(object).groupby(columns, sort=False).size()
+
+
+def pandas_top_counts(counts: pd.Series, k_top: int) -> pd.Series:
+    return counts.sort_values(ascending=False, kind="stable").head(k_top)
+
+
+@pytest.mark.parametrize("k_top", [0, 1, 5, 30, 100])
+def test_top_k_indices_matches_a_stable_sort(k_top):
+    # few distinct counts, so most of them are tied
+    counts = np.random.default_rng(0).integers(0, 8, size=50)
+
+    np.testing.assert_array_equal(
+        top_k_indices(counts, k_top), np.argsort(-counts, kind="stable")[:k_top]
+    )
+
+
+def test_count_code_groups_matches_groupby():
+    rng = np.random.default_rng(0)
+    codes = [rng.integers(-1, 4, size=200), rng.integers(-1, 6, size=200)]
+    pairs = pd.DataFrame({"a": codes[0], "b": codes[1]})
+
+    play_groups, (group_a, group_b), counts = _count_code_groups(codes, [4, 6])
+
+    expected = pandas_group_counts(pairs[(pairs >= 0).all(axis=1)], ["a", "b"])
+    assert list(zip(group_a, group_b)) == list(expected.index)
+    np.testing.assert_array_equal(counts, expected.to_numpy())
+    valid = play_groups >= 0
+    np.testing.assert_array_equal(valid, (pairs >= 0).all(axis=1).to_numpy())
+    assert list(zip(group_a[play_groups[valid]], group_b[play_groups[valid]])) == (
+        list(pairs[valid].itertuples(index=False, name=None))
+    )
+
+
+def test_top_songs_and_artists_match_pandas(history):
+    top_songs = get_top_songs(history, 5)
+    top_artists = get_top_artists(history, 5)
+
+    expected_songs = pandas_top_counts(
+        pandas_group_counts(history, ["trackName", "artistName"]), 5
+    )
+    expected_artists = pandas_top_counts(
+        pandas_group_counts(history, ["artistName"]), 5
+    )
+    assert list(top_songs.itertuples(index=False, name=None)) == [
+        (*song, plays) for song, plays in expected_songs.items()
+    ]
+    assert top_artists.to_dict() == expected_artists.to_dict()
+    assert list(top_artists.index) == list(expected_artists.index)
+
+
+@pytest.mark.parametrize("n_top", [1, 3])
+def test_top_songs_per_hour_match_pandas(history, n_top):
+    top = get_top_songs_per_hour(history, n_top, END_LOCAL_TIME_COL_NAME)
+
+    plays = history.assign(hour=history[END_LOCAL_TIME_COL_NAME].dt.hour)
+    counts = pandas_group_counts(plays, ["hour", "trackName", "artistName"])
+    expected = (
+        counts.rename("plays")
+        .reset_index()
+        .sort_values(["hour", "plays"], ascending=[True, False], kind="stable")
+        .groupby("hour")
+        .head(n_top)
+    )
+    assert list(top.itertuples(index=False, name=None)) == list(
+        expected.itertuples(index=False, name=None)
+    )
+
+
+def pandas_transitions(data: pd.DataFrame, k_top: int) -> dict:
+    """Transitions between the top songs as the first version of `gen_top_k_graph`
+    counted them: the plays of the top songs in time order, each one followed by
+    the next one, the plays of the other songs in between ignored."""
+    data = data.sort_values(END_LOCAL_TIME_COL_NAME, kind="stable")
+    songs = list(zip(data["trackName"].astype(object), data["artistName"]))
+    top_songs = pandas_top_counts(
+        pandas_group_counts(data, ["trackName", "artistName"]), k_top
+    ).index
+    top_plays = pd.Series([song for song in songs if song in set(top_songs)])
+
+    return (
+        pd.DataFrame({"source": top_plays, "target": top_plays.shift(-1)})
+        .dropna()
+        .groupby(["source", "target"])
+        .size()
+        .to_dict()
+    )
+
+
+@pytest.mark.parametrize("k_top", [3, 7, 15])
+def test_transition_counts_match_pandas(history, k_top):
+    shuffled = history.sample(frac=1, random_state=0)
+
+    for plays in (history, shuffled):
+        transitions = get_transition_counts(plays, k_top, END_LOCAL_TIME_COL_NAME)
+
+        songs = list(
+            transitions.songs[["trackName", "artistName"]].itertuples(
+                index=False, name=None
+            )
+        )
+        edges = transitions.edges
+        assert {
+            (songs[source], songs[target]): weight
+            for source, target, weight in edges.itertuples(index=False)
+        } == pandas_transitions(plays, k_top)
+        assert list(zip(edges["source"], edges["target"])) == sorted(
+            zip(edges["source"], edges["target"])
+        )
@@ -0,0 +1,176 @@
+import json
+
+import pandas as pd
+import pytest
+from conftest import load_history, make_records, write_history
+
+from wrapy.aggregates import STATE_VERSION, HistoryAggregates, WrapState
+from wrapy.constants import END_LOCAL_TIME_COL_NAME, K_TOP_SONGS_GRAPH
+from wrapy.core import get_transition_counts
+from wrapy.custom_exceptions import ValidationError
+from wrapy.utils import (
+    add_local_calendar_columns,
+    convert_column_utc_datetime_to_local_time,
+    load_streaming_history_data,
+)
+
+TIMEZONE = "America/Mexico_City"
+# account exports have minute resolution, the last plays share the same minute
+PLAYS = [
+    ("2023-07-02 16:58", "Artist 1", "Track 1", 180000),
+    ("2023-07-02 17:01", "Artist 2", "Track 2", 120000),
+    ("2023-07-02 17:02", "Artist 1", "Track 1", 30000),
+    ("2023-07-02 17:03", "Artist 3", "Track 3", 20000),
+    ("2023-07-02 17:03", "Artist 3", "Track 3", 20000),
+    ("2023-07-02 17:03", "Artist 2", "Track 2", 15000),
+    ("2023-07-02 17:03", "Artist 1", "Track 1", 25000),
+    ("2023-07-02 17:07", "Artist 3", "Track 3", 240000),
+]
+# the first export ends in the middle of 17:03
+SPLIT = 5
+
+
+def load_plays(tmp_path, name, plays):
+    file_path = tmp_path / f"StreamingHistory_music_{name}.json"
+    records = [
+        {"endTime": end_time, "artistName": artist, "trackName": track, "msPlayed": ms}
+        for end_time, artist, track, ms in plays
+    ]
+    file_path.write_text(json.dumps(records))
+
+    data = load_streaming_history_data(file_paths=[str(file_path)])
+    data = convert_column_utc_datetime_to_local_time(
+        data=data,
+        new_tz=TIMEZONE,
+        column_name="endTime",
+        new_column_name=END_LOCAL_TIME_COL_NAME,
+    )
+
+    return add_local_calendar_columns(data)
+
+
+@pytest.mark.parametrize(
+    "second_export",
+    [PLAYS[SPLIT:], PLAYS],
+    ids=["consecutive exports", "overlapping exports"],
+)
+def test_fold_keeps_the_new_plays_of_the_last_minute(tmp_path, second_export):
+    state = WrapState(TIMEZONE)
+    state.fold(load_plays(tmp_path, 0, PLAYS[:SPLIT]))
+    folded = state.fold(load_plays(tmp_path, 1, second_export))
+
+    assert folded.shape[0] == len(PLAYS) - SPLIT
+    assert state.aggregates.total_plays == len(PLAYS)
+
+    expected = load_plays(tmp_path, "all", PLAYS)
+    assert state.aggregates.stats() == HistoryAggregates.from_history(expected).stats()
+    transitions = state.aggregates.transitions(state.transitions)
+    expected_transitions = get_transition_counts(expected, 15, END_LOCAL_TIME_COL_NAME)
+    pd.testing.assert_frame_equal(transitions.songs, expected_transitions.songs)
+    pd.testing.assert_frame_equal(transitions.edges, expected_transitions.edges)
+
+
+def test_fold_skips_an_export_already_folded(tmp_path):
+    state = WrapState(TIMEZONE)
+    state.fold(load_plays(tmp_path, 0, PLAYS))
+    folded = state.fold(load_plays(tmp_path, 1, PLAYS))
+
+    assert folded.shape[0] == 0
+    assert state.aggregates.total_plays == len(PLAYS)
+
+
+def test_fold_warns_of_the_plays_before_the_last_one_folded(tmp_path, caplog):
+    state = WrapState(TIMEZONE)
+    state.fold(load_plays(tmp_path, 0, PLAYS[3:]))
+    folded = state.fold(load_plays(tmp_path, 1, PLAYS[:3]))
+
+    assert folded.shape[0] == 0
+    assert state.aggregates.total_plays == len(PLAYS) - 3
+    assert "3 plays of the new files are before the last play folded" in caplog.text
+
+
+@pytest.fixture
+def exports(tmp_path):
+    """Three consecutive exports, the songs of the last two are new so every one of
+    them changes the top songs."""
+    records = make_records(plays=900)
+    for position, record in enumerate(records[300:]):
+        export = 1 if position < 300 else 2
+        record["trackName"] = f"Export {export} {record['trackName']}"
+
+    return [
+        load_history([write_history(tmp_path, records[start : start + 300], name)])
+        for start, name in [
+            (0, "first.json"),
+            (300, "second.json"),
+            (600, "third.json"),
+        ]
+    ], load_history([write_history(tmp_path, records, "all.json")])
+
+
+def assert_same_summary(state, data):
+    summary = state.aggregates.summarize(state.transitions)
+    expected = get_transition_counts(data, K_TOP_SONGS_GRAPH, END_LOCAL_TIME_COL_NAME)
+
+    assert summary.stats == HistoryAggregates.from_history(data).stats()
+    pd.testing.assert_frame_equal(summary.transitions.songs, expected.songs)
+    pd.testing.assert_frame_equal(summary.transitions.edges, expected.edges)
+
+
+def sources_loader(parts):
+    """`WrapState.fold` loader of the exports, their hashes are their positions."""
+    return lambda hashes: pd.concat([parts[int(hash_)] for hash_ in hashes])
+
+
+def test_fold_counts_the_transitions_again_when_the_top_songs_change(exports):
+    parts, data = exports
+    state = WrapState(TIMEZONE)
+
+    for number, part in enumerate(parts):
+        top_songs = set(state.transitions.songs)
+        state.fold(part, [str(number)], sources_loader(parts))
+        assert set(state.transitions.songs) != top_songs
+
+    assert state.folds == [["0"], ["1"], ["2"]]
+    assert_same_summary(state, data)
+
+
+def test_fold_keeps_the_top_songs_without_the_previous_files(exports, caplog):
+    parts, _ = exports
+    state = WrapState(TIMEZONE)
+    state.fold(parts[0], ["0"])
+    top_songs = state.transitions.songs
+
+    state.fold(parts[1], ["1"], lambda hashes: None)
+
+    assert state.transitions.songs == top_songs
+    assert "no longer available" in caplog.text
+
+
+def test_state_is_saved_and_loaded(tmp_path, exports):
+    parts, data = exports
+    path = str(tmp_path / "state.json")
+    state = WrapState(TIMEZONE)
+    state.fold(parts[0], ["0"])
+    state.fold(parts[1], ["1"], sources_loader(parts))
+    state.output_digests = {"stats.txt": "digest"}
+    state.save(path)
+
+    state = WrapState.load(path, TIMEZONE)
+    state.fold(parts[2], ["2"], sources_loader(parts))
+
+    assert state.source_hashes == {"0", "1", "2"}
+    assert state.output_digests == {"stats.txt": "digest"}
+    assert_same_summary(state, data)
+
+
+def test_load_rejects_a_state_of_another_version_or_timezone(tmp_path):
+    path = tmp_path / "state.json"
+    WrapState(TIMEZONE).save(str(path))
+
+    with pytest.raises(ValidationError):
+        WrapState.load(str(path), "UTC")
+
+    path.write_text(json.dumps({"version": STATE_VERSION - 1}))
+    with pytest.raises(ValidationError):
+        WrapState.load(str(path), TIMEZONE)
@@ -0,0 +1,256 @@
+import io
+import json
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import load_history, make_records, write_history
+
+from wrapy.constants import (
+    END_LOCAL_TIME_COL_NAME,
+    LOCAL_CALENDAR_COLUMNS,
+    LOCAL_DATE_COL_NAME,
+)
+from wrapy.core import count_plays_per_x, get_top_songs_per_hour
+from wrapy.utils import (
+    add_local_calendar_columns,
+    detect_history_schema,
+    filter_data_by_dates,
+    iter_json_array,
+    load_streaming_history_data,
+    slice_data_by_dates,
+)
+
+
+def test_load_streaming_history_data_matches_the_records(tmp_path, history_records):
+    # a file with songs of its own, so the categories of the files differ
+    other_records = make_records(plays=50, tracks=5, artists=2, seed=1)
+    for record in other_records:
+        record["trackName"] = f"Other {record['trackName']}"
+    file_paths = [
+        write_history(tmp_path, history_records, "StreamingHistory_music_0.json"),
+        write_history(tmp_path, other_records, "StreamingHistory_music_1.json"),
+    ]
+
+    data = load_streaming_history_data(file_paths=file_paths)
+
+    expected = pd.DataFrame(history_records + other_records)
+    expected["endTime"] = pd.to_datetime(expected["endTime"], utc=True)
+    assert data.dtypes["artistName"] == "category"
+    assert data.dtypes["trackName"] == "category"
+    assert data.dtypes["msPlayed"] == np.int32
+    assert data["skipped"].isna().all()
+    pd.testing.assert_frame_equal(
+        data[expected.columns].astype({"artistName": object, "trackName": object}),
+        expected.astype({"msPlayed": np.int32}),
+    )
+
+
+def extended_records(records: list) -> list:
+    """The records as the extended streaming history has them, with a podcast
+    episode every tenth play and the `skipped` flag known for half of them."""
+    extended = []
+
+    for position, record in enumerate(records):
+        is_episode = position % 10 == 9
+        extended.append(
+            {
+                "ts": record["endTime"].replace(" ", "T") + ":00Z",
+                "platform": "android",
+                "ms_played": record["msPlayed"],
+                "master_metadata_track_name": (
+                    None if is_episode else record["trackName"]
+                ),
+                "master_metadata_album_artist_name": (
+                    None if is_episode else record["artistName"]
+                ),
+                "episode_name": f"Episode {position}" if is_episode else None,
+                "reason_end": "fwdbtn",
+                "skipped": [None, True, False, None][position % 4],
+                "offline": False,
+            }
+        )
+
+    return extended
+
+
+def test_detect_history_schema(history_records):
+    assert detect_history_schema(history_records[0]).name == "account"
+    assert (
+        detect_history_schema(extended_records(history_records)[0]).name == "extended"
+    )
+
+    with pytest.raises(ValueError):
+        detect_history_schema({"endTime": "2023-03-01 04:08", "msPlayed": 1})
+
+
+def test_load_streaming_history_data_of_the_extended_history(tmp_path, history_records):
+    records = extended_records(history_records)
+    file_path = write_history(tmp_path, records, "Streaming_History_Audio_2023.json")
+
+    data = load_streaming_history_data(file_paths=[file_path])
+
+    expected = pd.DataFrame(records)
+    expected = expected[expected["master_metadata_track_name"].notna()]
+    assert data.shape[0] == len(history_records) - len(history_records) // 10
+    pd.testing.assert_series_equal(
+        data["endTime"],
+        pd.to_datetime(expected["ts"], utc=True).reset_index(drop=True),
+        check_names=False,
+    )
+    assert data["trackName"].tolist() == expected["master_metadata_track_name"].tolist()
+    assert data["artistName"].tolist() == (
+        expected["master_metadata_album_artist_name"].tolist()
+    )
+    assert data["msPlayed"].tolist() == expected["ms_played"].tolist()
+    assert data["skipped"].tolist() == [
+        pd.NA if skipped is None else skipped for skipped in expected["skipped"]
+    ]
+
+
+def test_local_calendar_columns_match_the_local_times(tmp_path, history_records):
+    # a timezone with daylight saving time, which changed on 2023-03-26
+    history = load_history([write_history(tmp_path, history_records)], "Europe/Madrid")
+    timestamps = history[END_LOCAL_TIME_COL_NAME].dt
+
+    assert history["localHour"].tolist() == timestamps.hour.tolist()
+    assert history["localWeekday"].tolist() == timestamps.weekday.tolist()
+    assert history["localMonth"].tolist() == timestamps.month.tolist()
+    pd.testing.assert_series_equal(
+        history[LOCAL_DATE_COL_NAME],
+        timestamps.tz_localize(None).dt.normalize(),
+        check_names=False,
+    )
+    assert history[LOCAL_DATE_COL_NAME].dt.date.tolist() == timestamps.date.tolist()
+
+
+def test_counts_are_the_same_without_the_local_calendar_columns(history):
+    without_columns = history.drop(
+        columns=[*LOCAL_CALENDAR_COLUMNS.values(), LOCAL_DATE_COL_NAME]
+    )
+    targets = {"hour", "weekday", "month", "hour_weekday"}
+
+    counts = count_plays_per_x(history, targets, END_LOCAL_TIME_COL_NAME)
+    expected = count_plays_per_x(without_columns, targets, END_LOCAL_TIME_COL_NAME)
+    for target_name in targets:
+        np.testing.assert_array_equal(counts[target_name], expected[target_name])
+
+    pd.testing.assert_frame_equal(
+        get_top_songs_per_hour(history, 2, END_LOCAL_TIME_COL_NAME),
+        get_top_songs_per_hour(without_columns, 2, END_LOCAL_TIME_COL_NAME),
+        check_dtype=False,
+    )
+    pd.testing.assert_frame_equal(
+        add_local_calendar_columns(without_columns.copy()), history
+    )
+
+
+@pytest.fixture
+def sorted_and_shuffled(tmp_path):
+    # UTC times of the plays around the local days of the window (UTC-6)
+    end_times = [
+        "2023-03-15 05:59",  # 2023-03-14 23:59
+        "2023-03-15 06:00",  # 2023-03-15 00:00
+        "2023-04-01 12:00",
+        "2023-04-15 06:00",  # 2023-04-15 00:00
+        "2023-04-16 05:59",  # 2023-04-15 23:59
+        "2023-04-16 06:00",  # 2023-04-16 00:00
+    ]
+    records = [
+        {"endTime": end_time, "artistName": "A", "trackName": "T", "msPlayed": 1000}
+        for end_time in end_times
+    ]
+    data = load_history([write_history(tmp_path, records)])
+    shuffled = data.iloc[[4, 0, 5, 2, 1, 3]]
+    assert not shuffled[END_LOCAL_TIME_COL_NAME].is_monotonic_increasing
+
+    return data, shuffled
+
+
+def test_filter_data_by_dates_includes_the_whole_end_day(sorted_and_shuffled):
+    data, shuffled = sorted_and_shuffled
+
+    # the sorted plays are sliced with a binary search, the others with a mask
+    for plays in (data, shuffled):
+        filtered = filter_data_by_dates(
+            plays, END_LOCAL_TIME_COL_NAME, date(2023, 3, 15), date(2023, 4, 15)
+        )
+
+        assert sorted(filtered.index) == [1, 2, 3, 4]
+
+
+def test_filter_data_by_dates_of_a_single_day(sorted_and_shuffled):
+    data, shuffled = sorted_and_shuffled
+
+    for plays in (data, shuffled):
+        filtered = filter_data_by_dates(
+            plays, END_LOCAL_TIME_COL_NAME, date(2023, 4, 15), date(2023, 4, 15)
+        )
+
+        assert sorted(filtered.index) == [3, 4]
+
+
+def test_filter_data_by_dates_matches_a_filter_by_local_day(history):
+    start_date, end_date = date(2023, 3, 20), date(2023, 4, 10)
+    days = history[END_LOCAL_TIME_COL_NAME].dt.date
+    expected = history[(days >= start_date) & (days <= end_date)]
+
+    filtered = filter_data_by_dates(
+        history, END_LOCAL_TIME_COL_NAME, start_date, end_date
+    )
+    masked = filter_data_by_dates(
+        history.iloc[::-1], END_LOCAL_TIME_COL_NAME, start_date, end_date
+    )
+
+    pd.testing.assert_frame_equal(filtered, expected)
+    pd.testing.assert_frame_equal(masked.sort_index(), expected)
+
+
+def test_slice_data_by_dates_matches_a_filter_by_local_day(history):
+    windows = [
+        (date(2023, 3, 1), date(2023, 5, 29)),
+        (date(2023, 3, 20), date(2023, 4, 10)),
+        (date(2023, 4, 1), date(2023, 4, 30)),
+        (date(2023, 4, 2), date(2023, 4, 2)),
+        (date(2023, 2, 1), date(2023, 2, 28)),
+        (date(2023, 5, 20), date(2023, 6, 30)),
+    ]
+    days = history[END_LOCAL_TIME_COL_NAME].dt.date
+
+    slices = slice_data_by_dates(history, END_LOCAL_TIME_COL_NAME, windows)
+
+    assert len(slices) == len(windows)
+    for plays, (start_date, end_date) in zip(slices, windows):
+        pd.testing.assert_frame_equal(
+            plays, history[(days >= start_date) & (days <= end_date)]
+        )
+
+
+JSON_ITEMS = [
+    {"trackName": "Brackets }, {", "artistName": 'Quote \\" }', "msPlayed": 1},
+    {"trackName": "Ünïcode ]", "nested": {"a": [1, {"b": "}"}]}, "msPlayed": 2},
+    {},
+    1234567890,
+    "} ,",
+    [{"c": None}],
+    {"trackName": "Last", "msPlayed": 3},
+]
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 7, 16, 50, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_iter_json_array_matches_json_loads(block_size, indent):
+    text = json.dumps(JSON_ITEMS, indent=indent, ensure_ascii=False)
+    json_file = io.StringIO(text)
+    json_file.name = "items.json"
+
+    assert list(iter_json_array(json_file, block_size=block_size)) == JSON_ITEMS
+
+
+def test_iter_json_array_rejects_a_cut_array():
+    json_file = io.StringIO(json.dumps(JSON_ITEMS)[:-5])
+    json_file.name = "items.json"
+
+    with pytest.raises(ValueError):
+        list(iter_json_array(json_file, block_size=16))
@@ -0,0 +1,1018 @@
+import json
+import logging
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from wrapy.constants import (
+    ALLOWED_X_TARGETS,
+    END_LOCAL_TIME_COL_NAME,
+    HISTORY_CHUNK_SIZE,
+    K_TOP_ARTISTS,
+    K_TOP_SONGS,
+    K_TOP_SONGS_GRAPH,
+    LOCAL_DATE_COL_NAME,
+    SKIP_MS_TOLERANCE,
+    X_TARGET_BINS,
+)
+from wrapy.core import (
+    StatsEngine,
+    TransitionCounts,
+    WrapStats,
+    count_groups,
+    count_plays_per_x,
+    generate_plays_to_x_map,
+    get_calendar_fields,
+    get_song_groups,
+    get_top_artists,
+    get_top_songs,
+    get_top_songs_per_hour,
+    get_transition_counts,
+    is_skipped,
+    plays_to_x_map_from_counts,
+    top_k_indices,
+    top_k_indices_per_group,
+)
+from wrapy.custom_exceptions import ValidationError
+from wrapy.utils import (
+    add_local_calendar_columns,
+    convert_column_utc_datetime_to_local_time,
+    filter_data_by_dates,
+    iter_streaming_history_chunks,
+    sort_data_by_time,
+)
+
+SONG_COLUMNS = ["trackName", "artistName"]
+HOUR_SONG_COLUMNS = ["hour", "trackName", "artistName"]
+PLAY_KEY_COLUMNS = ["trackName", "artistName", "msPlayed"]
+WRAP_X_TARGETS = {"hour", "month", "weekday"}
+STATE_VERSION = 6
+
+logger = logging.getLogger("wrapy")
+
+
+@dataclass
+class WrapSummary:
+    """Aggregated inputs of every stat, card and chart of a wrap."""
+
+    stats: WrapStats
+    plays_per_groups: Dict[str, List[tuple]]
+    # the K_TOP_SONGS most played songs
+    top_songs: pd.DataFrame
+    # the K_TOP_ARTISTS most played artists
+    top_artists: pd.Series
+    # the most played song of each hour, see `get_top_songs_per_hour`
+    top_songs_per_hour: pd.DataFrame
+    # transitions between the K_TOP_SONGS_GRAPH most played songs
+    transitions: TransitionCounts
+
+
+def summarize_history(
+    data: pd.DataFrame, timestamp_col: str = END_LOCAL_TIME_COL_NAME
+) -> WrapSummary:
+    """Compute the summary of a wrap from the whole streaming history."""
+    return WrapSummary(
+        stats=StatsEngine(timestamp_column=timestamp_col).compute(data),
+        plays_per_groups=generate_plays_to_x_map(data, WRAP_X_TARGETS, timestamp_col),
+        top_songs=get_top_songs(data, K_TOP_SONGS),
+        top_artists=get_top_artists(data, K_TOP_ARTISTS),
+        top_songs_per_hour=get_top_songs_per_hour(data, 1, timestamp_col),
+        transitions=get_transition_counts(data, K_TOP_SONGS_GRAPH, timestamp_col),
+    )
+
+
+def _group_counts(data: pd.DataFrame, columns: List[str]) -> pd.Series:
+    """Plays of each distinct combination of values of the columns, indexed by them
+    in order of first appearance."""
+    return count_groups(data, columns).set_index(columns)["plays"]
+
+
+def _add_counts(counts: Optional[pd.Series], other: Optional[pd.Series]):
+    """Add the counts of the plays that come after the plays of `counts`. The keys
+    keep their order of first appearance, which breaks the ties of the top ones as
+    `count_top_k_groups` does, instead of the sorted order of `Series.add`."""
+    if counts is None:
+        return other
+    if other is None:
+        return counts
+
+    index = counts.index.append(other.index.difference(counts.index, sort=False))
+
+    return (
+        counts.add(other, fill_value=0).reindex(index).astype(np.int64).rename("plays")
+    )
+
+
+def _counts_to_rows(counts: Optional[pd.Series]) -> Optional[dict]:
+    if counts is None:
+        return None
+
+    return counts.reset_index().to_dict(orient="split", index=False)
+
+
+def _counts_from_rows(rows: Optional[dict]) -> Optional[pd.Series]:
+    if rows is None:
+        return None
+
+    counts = pd.DataFrame(rows["data"], columns=rows["columns"])
+
+    return counts.set_index(rows["columns"][:-1])["plays"].astype(np.int64)
+
+
+def _timestamp_to_text(timestamp: Optional[pd.Timestamp]) -> Optional[str]:
+    return None if timestamp is None else timestamp.isoformat()
+
+
+def _timestamp_from_text(text: Optional[str], timezone: str):
+    return None if text is None else pd.Timestamp(text).tz_convert(timezone)
+
+
+def _top_counts(counts: Optional[pd.Series], k_top: int) -> pd.Series:
+    """The `k_top` largest counts, sorted by count and ties by position."""
+    if counts is None:
+        return pd.Series(dtype=np.int64, name="plays")
+
+    return counts.iloc[top_k_indices(counts.to_numpy(), k_top)]
+
+
+class HistoryAggregates:
+    """Mergeable aggregates of a streaming history, enough to build every output of
+    a wrap: the play counts per calendar bucket, per song, per artist and per
+    (hour, song), the skip counts, the total time played and the first and last
+    plays. The distinct songs and artists are the keys of their counts.
+
+    Folding the plays of a history in chronological chunks with `update`, or merging
+    the aggregates of consecutive periods with `merge`, gives the same aggregates as
+    computing them at once with `from_history`.
+
+    The songs are coded in order of first appearance, as `get_song_groups` does, so
+    `transition_songs` gives the same top songs as `get_transition_counts`. The
+    transitions between them are counted apart, with a `TransitionCounter`, since
+    the top songs are not known until every play is folded.
+    """
+
+    def __init__(self, skip_thresholds: Iterable[int] = (SKIP_MS_TOLERANCE,)):
+        self.skip_thresholds = sorted(set(skip_thresholds))
+        self.total_plays = 0
+        self.total_ms = 0
+        self.skips = {threshold: 0 for threshold in self.skip_thresholds}
+        self.start: Optional[pd.Timestamp] = None
+        self.end: Optional[pd.Timestamp] = None
+        self.plays_per_x = {
+            target_name: np.zeros(X_TARGET_BINS[target_name], dtype=np.int64)
+            for target_name in ALLOWED_X_TARGETS
+        }
+        self.song_counts: Optional[pd.Series] = None
+        self.artist_counts: Optional[pd.Series] = None
+        self.hour_song_counts: Optional[pd.Series] = None
+        # code of every (song, artist), in order of first appearance
+        self.song_codes: Dict[Tuple[str, str], int] = {}
+        # plays of every song, by code
+        self.song_plays = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def from_history(
+        cls,
+        data: pd.DataFrame,
+        skip_thresholds: Iterable[int] = (SKIP_MS_TOLERANCE,),
+        timestamp_col: str = END_LOCAL_TIME_COL_NAME,
+    ) -> "HistoryAggregates":
+        """Compute the aggregates of the plays of a streaming history."""
+        aggregates = cls(skip_thresholds)
+
+        if data.shape[0] == 0:
+            return aggregates
+
+        data = sort_data_by_time(data, timestamp_col)
+
+        stats = StatsEngine(aggregates.skip_thresholds, timestamp_col).compute(data)
+        aggregates.total_plays = stats.total_plays
+        aggregates.total_ms = stats.total_ms
+        aggregates.skips = stats.skips
+        aggregates.start = stats.start
+        aggregates.end = stats.end
+
+        aggregates.plays_per_x = count_plays_per_x(
+            data, ALLOWED_X_TARGETS, timestamp_col
+        )
+
+        aggregates.song_counts = _group_counts(data, SONG_COLUMNS)
+        aggregates.artist_counts = _group_counts(data, ["artistName"])
+
+        songs = data["trackName"].array
+        artists = data["artistName"].array
+        hours = get_calendar_fields(data, {"hour"}, timestamp_col)["hour"]
+        aggregates.hour_song_counts = _group_counts(
+            pd.DataFrame({"hour": hours, "trackName": songs, "artistName": artists}),
+            HOUR_SONG_COLUMNS,
+        )
+
+        _, groups = get_song_groups(data)
+        aggregates.song_codes = {
+            song: code
+            for code, song in enumerate(
+                zip(groups["trackName"].tolist(), groups["artistName"].tolist())
+            )
+        }
+        aggregates.song_plays = groups["plays"].to_numpy(dtype=np.int64)
+
+        return aggregates
+
+    def update(
+        self, data: pd.DataFrame, timestamp_col: str = END_LOCAL_TIME_COL_NAME
+    ) -> "HistoryAggregates":
+        """Fold the plays of `data`, which must come after the plays already folded."""
+        return self.merge(
+            HistoryAggregates.from_history(data, self.skip_thresholds, timestamp_col)
+        )
+
+    def merge(self, other: "HistoryAggregates") -> "HistoryAggregates":
+        """Merge the aggregates of the plays that come right after the plays of these
+        aggregates."""
+        assert self.skip_thresholds == other.skip_thresholds
+
+        if other.total_plays == 0:
+            return self
+
+        self.total_plays += other.total_plays
+        self.total_ms += other.total_ms
+        for threshold in self.skip_thresholds:
+            self.skips[threshold] += other.skips[threshold]
+
+        self.start = other.start if self.start is None else min(self.start, other.start)
+        self.end = other.end if self.end is None else max(self.end, other.end)
+
+        for target_name in ALLOWED_X_TARGETS:
+            self.plays_per_x[target_name] = (
+                self.plays_per_x[target_name] + other.plays_per_x[target_name]
+            )
+
+        self.song_counts = _add_counts(self.song_counts, other.song_counts)
+        self.artist_counts = _add_counts(self.artist_counts, other.artist_counts)
+        self.hour_song_counts = _add_counts(
+            self.hour_song_counts, other.hour_song_counts
+        )
+
+        # recode the songs of the other plays, the new ones get the next codes
+        other_codes = np.empty(len(other.song_codes), dtype=np.int64)
+        for song, code in other.song_codes.items():
+            other_codes[code] = self.song_codes.setdefault(song, len(self.song_codes))
+        song_plays = np.zeros(len(self.song_codes), dtype=np.int64)
+        song_plays[: self.song_plays.size] = self.song_plays
+        song_plays[other_codes] += other.song_plays
+        self.song_plays = song_plays
+
+        return self
+
+    def to_dict(self) -> dict:
+        """The aggregates as JSON serializable values, see `from_dict`."""
+        return {
+            "skip_thresholds": self.skip_thresholds,
+            "total_plays": self.total_plays,
+            "total_ms": self.total_ms,
+            "skips": [self.skips[threshold] for threshold in self.skip_thresholds],
+            "start": _timestamp_to_text(self.start),
+            "end": _timestamp_to_text(self.end),
+            "plays_per_x": {
+                target_name: plays.tolist()
+                for target_name, plays in self.plays_per_x.items()
+            },
+            "song_counts": _counts_to_rows(self.song_counts),
+            "artist_counts": _counts_to_rows(self.artist_counts),
+            "hour_song_counts": _counts_to_rows(self.hour_song_counts),
+            "songs": [list(song) for song in self.song_codes],
+            "song_plays": self.song_plays.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict, timezone: str) -> "HistoryAggregates":
+        """Aggregates saved with `to_dict`, of plays in the timezone."""
+        aggregates = cls(values["skip_thresholds"])
+        aggregates.total_plays = values["total_plays"]
+        aggregates.total_ms = values["total_ms"]
+        aggregates.skips = dict(zip(aggregates.skip_thresholds, values["skips"]))
+        aggregates.start = _timestamp_from_text(values["start"], timezone)
+        aggregates.end = _timestamp_from_text(values["end"], timezone)
+        aggregates.plays_per_x = {
+            target_name: np.array(plays, dtype=np.int64)
+            for target_name, plays in values["plays_per_x"].items()
+        }
+        aggregates.song_counts = _counts_from_rows(values["song_counts"])
+        aggregates.artist_counts = _counts_from_rows(values["artist_counts"])
+        aggregates.hour_song_counts = _counts_from_rows(values["hour_song_counts"])
+        aggregates.song_codes = {
+            tuple(song): code for code, song in enumerate(values["songs"])
+        }
+        aggregates.song_plays = np.array(values["song_plays"], dtype=np.int64)
+
+        return aggregates
+
+    def stats(self) -> WrapStats:
+        return WrapStats(
+            total_plays=self.total_plays,
+            total_ms=self.total_ms,
+            skips=dict(self.skips),
+            unique_songs=self.song_counts.index.get_level_values("trackName").nunique(),
+            unique_artists=self.artist_counts.size,
+            start=self.start,
+            end=self.end,
+        )
+
+    def plays_per_groups(self, target_names: Set[str]) -> Dict[str, List[tuple]]:
+        """Same as `generate_plays_to_x_map` over the folded plays."""
+        return plays_to_x_map_from_counts(
+            {target_name: self.plays_per_x[target_name] for target_name in target_names}
+        )
+
+    def top_songs(self, k_top: int = 5) -> pd.DataFrame:
+        return _top_counts(self.song_counts, k_top).reset_index(name="plays")
+
+    def top_artists(self, k_top: int = 5) -> pd.Series:
+        return _top_counts(self.artist_counts, k_top)
+
+    def top_songs_per_hour(self, n_top: int = 1) -> pd.DataFrame:
+        """Same as `get_top_songs_per_hour` over the folded plays."""
+        songs = self.hour_song_counts.reset_index(name="plays")
+
+        return (
+            songs.sort_values(["hour", "plays"], ascending=[True, False], kind="stable")
+            .groupby("hour")
+            .head(n_top)
+            .reset_index(drop=True)
+        )
+
+    def transition_songs(self, k_top: int = K_TOP_SONGS_GRAPH) -> List[tuple]:
+        """The `k_top` most played (song, artist), the nodes of the transitions of
+        `get_transition_counts` over the folded plays."""
+        songs = list(self.song_codes)
+
+        return [songs[code] for code in top_k_indices(self.song_plays, k_top)]
+
+    def transitions(self, counter: "TransitionCounter") -> TransitionCounts:
+        """Transitions of the counter with the plays of its songs. Same as
+        `get_transition_counts` over the folded plays when the counter counted them
+        between the `transition_songs`."""
+        songs = pd.DataFrame(counter.songs, columns=SONG_COLUMNS, dtype=object)
+        songs["plays"] = self.song_plays[
+            [self.song_codes[song] for song in counter.songs]
+        ]
+
+        return TransitionCounts(songs=songs, edges=counter.edges())
+
+    def summarize(self, counter: "TransitionCounter") -> WrapSummary:
+        """Compute the summary of a wrap from the folded plays and the transitions
+        of the counter."""
+        return WrapSummary(
+            stats=self.stats(),
+            plays_per_groups=self.plays_per_groups(WRAP_X_TARGETS),
+            top_songs=self.top_songs(K_TOP_SONGS),
+            top_artists=self.top_artists(K_TOP_ARTISTS),
+            top_songs_per_hour=self.top_songs_per_hour(1),
+            transitions=self.transitions(counter),
+        )
+
+
+class TransitionCounter:
+    """Transitions between a fixed set of songs, see `get_transition_counts`,
+    counted over the plays of a history folded in chronological chunks with
+    `update`. Only the (k, k) counts and the node of the last play of one of the
+    songs, to count the transition across the end of a chunk, are kept."""
+
+    def __init__(self, songs: List[tuple]):
+        # (song, artist) of every node
+        self.songs = [tuple(song) for song in songs]
+        self.weights = np.zeros((len(self.songs), len(self.songs)), dtype=np.int64)
+        # node of the last play of one of the songs, -1 before the first one
+        self.last_node = -1
+
+    def update(
+        self, data: pd.DataFrame, timestamp_col: str = END_LOCAL_TIME_COL_NAME
+    ) -> "TransitionCounter":
+        """Count the transitions of the plays of `data`, which must come after the
+        plays already counted."""
+        if data.shape[0] == 0 or not self.songs:
+            return self
+
+        play_groups, groups = get_song_groups(data)
+
+        timestamps = data[timestamp_col]
+        if not timestamps.is_monotonic_increasing:
+            play_groups = play_groups[np.argsort(timestamps.array.asi8, kind="stable")]
+
+        song_nodes = {song: node for node, song in enumerate(self.songs)}
+        # the last position maps the plays without song or artist to -1
+        group_nodes = np.full(len(groups) + 1, -1, dtype=np.int64)
+        group_nodes[:-1] = [
+            song_nodes.get(song, -1)
+            for song in zip(groups["trackName"].tolist(), groups["artistName"].tolist())
+        ]
+
+        play_nodes = np.concatenate([[self.last_node], group_nodes[play_groups]])
+        play_nodes = play_nodes[play_nodes >= 0]
+
+        if play_nodes.size == 0:
+            return self
+
+        k_songs = len(self.songs)
+        transition_keys = play_nodes[:-1] * k_songs + play_nodes[1:]
+        self.weights += np.bincount(
+            transition_keys, minlength=k_songs * k_songs
+        ).reshape(k_songs, k_songs)
+        self.last_node = int(play_nodes[-1])
+
+        return self
+
+    def reorder(self, songs: List[tuple]) -> "TransitionCounter":
+        """The same counts with the nodes in the order of `songs`, the same songs
+        as the counter in another order."""
+        nodes = {song: node for node, song in enumerate(self.songs)}
+        old_nodes = [nodes[tuple(song)] for song in songs]
+
+        counter = TransitionCounter(songs)
+        counter.weights = self.weights[np.ix_(old_nodes, old_nodes)]
+        if self.last_node >= 0:
+            counter.last_node = old_nodes.index(self.last_node)
+
+        return counter
+
+    def to_dict(self) -> dict:
+        return {
+            "songs": [list(song) for song in self.songs],
+            "weights": self.weights.tolist(),
+            "last_node": self.last_node,
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "TransitionCounter":
+        counter = cls(values["songs"])
+        counter.weights = np.array(values["weights"], dtype=np.int64).reshape(
+            counter.weights.shape
+        )
+        counter.last_node = values["last_node"]
+
+        return counter
+
+    def edges(self) -> pd.DataFrame:
+        """Source, target and weight of every transition seen at least once, in the
+        order of `get_transition_counts`."""
+        sources, targets = np.nonzero(self.weights)
+
+        return pd.DataFrame(
+            {
+                "source": sources.astype(np.int64),
+                "target": targets.astype(np.int64),
+                "weight": self.weights[sources, targets],
+            }
+        )
+
+
+def _file_number(file_path: str) -> Tuple[str, int]:
+    """Sort key of the files of an export in the order they were written, e.g.
+    StreamingHistory_music_2.json before StreamingHistory_music_10.json."""
+    name = os.path.basename(file_path)
+    match = re.search(r"(\d+)\.json$", name)
+
+    if match is None:
+        return name, -1
+
+    return name[: match.start()], int(match.group(1))
+
+
+def _iter_local_history_chunks(
+    file_paths: List[str],
+    local_timezone: str,
+    chunk_size: int,
+    start_date: Optional[date],
+    end_date: Optional[date],
+) -> Iterator[pd.DataFrame]:
+    """Chunks of at most `chunk_size` plays of the streaming history files, with the
+    local time and calendar columns, in the order the files were exported, and
+    only with the plays between `start_date` and `end_date` when both are given."""
+    for chunk in iter_streaming_history_chunks(
+        sorted(file_paths, key=_file_number), chunk_size
+    ):
+        chunk = convert_column_utc_datetime_to_local_time(
+            data=chunk,
+            new_tz=local_timezone,
+            column_name="endTime",
+            new_column_name=END_LOCAL_TIME_COL_NAME,
+        )
+        chunk = add_local_calendar_columns(chunk)
+
+        if start_date and end_date:
+            chunk = filter_data_by_dates(
+                chunk, END_LOCAL_TIME_COL_NAME, start_date, end_date
+            )
+
+        yield chunk
+
+
+def aggregate_history_in_chunks(
+    file_paths: List[str],
+    local_timezone: str,
+    chunk_size: int = HISTORY_CHUNK_SIZE,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> HistoryAggregates:
+    """Compute the aggregates of the streaming history files reading at most
+    `chunk_size` plays at once, so the memory used depends on the chunk size and
+    on the number of distinct songs instead of on the whole history.
+
+    The files are read in the order they were exported, which is chronological,
+    and only the plays between `start_date` and `end_date` are taken when both are
+    given."""
+    # aggregates of consecutive runs of chunks, each one of twice the chunks of the
+    # next one, as the digits of a binary counter. Merging aggregates of the same
+    # size, instead of folding every chunk into the whole aggregates, aligns the
+    # counts of each song O(log chunks) times rather than once per chunk
+    partial_aggregates: List[Tuple[int, HistoryAggregates]] = []
+
+    for chunk in _iter_local_history_chunks(
+        file_paths, local_timezone, chunk_size, start_date, end_date
+    ):
+        chunks, aggregates = 1, HistoryAggregates.from_history(chunk)
+
+        while partial_aggregates and partial_aggregates[-1][0] == chunks:
+            previous_chunks, previous_aggregates = partial_aggregates.pop()
+            chunks += previous_chunks
+            aggregates = previous_aggregates.merge(aggregates)
+
+        partial_aggregates.append((chunks, aggregates))
+
+    aggregates = HistoryAggregates()
+
+    for _, chunk_aggregates in partial_aggregates:
+        aggregates.merge(chunk_aggregates)
+
+    return aggregates
+
+
+def count_transitions_in_chunks(
+    file_paths: List[str],
+    songs: List[tuple],
+    local_timezone: str,
+    chunk_size: int = HISTORY_CHUNK_SIZE,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> TransitionCounter:
+    """Count the transitions between the songs over the plays of the streaming
+    history files, read as `aggregate_history_in_chunks` does. The top songs are
+    only known once every play is aggregated, so the files are read a second time
+    with the `transition_songs` of the aggregates."""
+    counter = TransitionCounter(songs)
+
+    for chunk in _iter_local_history_chunks(
+        file_paths, local_timezone, chunk_size, start_date, end_date
+    ):
+        counter.update(chunk)
+
+    return counter
+
+
+class HistoryCube:
+    """Plays, time played and skips of a streaming history counted per cell of
+    (local day, hour, song), to compute the wraps of many periods from a single pass
+    over the plays: the counts of a period are sums over the cells of its days.
+
+    The history must be sorted by time, see `sort_data_by_time`. The cells are kept
+    in the order of their first play, so the cells of a period are contiguous and
+    the songs and artists come out of them in order of first appearance, which
+    breaks the ties of the tops as the functions of `wrapy.core` do over the plays.
+    The transitions depend on the order of the plays, so they are counted over the
+    plays of the period, a slice of the history.
+    """
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        timestamp_col: str = END_LOCAL_TIME_COL_NAME,
+        song_column: str = "trackName",
+        artist_column: str = "artistName",
+    ):
+        assert data[timestamp_col].is_monotonic_increasing
+
+        self.data = data
+        self.timestamp_col = timestamp_col
+
+        if (
+            LOCAL_DATE_COL_NAME in data.columns
+            and timestamp_col == END_LOCAL_TIME_COL_NAME
+        ):
+            play_days = data[LOCAL_DATE_COL_NAME].to_numpy()
+        else:
+            play_days = data[timestamp_col].dt.tz_localize(None).to_numpy()
+        # days since the epoch of every play, sorted
+        self.play_days = play_days.astype("datetime64[D]").view(np.int64)
+
+        hours = get_calendar_fields(data, {"hour"}, timestamp_col)["hour"]
+        song_codes, songs = pd.factorize(data[song_column])
+        artist_codes, artists = pd.factorize(data[artist_column])
+        self.songs = np.asarray(songs, dtype=object)
+        self.artists = np.asarray(artists, dtype=object)
+
+        # mixed radix key of the cell of every play, the missing songs and artists
+        # (-1) are kept as their own value so every play is in a cell
+        first_day = self.play_days[0] if self.play_days.size else 0
+        n_songs, n_artists = len(self.songs) + 1, len(self.artists) + 1
+        key = (self.play_days - first_day) * 24 + hours.astype(np.int64)
+        key = (key * n_songs + song_codes + 1) * n_artists + artist_codes + 1
+
+        # in order of first play
+        cell_ids, cell_keys = pd.factorize(key)
+        self.plays = np.bincount(cell_ids, minlength=len(cell_keys))
+        self.ms_played = np.bincount(
+            cell_ids, weights=data["msPlayed"].to_numpy(), minlength=len(cell_keys)
+        ).astype(np.int64)
+        self.skips = np.bincount(
+            cell_ids, weights=is_skipped(data), minlength=len(cell_keys)
+        ).astype(np.int64)
+
+        cell_keys, artist_codes = np.divmod(cell_keys, n_artists)
+        cell_keys, song_codes = np.divmod(cell_keys, n_songs)
+        self.cell_artists = artist_codes - 1
+        self.cell_songs = song_codes - 1
+        self.cell_hours = cell_keys % 24
+        self.cell_days = cell_keys // 24 + first_day
+
+        cell_dates = self.cell_days.astype("datetime64[D]")
+        self.cell_weekdays = (self.cell_days + 3) % 7  # 1970-01-01 was a Thursday
+        self.cell_months = cell_dates.astype("datetime64[M]").view(np.int64) % 12 + 1
+
+        # key of the song and of the (hour, song) of every cell, -1 when the song or
+        # the artist is missing, as the plays ignored by the tops
+        known_songs = (self.cell_songs >= 0) & (self.cell_artists >= 0)
+        self.cell_song_keys = np.where(
+            known_songs, self.cell_songs * len(self.artists) + self.cell_artists, -1
+        )
+        self.cell_hour_song_keys = np.where(
+            known_songs,
+            self.cell_hours * len(self.songs) * len(self.artists) + self.cell_song_keys,
+            -1,
+        )
+
+    def _positions(self, start_date: date, end_date: date) -> Tuple[slice, slice]:
+        """Cells and plays of the days from `start_date` to `end_date`."""
+        bounds = np.array(
+            [start_date, end_date + timedelta(days=1)], dtype="datetime64[D]"
+        ).view(np.int64)
+        cells = slice(*np.searchsorted(self.cell_days, bounds, side="left"))
+        plays = slice(*np.searchsorted(self.play_days, bounds, side="left"))
+
+        return cells, plays
+
+    def count_plays(self, start_date: date, end_date: date) -> int:
+        _, plays = self._positions(start_date, end_date)
+
+        return plays.stop - plays.start
+
+    def stats(self, start_date: date, end_date: date) -> WrapStats:
+        """Same as `StatsEngine().compute` over the plays of the period, which must
+        have at least one play."""
+        cells, plays = self._positions(start_date, end_date)
+        timestamps = self.data[self.timestamp_col]
+
+        return WrapStats(
+            total_plays=int(self.plays[cells].sum()),
+            total_ms=int(self.ms_played[cells].sum()),
+            skips={SKIP_MS_TOLERANCE: int(self.skips[cells].sum())},
+            unique_songs=_count_present_codes(self.cell_songs[cells], len(self.songs)),
+            unique_artists=_count_present_codes(
+                self.cell_artists[cells], len(self.artists)
+            ),
+            start=timestamps.iloc[plays.start],
+            end=timestamps.iloc[plays.stop - 1],
+        )
+
+    def plays_per_groups(
+        self, start_date: date, end_date: date, target_names: Set[str]
+    ) -> Dict[str, List[tuple]]:
+        """Same as `generate_plays_to_x_map` over the plays of the period, for the
+        hour, weekday and month targets."""
+        cells, _ = self._positions(start_date, end_date)
+        cell_fields = {
+            "hour": self.cell_hours,
+            "weekday": self.cell_weekdays,
+            "month": self.cell_months,
+        }
+
+        return plays_to_x_map_from_counts(
+            {
+                target_name: np.bincount(
+                    cell_fields[target_name][cells],
+                    weights=self.plays[cells],
+                    minlength=X_TARGET_BINS[target_name],
+                ).astype(np.int64)
+                for target_name in target_names
+            }
+        )
+
+    def _count_cell_groups(
+        self, cells: slice, cell_keys: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Plays of each distinct key of the cells, in order of first appearance, the
+        cells with a missing key (-1) are ignored. Returns the keys and their plays."""
+        cell_keys = cell_keys[cells]
+        known = cell_keys >= 0
+
+        group_ids, group_keys = pd.factorize(cell_keys[known])
+        counts = np.bincount(
+            group_ids, weights=self.plays[cells][known], minlength=len(group_keys)
+        ).astype(np.int64)
+
+        return group_keys, counts
+
+    def top_songs(self, start_date: date, end_date: date, k_top: int) -> pd.DataFrame:
+        cells, _ = self._positions(start_date, end_date)
+        song_keys, counts = self._count_cell_groups(cells, self.cell_song_keys)
+        top = top_k_indices(counts, k_top)
+        songs, artists = np.divmod(song_keys[top], len(self.artists))
+
+        return pd.DataFrame(
+            {
+                "trackName": self.songs[songs],
+                "artistName": self.artists[artists],
+                "plays": counts[top],
+            }
+        )
+
+    def top_artists(self, start_date: date, end_date: date, k_top: int) -> pd.Series:
+        cells, _ = self._positions(start_date, end_date)
+        artists, counts = self._count_cell_groups(cells, self.cell_artists)
+        top = top_k_indices(counts, k_top)
+
+        return pd.DataFrame(
+            {"artistName": self.artists[artists[top]], "plays": counts[top]}
+        ).set_index("artistName")["plays"]
+
+    def top_songs_per_hour(
+        self, start_date: date, end_date: date, n_top: int = 1
+    ) -> pd.DataFrame:
+        cells, _ = self._positions(start_date, end_date)
+        hour_song_keys, counts = self._count_cell_groups(
+            cells, self.cell_hour_song_keys
+        )
+        hours, song_keys = np.divmod(
+            hour_song_keys, len(self.songs) * len(self.artists)
+        )
+        top = top_k_indices_per_group(hours, counts, n_top)
+        songs, artists = np.divmod(song_keys[top], len(self.artists))
+
+        return pd.DataFrame(
+            {
+                "hour": hours[top],
+                "trackName": self.songs[songs],
+                "artistName": self.artists[artists],
+                "plays": counts[top],
+            }
+        )
+
+    def summarize(self, start_date: date, end_date: date) -> WrapSummary:
+        """Compute the summary of the wrap of the days from `start_date` to
+        `end_date`, the same as `summarize_history` over the plays of those days."""
+        _, plays = self._positions(start_date, end_date)
+
+        return WrapSummary(
+            stats=self.stats(start_date, end_date),
+            plays_per_groups=self.plays_per_groups(
+                start_date, end_date, WRAP_X_TARGETS
+            ),
+            top_songs=self.top_songs(start_date, end_date, K_TOP_SONGS),
+            top_artists=self.top_artists(start_date, end_date, K_TOP_ARTISTS),
+            top_songs_per_hour=self.top_songs_per_hour(start_date, end_date, 1),
+            transitions=get_transition_counts(
+                self.data.iloc[plays], K_TOP_SONGS_GRAPH, self.timestamp_col
+            ),
+        )
+
+
+def _count_present_codes(codes: np.ndarray, n_codes: int) -> int:
+    """Number of distinct codes, the missing ones (-1) aside."""
+    return int(np.count_nonzero(np.bincount(codes[codes >= 0], minlength=n_codes)))
+
+
+def _play_keys(data: pd.DataFrame) -> List[tuple]:
+    """(song, artist, time played) of every play, to tell apart the plays of the
+    same instant."""
+    return list(zip(*(data[column].tolist() for column in PLAY_KEY_COLUMNS)))
+
+
+def _drop_folded_plays(
+    data: pd.DataFrame, end: Optional[pd.Timestamp], end_plays: List[tuple]
+) -> pd.DataFrame:
+    """The plays of `data` not folded yet, given the time of the last play folded
+    and the keys of the plays folded at that time, see `WrapState.fold`."""
+    if end is None:
+        return data
+
+    timestamps = data[END_LOCAL_TIME_COL_NAME]
+    new_plays = (timestamps > end).to_numpy()
+    end_positions = np.flatnonzero((timestamps == end).to_numpy())
+    folded_plays = Counter(end_plays)
+
+    for position, key in zip(end_positions, _play_keys(data.iloc[end_positions])):
+        if folded_plays[key] > 0:
+            folded_plays[key] -= 1
+        else:
+            new_plays[position] = True
+
+    return data[new_plays]
+
+
+def _last_plays(
+    data: pd.DataFrame, end: Optional[pd.Timestamp], end_plays: List[tuple]
+) -> Tuple[Optional[pd.Timestamp], List[tuple]]:
+    """Time of the last play folded and keys of the plays folded at that time, once
+    the new plays of `data` are folded."""
+    if data.shape[0] == 0:
+        return end, end_plays
+
+    timestamps = data[END_LOCAL_TIME_COL_NAME]
+    new_end = timestamps.max() if end is None else max(end, timestamps.max())
+    new_end_plays = list(end_plays) if new_end == end else []
+    new_end_plays.extend(_play_keys(data[timestamps == new_end]))
+
+    return new_end, new_end_plays
+
+
+class WrapState:
+    """State of an incremental wrap kept between runs: the aggregates of the plays
+    folded so far, the transitions between their top songs, the keys of the plays
+    folded at the time of the last one, the content hashes of the source files
+    already seen, grouped by the run that folded them, the fingerprints of the
+    files of the last run and the digests of the inputs of each output rendered.
+
+    It's saved as JSON with the version of its format, a state of another version
+    or timezone is rejected instead of being rebuilt from the files at hand, which
+    could miss the plays of exports no longer kept."""
+
+    def __init__(self, timezone: str):
+        self.version = STATE_VERSION
+        self.timezone = timezone
+        self.aggregates = HistoryAggregates()
+        self.transitions = TransitionCounter([])
+        self.end_plays: List[tuple] = []
+        self.source_hashes: Set[str] = set()
+        # content hashes of the files of every fold with new plays, in order
+        self.folds: List[List[str]] = []
+        # fingerprints of the source files by path, see `indexed_fingerprints`
+        self.fingerprints: Dict[str, dict] = dict()
+        self.output_digests: Dict[str, str] = dict()
+
+    @classmethod
+    def load(cls, path: str, timezone: str) -> "WrapState":
+        """Load the state from the path, a new state is returned if there is no state
+        yet."""
+        if not os.path.exists(path):
+            return cls(timezone)
+
+        with open(path) as state_file:
+            values = json.load(state_file)
+
+        if values.get("version") != STATE_VERSION:
+            raise ValidationError(
+                f"The state in {path} is of version {values.get('version')}, this"
+                f" version of wrapy uses version {STATE_VERSION}. Remove it to"
+                " build the wrap again from the files in the data folder"
+            )
+
+        if values["timezone"] != timezone:
+            raise ValidationError(
+                f"The state in {path} was built for the timezone"
+                f" {values['timezone']}, not {timezone}"
+            )
+
+        state = cls(timezone)
+        state.aggregates = HistoryAggregates.from_dict(values["aggregates"], timezone)
+        state.transitions = TransitionCounter.from_dict(values["transitions"])
+        state.end_plays = [tuple(key) for key in values["end_plays"]]
+        state.source_hashes = set(values["source_hashes"])
+        state.folds = values["folds"]
+        state.fingerprints = values["fingerprints"]
+        state.output_digests = values["output_digests"]
+
+        return state
+
+    def fold(
+        self,
+        data: pd.DataFrame,
+        source_hashes: Iterable[str] = (),
+        load_sources: Optional[Callable[[List[str]], Optional[pd.DataFrame]]] = None,
+    ) -> pd.DataFrame:
+        """Fold the plays of `data`, read from the files with the content hashes
+        `source_hashes`, that were not folded yet and return them.
+
+        Only the plays from the time of the last play folded on are taken, so
+        overlapping exports are not counted twice. Account exports have minute
+        resolution, so a new export can hold more plays of that same minute: the
+        plays of that time are taken except as many of each (song, artist, time
+        played) as were already folded. The plays before it are taken as already
+        folded, with a warning, since the plays folded are not kept one by one.
+
+        When the new plays change the top songs, the transitions between the new
+        ones are counted again over the plays of the previous folds, read with
+        `load_sources` from the content hashes of their files (None when some are
+        no longer available)."""
+        source_hashes = sorted(set(source_hashes))
+        self.source_hashes.update(source_hashes)
+
+        end = self.aggregates.end
+
+        if end is not None:
+            earlier_plays = int((data[END_LOCAL_TIME_COL_NAME] < end).sum())
+
+            if earlier_plays:
+                logger.warning(
+                    f"{earlier_plays} plays of the new files are before the last"
+                    f" play folded ({end}), they are taken as already folded"
+                )
+
+        data = _drop_folded_plays(data, end, self.end_plays)
+
+        if data.shape[0] == 0:
+            return data
+
+        self.aggregates.update(data)
+        self._count_transitions(data, load_sources)
+        self.folds.append(source_hashes)
+        _, self.end_plays = _last_plays(data, end, self.end_plays)
+
+        return data
+
+    def _count_transitions(
+        self,
+        data: pd.DataFrame,
+        load_sources: Optional[Callable[[List[str]], Optional[pd.DataFrame]]],
+    ) -> None:
+        """Count the transitions of the new plays between the top songs, which can
+        change with them."""
+        songs = self.aggregates.transition_songs()
+
+        if self.aggregates.total_plays == data.shape[0]:
+            self.transitions = TransitionCounter(songs)
+        elif set(songs) == set(self.transitions.songs):
+            self.transitions = self.transitions.reorder(songs)
+        else:
+            transitions = self._recount_transitions(songs, load_sources)
+
+            if transitions is None:
+                logger.warning(
+                    "The top songs changed with the new plays but the files of"
+                    " previous runs are no longer available, the transitions are"
+                    " still counted between the previous ones"
+                )
+            else:
+                self.transitions = transitions
+
+        self.transitions.update(data)
+
+    def _recount_transitions(
+        self,
+        songs: List[tuple],
+        load_sources: Optional[Callable[[List[str]], Optional[pd.DataFrame]]],
+    ) -> Optional["TransitionCounter"]:
+        """Count the transitions between the songs over the plays of the previous
+        folds, read again one fold at a time."""
+        if load_sources is None:
+            return None
+
+        transitions = TransitionCounter(songs)
+        end, end_plays = None, []
+
+        for source_hashes in self.folds:
+            data = load_sources(source_hashes)
+
+            if data is None:
+                return None
+
+            data = _drop_folded_plays(data, end, end_plays)
+            transitions.update(data)
+            end, end_plays = _last_plays(data, end, end_plays)
+
+        return transitions
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "timezone": self.timezone,
+            "aggregates": self.aggregates.to_dict(),
+            "transitions": self.transitions.to_dict(),
+            "end_plays": [list(key) for key in self.end_plays],
+            "source_hashes": sorted(self.source_hashes),
+            "folds": self.folds,
+            "fingerprints": self.fingerprints,
+            "output_digests": self.output_digests,
+        }
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+
+        with open(tmp_path, "w") as state_file:
+            json.dump(self.to_dict(), state_file)
+
+        os.replace(tmp_path, path)
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from wrapy.constants import CACHE_MAX_BYTES, DEFAULT_CACHE_DIR
+
+CACHE_ENTRY_EXTENSION = ".parquet"
+CACHE_METADATA_EXTENSION = ".json"
+HASH_CHUNK_SIZE = 1 << 20
+# fingerprints of the source files last hashed, by path, see `HistoryCache.fingerprints`
+FINGERPRINT_INDEX_FILE_NAME = "fingerprints.index"
+# version of the columns (and order) of the cached histories, a new version makes
+# new keys
+CACHE_FORMAT_VERSION = 3
+
+
+def file_fingerprint(file_path: str) -> dict:
+    """Describe the current state of a source file by its absolute path, size,
+    modification time and a hash of its content."""
+    stat = os.stat(file_path)
+    content_hash = hashlib.blake2b(digest_size=16)
+
+    with open(file_path, "rb") as source_file:
+        for chunk in iter(lambda: source_file.read(HASH_CHUNK_SIZE), b""):
+            content_hash.update(chunk)
+
+    return {
+        "path": os.path.abspath(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": content_hash.hexdigest(),
+    }
+
+
+def indexed_fingerprints(
+    file_paths: List[str], index: Dict[str, dict]
+) -> Tuple[List[dict], bool]:
+    """Fingerprints of the source files, see `file_fingerprint`, from an index of the
+    fingerprints last computed by absolute path, which is updated in place. The
+    content of a file is hashed only when its size or modification time differ
+    from the ones it had when it was last hashed. Returns the fingerprints and
+    whether the index changed."""
+    fingerprints = []
+    index_changed = False
+
+    for file_path in file_paths:
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        fingerprint = index.get(path)
+        unchanged = (
+            fingerprint is not None
+            and fingerprint["size"] == stat.st_size
+            and fingerprint["mtime_ns"] == stat.st_mtime_ns
+        )
+
+        if not unchanged:
+            fingerprint = file_fingerprint(path)
+            index[path] = fingerprint
+            index_changed = True
+
+        fingerprints.append(fingerprint)
+
+    return fingerprints, index_changed
+
+
+def build_cache_key(fingerprints: List[dict], timezone: str) -> str:
+    """Build the key of a parsed history from the fingerprints of its source files,
+    the timezone used to compute the local times and the format of the cache."""
+    payload = json.dumps(
+        {
+            "sources": sorted(fingerprints, key=lambda item: item["path"]),
+            "timezone": timezone,
+            "format": CACHE_FORMAT_VERSION,
+        },
+        sort_keys=True,
+    )
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class HistoryCache:
+    """On-disk cache of parsed streaming histories stored as Parquet files.
+
+    Entries are keyed by the fingerprints of their source files plus the
+    timezone (see `build_cache_key`), so any change to the sources produces a new
+    key. When a new entry is stored, the entries built from the same source paths
+    and timezone are removed, and the least recently used entries are evicted
+    until the cache fits in `max_bytes`. The fingerprints of the sources are kept
+    in an index, so the sources are hashed only when they change.
+    """
+
+    def __init__(
+        self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def fingerprints(self, file_paths: List[str]) -> List[dict]:
+        """Fingerprints of the source files, see `indexed_fingerprints`, so a cache
+        hit doesn't read the sources."""
+        index = self.__load_fingerprint_index()
+        fingerprints, index_changed = indexed_fingerprints(file_paths, index)
+
+        if index_changed:
+            self.__save_fingerprint_index(index)
+
+        return fingerprints
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Return the cached history for the key, or None on a cache miss."""
+        entry_path = self.__entry_path(key)
+
+        if not os.path.exists(entry_path):
+            return None
+
+        try:
+            data = pd.read_parquet(entry_path)
+        except Exception:
+            # a corrupted or partially written entry is treated as a miss
+            self.__remove_entry(key)
+            return None
+
+        # mark the entry as recently used for the eviction policy
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+
+        return data
+
+    def put(
+        self, key: str, data: pd.DataFrame, fingerprints: List[dict], timezone: str
+    ) -> None:
+        """Store the parsed history under the key, invalidating the stale entries of
+        the same sources and evicting old entries if the cache is too big."""
+        for stale_key in self.__find_entries(fingerprints, timezone):
+            if stale_key != key:
+                self.__remove_entry(stale_key)
+
+        entry_path = self.__entry_path(key)
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, entry_path)
+
+        metadata = {
+            "sources": sorted(item["path"] for item in fingerprints),
+            "timezone": timezone,
+        }
+        with open(self.__metadata_path(key), "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+
+        self.evict(keep_key=key)
+
+    def evict(self, keep_key: Optional[str] = None) -> None:
+        """Remove the least recently used entries until the total size of the cache
+        is below `max_bytes`. The entry of `keep_key`, the one just stored, is never
+        removed, even if it doesn't fit alone."""
+        entries = []
+
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(CACHE_ENTRY_EXTENSION):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, file_name))
+            except FileNotFoundError:
+                # removed by another process sharing the cache
+                continue
+            key = file_name[: -len(CACHE_ENTRY_EXTENSION)]
+            entries.append((stat.st_mtime, stat.st_size, key))
+
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, key in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep_key:
+                continue
+            self.__remove_entry(key)
+            total_bytes -= size
+
+    def __find_entries(self, fingerprints: List[dict], timezone: str) -> List[str]:
+        """Find the keys of the entries built from the same source paths and
+        timezone."""
+        sources = sorted(item["path"] for item in fingerprints)
+        keys = []
+
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(CACHE_METADATA_EXTENSION):
+                continue
+            try:
+                with open(os.path.join(self.cache_dir, file_name)) as metadata_file:
+                    metadata = json.load(metadata_file)
+            except (OSError, ValueError):
+                continue
+
+            if metadata.get("sources") == sources and (
+                metadata.get("timezone") == timezone
+            ):
+                keys.append(file_name[: -len(CACHE_METADATA_EXTENSION)])
+
+        return keys
+
+    def __load_fingerprint_index(self) -> Dict[str, dict]:
+        try:
+            with open(self.__fingerprint_index_path()) as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return dict()
+
+    def __save_fingerprint_index(self, index: Dict[str, dict]) -> None:
+        """Write the index without the files that don't exist anymore."""
+        index = {path: item for path, item in index.items() if os.path.exists(path)}
+        index_path = self.__fingerprint_index_path()
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+
+        with open(tmp_path, "w") as index_file:
+            json.dump(index, index_file)
+
+        os.replace(tmp_path, index_path)
+
+    def __fingerprint_index_path(self) -> str:
+        return os.path.join(self.cache_dir, FINGERPRINT_INDEX_FILE_NAME)
+
+    def __remove_entry(self, key: str) -> None:
+        for path in (self.__entry_path(key), self.__metadata_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_ENTRY_EXTENSION)
+
+    def __metadata_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_METADATA_EXTENSION)
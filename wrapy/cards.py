@@ -0,0 +1,284 @@
+"""Text and title cards drawn with Pillow.
+
+The cards keep the layout of the matplotlib cards they replace: the positions are
+fractions of a text area of the card, measured from the bottom, the font sizes are
+in points at the DPI of the layout and the text is DejaVu Sans, the default font of
+matplotlib. Matplotlib is not imported, so the cards can be drawn without loading
+the plotting libraries.
+"""
+
+import importlib.util
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple, Union
+
+from PIL import Image, ImageDraw, ImageFont
+
+from wrapy.constants import GREEN_BLUE_HEXA_COLOR, WHITE_COLOR
+
+FONT_FILE_NAMES = {False: "DejaVuSans.ttf", True: "DejaVuSans-Bold.ttf"}
+POINTS_PER_INCH = 72
+# the sizes of the cards are given in pixels at this DPI
+BASE_DPI = 100
+LINE_SPACING = 1.2
+# padding around the text of the cards cropped to their text, in inches
+CROP_PADDING_INCHES = 0.1
+BACKGROUND_COLOR = "black"
+
+
+@dataclass(frozen=True)
+class CardLayout:
+    """Placement of the text of a card.
+
+    The text area starts at (`left`, `bottom`) and spans `width` x `height`, all of
+    them fractions of the card. The title is centered at `x` with its last line on
+    `title_y`, and each line of content is `line_gap` below the previous one, the
+    first one `title_gap` below the title; `x` and the `*_y` / `*_gap` values are
+    fractions of the text area. When `crop_to_text` is set, the card is cropped to
+    its text area and text and then scaled to fit the card size.
+    """
+
+    dpi: int
+    x: float
+    title_y: float
+    title_gap: float = 0.0
+    line_gap: float = 0.0
+    left: float = 0.0
+    bottom: float = 0.0
+    width: float = 1.0
+    height: float = 1.0
+    crop_to_text: bool = False
+
+
+# the text area of the default matplotlib subplot
+TEXT_CARD_LAYOUT = CardLayout(
+    dpi=200,
+    x=0.5,
+    title_y=0.85,
+    title_gap=0.15,
+    line_gap=0.10,
+    left=0.125,
+    bottom=0.11,
+    width=0.775,
+    height=0.77,
+    crop_to_text=True,
+)
+TITLE_CARD_LAYOUT = CardLayout(dpi=100, x=0.5, title_y=0.5)
+
+
+@dataclass
+class _TextBlock:
+    lines: List[str]
+    font_size: float
+    bold: bool
+    color: str
+    x: float
+    # baselines of the lines, in pixels from the top at the DPI of the layout
+    baselines: List[float]
+    widths: List[float]
+    top: float
+    bottom: float
+
+
+def _find_font_path(bold: bool) -> Optional[str]:
+    """Path of the DejaVu Sans font shipped with matplotlib, found without importing
+    matplotlib."""
+    spec = importlib.util.find_spec("matplotlib")
+
+    if spec is None or not spec.submodule_search_locations:
+        return None
+
+    font_path = os.path.join(
+        spec.submodule_search_locations[0],
+        "mpl-data",
+        "fonts",
+        "ttf",
+        FONT_FILE_NAMES[bold],
+    )
+
+    return font_path if os.path.exists(font_path) else None
+
+
+@lru_cache(maxsize=None)
+def get_font(size: float, bold: bool = False) -> ImageFont.FreeTypeFont:
+    """Load the font of the cards once per size, `size` in pixels."""
+    font_path = _find_font_path(bold)
+
+    if font_path is None:
+        return ImageFont.load_default(size=size)
+
+    return ImageFont.truetype(font_path, size=size)
+
+
+@lru_cache(maxsize=8)
+def get_background(image_path: str, img_size: tuple) -> Image.Image:
+    """Load the background image scaled to the card size once, don't modify it."""
+    with Image.open(image_path) as image:
+        return image.convert("RGB").resize((img_size[1], img_size[0]))
+
+
+def _line_metrics(font: ImageFont.FreeTypeFont, line: str) -> Tuple[float, float]:
+    """Ascent and descent of the line from its baseline, at least the ones of "lp"
+    as matplotlib does so lines without ascenders or descenders are not shorter."""
+    _, lp_top, _, lp_bottom = font.getbbox("lp", anchor="ls")
+    _, top, _, bottom = font.getbbox(line, anchor="ls") if line else (0, 0, 0, 0)
+
+    return max(-top, -lp_top), max(bottom, lp_bottom)
+
+
+def _layout_block(
+    text: str, font_size: int, bold: bool, color: str, x: float, y: float, dpi: int
+) -> _TextBlock:
+    """Place the lines of a text centered at `x` with the baseline of the last line
+    at `y`, both in pixels at the DPI of the layout."""
+    font_size = font_size * dpi / POINTS_PER_INCH
+    font = get_font(font_size, bold)
+    lines = text.split("\n")
+    metrics = [_line_metrics(font, line) for line in lines]
+
+    # from the last line up, each baseline is LINE_SPACING times the ascent of its
+    # line below the descent of the previous line
+    baselines = [y]
+    for (_, descent), (ascent, _) in zip(metrics[-2::-1], metrics[:0:-1]):
+        baselines.append(baselines[-1] - LINE_SPACING * ascent - descent)
+    baselines.reverse()
+
+    return _TextBlock(
+        lines=lines,
+        font_size=font_size,
+        bold=bold,
+        color=color,
+        x=x,
+        baselines=baselines,
+        widths=[font.getlength(line) for line in lines],
+        top=baselines[0] - metrics[0][0],
+        bottom=baselines[-1] + metrics[-1][1],
+    )
+
+
+def render_card(
+    layout: CardLayout,
+    img_size: tuple,
+    title: str,
+    title_font_size: int,
+    title_color: str = WHITE_COLOR,
+    text_lines: Sequence[str] = (),
+    content_font_size: int = 14,
+    background_img: Optional[Union[str, Image.Image]] = None,
+) -> Image.Image:
+    """Draw a card of `img_size` (height, width) with a bold title and some lines of
+    content placed by the layout. The background image is given as a path, loaded
+    and scaled once for all the cards, or as an image."""
+    height, width = img_size
+    dpi = layout.dpi
+    # size of the card in pixels at the DPI of the layout
+    card_width = width / BASE_DPI * dpi
+    card_height = height / BASE_DPI * dpi
+
+    def to_pixels(x: float, y: float) -> Tuple[float, float]:
+        x = (layout.left + x * layout.width) * card_width
+        y = (1 - layout.bottom - y * layout.height) * card_height
+        return x, y
+
+    y = layout.title_y
+    blocks = [
+        _layout_block(
+            title, title_font_size, True, title_color, *to_pixels(layout.x, y), dpi
+        )
+    ]
+    y -= layout.title_gap
+
+    for line in text_lines:
+        blocks.append(
+            _layout_block(
+                line,
+                content_font_size,
+                False,
+                WHITE_COLOR,
+                *to_pixels(layout.x, y),
+                dpi
+            )
+        )
+        y -= layout.line_gap
+
+    if layout.crop_to_text:
+        # crop to the text area and the text plus a padding, as a tight bbox of
+        # matplotlib, then fit it in the card centered
+        padding = CROP_PADDING_INCHES * dpi
+        area_left, area_bottom = to_pixels(0, 0)
+        area_right, area_top = to_pixels(1, 1)
+
+        left = min([area_left] + [block.x - max(block.widths) / 2 for block in blocks])
+        right = max(
+            [area_right] + [block.x + max(block.widths) / 2 for block in blocks]
+        )
+        top = min([area_top] + [block.top for block in blocks])
+        bottom = max([area_bottom] + [block.bottom for block in blocks])
+        left, top = left - padding, top - padding
+        right, bottom = right + padding, bottom + padding
+
+        scale = min(width / (right - left), height / (bottom - top))
+        offset_x = (width - (right - left) * scale) / 2 - left * scale
+        offset_y = (height - (bottom - top) * scale) / 2 - top * scale
+    else:
+        scale = BASE_DPI / dpi
+        offset_x = offset_y = 0
+
+    if background_img is None:
+        image = Image.new("RGB", (width, height), BACKGROUND_COLOR)
+    elif isinstance(background_img, str):
+        image = get_background(background_img, img_size).copy()
+    else:
+        image = background_img.convert("RGB").resize((width, height))
+
+    draw = ImageDraw.Draw(image)
+
+    for block in blocks:
+        font = get_font(block.font_size * scale, block.bold)
+
+        for line, baseline in zip(block.lines, block.baselines):
+            draw.text(
+                (block.x * scale + offset_x, baseline * scale + offset_y),
+                line,
+                font=font,
+                fill=block.color,
+                anchor="ms",
+            )
+
+    return image
+
+
+def render_text_card(
+    title: str,
+    text_lines: Sequence[str],
+    img_size: tuple,
+    title_font_size: int = 20,
+    content_font_size: int = 14,
+) -> Image.Image:
+    """Card with a title on top and a line of text below for each item."""
+    return render_card(
+        TEXT_CARD_LAYOUT,
+        img_size,
+        title,
+        title_font_size,
+        title_color=GREEN_BLUE_HEXA_COLOR,
+        text_lines=text_lines,
+        content_font_size=content_font_size,
+    )
+
+
+def render_title_card(
+    title: str,
+    img_size: tuple,
+    font_size: int = 16,
+    background_img: Optional[Union[str, Image.Image]] = None,
+) -> Image.Image:
+    """Card containing only a title centered."""
+    return render_card(
+        TITLE_CARD_LAYOUT,
+        img_size,
+        title,
+        font_size,
+        background_img=background_img,
+    )
@@ -2,6 +2,7 @@ import os
 
 DEFAULT_DATA_DIR = "spotify_data"
 DEFAULT_OUTPUT_PATH = "output"
+DEFAULT_CACHE_DIR = ".wrapy_cache"
 ASSETS_PATH = "assets"
 
 TOTAL_SECONDS_PER_DAY = 86400
@@ -9,8 +10,21 @@ TOTAL_SECONDS_PER_HOUR = 3600
 TOTAL_SECONDS_PER_MINUTE = 60
 DAYS_PER_YEAR = 365.0
 LIMIT_DATE_FORMAT = "%Y-%m-%d"
+HISTORY_DATE_FORMAT = "%Y-%m-%d %H:%M"
+EXTENDED_HISTORY_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+SKIP_MS_TOLERANCE = 10_000
 K_TOP_SONGS = 20
 K_TOP_SONGS_GRAPH = 7
+K_TOP_ARTISTS = 5
+
+# transition graph of the top songs
+GRAPH_LAYOUTS = ("auto", "spring", "circular", "shell")
+# "auto" uses a spring layout up to this number of songs, a shell layout above it
+GRAPH_SPRING_LAYOUT_MAX_NODES = 30
+# the graph is rendered at this factor of its size and then downscaled
+GRAPH_SUPERSAMPLE = 1
+# layouts kept in memory, keyed by the songs of the graph
+GRAPH_LAYOUT_CACHE_SIZE = 32
 
 DAYS_WEEK_MAP_EN = {
     0: "Monday",
@@ -32,9 +46,81 @@ DAYS_WEEK_MAP = {
     6: "Domingo",
 }
 
-ALLOWED_X_TARGETS = {"month", "weekday", "hour"}
+ALLOWED_X_TARGETS = {"month", "weekday", "hour", "day_of_year", "hour_weekday"}
+# calendar fields needed by each target and the number of possible keys
+X_TARGET_FIELDS = {
+    "month": ("month",),
+    "weekday": ("weekday",),
+    "hour": ("hour",),
+    "day_of_year": ("day_of_year",),
+    "hour_weekday": ("weekday", "hour"),
+}
+X_TARGET_BINS = {
+    "month": 13,
+    "weekday": 7,
+    "hour": 24,
+    "day_of_year": 367,
+    "hour_weekday": 7 * 24,
+}
+# pandas datetime accessor for each calendar field
+CALENDAR_FIELD_ACCESSORS = {
+    "month": "month",
+    "weekday": "weekday",
+    "hour": "hour",
+    "day_of_year": "dayofyear",
+}
 
 END_LOCAL_TIME_COL_NAME = "endLocalTime"
+# calendar fields of the local time of the plays computed once after the timezone
+# conversion, see `add_local_calendar_columns`: calendar field -> int8 column
+LOCAL_CALENDAR_COLUMNS = {
+    "hour": "localHour",
+    "weekday": "localWeekday",
+    "month": "localMonth",
+}
+LOCAL_DATE_COL_NAME = "localDate"
+SKIPPED_COL_NAME = "skipped"
+
+# Streaming history exports: the account data export (StreamingHistory*.json) and
+# the extended streaming history (Streaming_History_Audio_*.json)
+HISTORY_FILE_PREFIXES = ("StreamingHistory", "Streaming_History_Audio_")
+# column of the loaded history -> field of the records of each export, the fields
+# not listed are dropped while parsing
+ACCOUNT_HISTORY_FIELDS = {
+    "endTime": "endTime",
+    "artistName": "artistName",
+    "trackName": "trackName",
+    "msPlayed": "msPlayed",
+}
+EXTENDED_HISTORY_FIELDS = {
+    "endTime": "ts",
+    "artistName": "master_metadata_album_artist_name",
+    "trackName": "master_metadata_track_name",
+    "msPlayed": "ms_played",
+    SKIPPED_COL_NAME: "skipped",
+}
+# plays folded at once and characters read at once when the history is read as a
+# stream, see `iter_streaming_history_chunks`
+HISTORY_CHUNK_SIZE = 100_000
+# records turned into typed columns at once when a history file is loaded
+HISTORY_LOAD_CHUNK_SIZE = 10_000
+JSON_READ_BLOCK_SIZE = 1 << 20
+
+# Incremental wraps
+INCREMENTAL_OUTPUT_PATH = os.path.join(DEFAULT_OUTPUT_PATH, "incremental")
+STATE_FILE_NAME = "wrapy_state.json"
+
+# Batch of wraps
+BATCH_OUTPUT_PATH = os.path.join(DEFAULT_OUTPUT_PATH, "batch")
+BATCH_REPORT_FILE_NAME = "batch_report.json"
+BATCH_TASKS_PER_WORKER = 20
+
+# Parsed history cache
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Timings of the stages, written next to the stats
+TIMINGS_FILE_NAME = "timings.json"
+PROFILERS = ("cprofile", "pyinstrument")
 
 REPO_URL = "https://github.com/dbetm/spotify-wrapy"
 
@@ -43,7 +129,14 @@ VIDEO_DIMENSIONS = (1920, 1080)
 IMAGE_DURATION_SECS = 3.5
 FPS = 30
 TRANSTITION_DURATION_SECS = 0.4
+VIDEO_BACKENDS = ("moviepy", "ffmpeg", "segments")
+DEFAULT_VIDEO_BACKEND = "moviepy"
+VIDEO_CODEC = "libx264"
+VIDEO_PRESET = "medium"
+VIDEO_CRF = 23
 
 # Text cards
 CARD_IMG_SIZE = VIDEO_DIMENSIONS
 COVER_BG_IMAGE_PATH = os.path.join(ASSETS_PATH, "earth-from-iss-for-cover.png")
+GREEN_BLUE_HEXA_COLOR = "#86C8BC"
+WHITE_COLOR = "#ffffff"
@@ -1,84 +1,362 @@
 import math
+import os
 import random
-from typing import Callable, List, Optional, Set, Union
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
-import matplotlib.pyplot as plt
-import networkx as nx
 import numpy as np
 import pandas as pd
-from matplotlib import cm
-from PIL import Image, ImageDraw, ImageFont
 
 from wrapy.constants import (
     ALLOWED_X_TARGETS,
+    CALENDAR_FIELD_ACCESSORS,
     DAYS_PER_YEAR,
+    END_LOCAL_TIME_COL_NAME,
+    GRAPH_LAYOUT_CACHE_SIZE,
+    GRAPH_LAYOUTS,
+    GRAPH_SPRING_LAYOUT_MAX_NODES,
+    GRAPH_SUPERSAMPLE,
+    GREEN_BLUE_HEXA_COLOR,
+    LOCAL_CALENDAR_COLUMNS,
+    SKIP_MS_TOLERANCE,
+    SKIPPED_COL_NAME,
     TOTAL_SECONDS_PER_DAY,
     TOTAL_SECONDS_PER_HOUR,
     TOTAL_SECONDS_PER_MINUTE,
+    WHITE_COLOR,
+    X_TARGET_BINS,
+    X_TARGET_FIELDS,
 )
 
-GREEN_BLUE_HEXA_COLOR = "#86C8BC"
-WHITE_COLOR = "#ffffff"
+# matplotlib and networkx are imported by the functions that plot, so the stats can
+# be computed without loading them
+if TYPE_CHECKING:
+    import networkx as nx
+    from matplotlib.figure import Figure
+    from PIL import Image
 
 
-def __increase_key_group(groups: dict, group_name: str, key: str) -> dict:
-    """Increase accumulator by given group name and key of that group."""
-    assert group_name in groups
+def extract_calendar_fields(
+    timestamps: pd.Series, field_names: Set[str]
+) -> Dict[str, np.ndarray]:
+    """Pull each of the given calendar fields out of the timestamps once, as small
+    integer arrays. Datetime accessors are the expensive part of the counting."""
+    return {
+        field_name: getattr(timestamps.dt, CALENDAR_FIELD_ACCESSORS[field_name])
+        .to_numpy()
+        .astype(np.int16, copy=False)
+        for field_name in field_names
+    }
 
-    if not key in groups[group_name]:
-        groups[group_name][key] = 1
-    else:
-        groups[group_name][key] += 1
 
-    return groups
+def get_calendar_fields(
+    data: pd.DataFrame, field_names: Set[str], column_name: str = "endLocalTime"
+) -> Dict[str, np.ndarray]:
+    """Calendar fields of the timestamps of `column_name`, taken from the local
+    calendar columns of the history when it has them (see
+    `add_local_calendar_columns`), otherwise extracted from the timestamps."""
+    fields = dict()
 
+    if column_name == END_LOCAL_TIME_COL_NAME:
+        for field_name in field_names:
+            calendar_column = LOCAL_CALENDAR_COLUMNS.get(field_name)
 
-def generate_plays_to_x_map(
+            if calendar_column in data.columns:
+                fields[field_name] = data[calendar_column].to_numpy()
+
+    missing_field_names = set(field_names) - fields.keys()
+
+    if missing_field_names:
+        fields.update(extract_calendar_fields(data[column_name], missing_field_names))
+
+    return fields
+
+
+def count_plays_per_x(
     data: pd.DataFrame,
     target_names: Set[str],
     column_name: str = "endLocalTime",
-) -> List[tuple]:
+) -> Dict[str, np.ndarray]:
+    """Count the plays grouped by each one of the targets given. The calendar fields
+    of `column_name` are taken only once, see `get_calendar_fields`, and each target
+    is counted with a single `bincount` over them.
+
+    Returns a dictionary mapping each target name to an array with the plays of
+    every possible key of the target, see `X_TARGET_BINS`. The key of
+    `hour_weekday` is `weekday * 24 + hour`.
+    """
     for target_name in target_names:
         assert target_name in ALLOWED_X_TARGETS
 
-    groups = {"hour": dict(), "weekday": dict(), "month": dict()}
+    field_names = set()
+    for target_name in target_names:
+        field_names.update(X_TARGET_FIELDS[target_name])
+
+    fields = get_calendar_fields(data, field_names, column_name)
 
-    for _, row in data.iterrows():
-        if "hour" in target_names:
-            key_hour = row[column_name].hour
-            groups = __increase_key_group(groups, group_name="hour", key=key_hour)
-        if "weekday" in target_names:
-            key_weekday = row[column_name].weekday()
-            groups = __increase_key_group(groups, group_name="weekday", key=key_weekday)
-        if "month" in target_names:
-            key_month = row[column_name].month
-            groups = __increase_key_group(groups, group_name="month", key=key_month)
-
-    for group_name, results in groups.items():
-        groups[group_name] = sorted(results.items())
+    counts = dict()
+
+    for target_name in target_names:
+        if target_name == "hour_weekday":
+            keys = fields["weekday"].astype(np.int16) * 24 + fields["hour"]
+        else:
+            keys = fields[target_name]
+
+        counts[target_name] = np.bincount(keys, minlength=X_TARGET_BINS[target_name])
+
+    return counts
+
+
+def plays_to_x_map_from_counts(counts: Dict[str, np.ndarray]) -> Dict[str, List[tuple]]:
+    """Turn the arrays of `count_plays_per_x` into sorted lists of `(key, plays)`
+    tuples, only keys with at least one play are included. The key of
+    `hour_weekday` is a `(weekday, hour)` tuple."""
+    groups = dict()
+
+    for target_name, target_counts in counts.items():
+        (present_keys,) = np.nonzero(target_counts)
+
+        if target_name == "hour_weekday":
+            groups[target_name] = [
+                ((int(key // 24), int(key % 24)), int(target_counts[key]))
+                for key in present_keys
+            ]
+        else:
+            groups[target_name] = [
+                (int(key), int(target_counts[key])) for key in present_keys
+            ]
 
     return groups
 
 
+def generate_plays_to_x_map(
+    data: pd.DataFrame,
+    target_names: Set[str],
+    column_name: str = "endLocalTime",
+) -> Dict[str, List[tuple]]:
+    """Count the plays grouped by each one of the targets given, see
+    `count_plays_per_x`.
+
+    Returns a dictionary mapping each target name to a sorted list of
+    `(key, plays)` tuples, only keys with at least one play are included. The key
+    of `hour_weekday` is a `(weekday, hour)` tuple.
+    """
+    return plays_to_x_map_from_counts(
+        count_plays_per_x(data, target_names, column_name)
+    )
+
+
 def compute_unique_values(data: pd.DataFrame, column_name: str) -> int:
     count = data[column_name].unique().size
 
     return count
 
 
-def count_song_skips(data: pd.DataFrame, ms_tolerance: int = 10_000) -> dict:
-    jumps = data[data["msPlayed"] < ms_tolerance].shape[0]
+def _known_skip_flags(
+    data: pd.DataFrame, skipped_column: str = SKIPPED_COL_NAME
+) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """The `skipped` flags of the plays and whether each one is known, or None when
+    no play has a flag, e.g. in the account data export."""
+    if skipped_column not in data.columns:
+        return None, None
+
+    flags = data[skipped_column]
+    known = flags.notna().to_numpy()
+
+    if not known.any():
+        return None, None
+
+    return flags.to_numpy(dtype=bool, na_value=False), known
+
+
+def is_skipped(
+    data: pd.DataFrame,
+    ms_tolerance: int = SKIP_MS_TOLERANCE,
+    ms_column: str = "msPlayed",
+    skipped_column: str = SKIPPED_COL_NAME,
+) -> np.ndarray:
+    """Whether each play was skipped, as flagged by the extended streaming history
+    when the flag is known, otherwise when less than `ms_tolerance` ms were
+    played."""
+    short_plays = data[ms_column].to_numpy() < ms_tolerance
+    flags, known = _known_skip_flags(data, skipped_column)
+
+    if flags is None:
+        return short_plays
+
+    return np.where(known, flags, short_plays)
+
+
+def count_song_skips(data: pd.DataFrame, ms_tolerance: int = SKIP_MS_TOLERANCE) -> dict:
+    jumps = int(is_skipped(data, ms_tolerance).sum())
     jumps_percentage = (jumps / data.shape[0]) * 100.0
 
     return {"percentage": jumps_percentage, "total": jumps}
 
 
-def get_average_plays_per_day(data: pd.DataFrame, ms_tolerance: int = 10_000) -> float:
-    plays_without_jumps = data[data["msPlayed"] >= ms_tolerance].shape[0]
+def get_average_plays_per_day(
+    data: pd.DataFrame, ms_tolerance: int = SKIP_MS_TOLERANCE
+) -> float:
+    plays_without_jumps = data.shape[0] - int(is_skipped(data, ms_tolerance).sum())
 
     return plays_without_jumps / DAYS_PER_YEAR
 
 
+def _factorize(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the integer codes of a column and its distinct values, missing values
+    get the code -1. Categorical columns reuse their own codes."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return (
+            values.cat.codes.to_numpy().astype(np.int64),
+            np.asarray(values.cat.categories, dtype=object),
+        )
+
+    codes, uniques = pd.factorize(values)
+
+    return codes.astype(np.int64, copy=False), np.asarray(uniques, dtype=object)
+
+
+def top_k_indices(counts: np.ndarray, k_top: int) -> np.ndarray:
+    """Return the indices of the `k_top` largest counts sorted by count, ties are
+    broken by the lowest index. It only partitions the counts around the k-th
+    largest one instead of sorting all of them."""
+    k_top = min(k_top, counts.size)
+
+    if k_top <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    kth_count = np.partition(counts, counts.size - k_top)[counts.size - k_top]
+    above = np.flatnonzero(counts > kth_count)
+    ties = np.flatnonzero(counts == kth_count)[: k_top - above.size]
+    candidates = np.concatenate([above, ties])
+
+    return candidates[np.lexsort((candidates, -counts[candidates]))]
+
+
+def top_k_indices_per_group(
+    groups: np.ndarray, counts: np.ndarray, k_top: int
+) -> np.ndarray:
+    """Return the indices of the `k_top` largest counts of each group, sorted by
+    group and then by count, ties are broken by the lowest index."""
+    order = np.lexsort((np.arange(counts.size), -counts, groups))
+    sorted_groups = groups[order]
+
+    # position of each count inside its group
+    group_starts = np.searchsorted(sorted_groups, sorted_groups, side="left")
+    rank = np.arange(order.size) - group_starts
+
+    return order[rank < k_top]
+
+
+def _count_code_groups(
+    codes: List[np.ndarray], sizes: List[int]
+) -> Tuple[np.ndarray, List[np.ndarray], np.ndarray]:
+    """Count the plays of each distinct combination of integer codes, `sizes` being
+    the number of possible codes of each column. The codes are combined in a single
+    integer key per play, which is grouped and counted with `factorize` +
+    `bincount`. Plays with a missing code (-1) are ignored.
+
+    Returns the group of every play (-1 for the ignored ones), the codes of each
+    column for every group, in order of first appearance, and the plays of every
+    group.
+    """
+    # drop the plays with missing values, like `value_counts` does
+    valid = np.logical_and.reduce([column_codes >= 0 for column_codes in codes])
+
+    # mixed radix key, the last column is the least significant digit
+    key = np.zeros(int(valid.sum()), dtype=np.int64)
+    for column_codes, size in zip(codes, sizes):
+        key = key * size + column_codes[valid]
+
+    group_ids, group_keys = pd.factorize(key)
+    counts = np.bincount(group_ids, minlength=len(group_keys))
+
+    group_codes = []
+    for size in reversed(sizes):
+        group_keys, column_codes = np.divmod(group_keys, size)
+        group_codes.append(column_codes)
+
+    play_groups = np.full(valid.size, -1, dtype=np.int64)
+    play_groups[valid] = group_ids
+
+    return play_groups, group_codes[::-1], counts
+
+
+def count_groups(
+    data: pd.DataFrame, columns: List[str], count_column: str = "plays"
+) -> pd.DataFrame:
+    """Count the plays of each distinct combination of values of the given columns,
+    see `_count_code_groups`. The groups are returned in order of first appearance.
+
+    Returns a DataFrame with the given columns plus `count_column`.
+    """
+    codes, uniques = zip(*(_factorize(data[column]) for column in columns))
+
+    _, group_codes, counts = _count_code_groups(
+        list(codes), [len(column_uniques) for column_uniques in uniques]
+    )
+
+    groups = pd.DataFrame(
+        {
+            column: column_uniques[column_codes]
+            for column, column_uniques, column_codes in zip(
+                columns, uniques, group_codes
+            )
+        }
+    )
+    groups[count_column] = counts
+
+    return groups
+
+
+def count_top_k_groups(
+    data: pd.DataFrame,
+    columns: List[str],
+    k_top: int,
+    count_column: str = "plays",
+) -> pd.DataFrame:
+    """Count the plays of each distinct combination of values of the given columns
+    and return the `k_top` most played ones, sorted by plays.
+
+    The counting is done over the integer codes of the columns (see
+    `_count_code_groups`) and the top groups are found with a partial selection.
+    The input DataFrame is not modified.
+
+    Returns a DataFrame with the given columns plus `count_column`.
+    """
+    codes, uniques = zip(*(_factorize(data[column]) for column in columns))
+
+    _, group_codes, counts = _count_code_groups(
+        list(codes), [len(column_uniques) for column_uniques in uniques]
+    )
+    top_groups = top_k_indices(counts, k_top)
+
+    top = pd.DataFrame(
+        {
+            column: column_uniques[column_codes[top_groups]]
+            for column, column_uniques, column_codes in zip(
+                columns, uniques, group_codes
+            )
+        }
+    )
+    top[count_column] = counts[top_groups]
+
+    return top
+
+
 def get_top_songs(
     data: pd.DataFrame,
     k_top: int = 5,
@@ -86,23 +364,54 @@ def get_top_songs(
     artist_column: str = "artistName",
 ) -> pd.DataFrame:
     """Get the most listened songs."""
-    song_id_key = "song_id"
-    data[song_id_key] = data[song_column] + "#&&6" + data[artist_column]
-    song_counts = data[song_id_key].value_counts(ascending=False).head(k_top)
+    return count_top_k_groups(data, [song_column, artist_column], k_top)
 
-    df = song_counts.index.to_series().str.extract(r"^(.*?)#&&6(.*)$")
-    df.columns = [song_column, artist_column]
 
-    df["plays"] = song_counts.values
+def get_top_artists(
+    data: pd.DataFrame, k_top: int = 5, artist_column: str = "artistName"
+) -> pd.Series:
+    """Get the most listened artists."""
+    top = count_top_k_groups(data, [artist_column], k_top)
 
-    return df.reset_index().drop(columns=[song_id_key])
+    return top.set_index(artist_column)["plays"]
 
 
-def get_top_artists(
-    data: pd.DataFrame, k_top: int = 5, artist_column: str = "artistName"
+def get_top_songs_per_hour(
+    data: pd.DataFrame,
+    n_top: int = 1,
+    timestamp_col: str = "endLocalTime",
+    song_col: str = "trackName",
+    artist_column: str = "artistName",
 ) -> pd.DataFrame:
-    """Get the most listened artists."""
-    return data[artist_column].value_counts(ascending=False).head(k_top)
+    """Get the `n_top` most listened songs of every hour of the day.
+
+    The plays are counted once grouped by (hour, song, artist), then the groups are
+    sorted by hour and plays to take the first ones of each hour. The input
+    DataFrame is not modified.
+
+    Returns a DataFrame with the columns `hour`, `song_col`, `artist_column` and
+    `plays`, sorted by hour and then by plays.
+    """
+    hours = get_calendar_fields(data, {"hour"}, timestamp_col)["hour"]
+    song_codes, songs = _factorize(data[song_col])
+    artist_codes, artists = _factorize(data[artist_column])
+
+    _, (group_hours, group_songs, group_artists), counts = _count_code_groups(
+        [hours.astype(np.int64), song_codes, artist_codes],
+        [X_TARGET_BINS["hour"], len(songs), len(artists)],
+    )
+
+    # by hour, then by plays, ties broken by first appearance
+    top = top_k_indices_per_group(group_hours, counts, n_top)
+
+    return pd.DataFrame(
+        {
+            "hour": group_hours[top],
+            song_col: songs[group_songs[top]],
+            artist_column: artists[group_artists[top]],
+            "plays": counts[top],
+        }
+    )
 
 
 def get_top_songs_for_each_hour(
@@ -115,23 +424,50 @@ def get_top_songs_for_each_hour(
     join_word: str = "",
 ) -> dict:
     """Return a dictionary mapping top hour with top song + artist"""
-    plays_per_hour.sort(key=lambda x: x[1], reverse=True)
+    top_songs_per_hour = get_top_songs_per_hour(
+        data, 1, timestamp_col, song_col, artist_column
+    )
+
+    return pick_top_songs_for_top_hours(
+        top_songs_per_hour,
+        plays_per_hour,
+        k_top,
+        song_col=song_col,
+        artist_column=artist_column,
+        join_word=join_word,
+    )
+
+
+def pick_top_songs_for_top_hours(
+    top_songs_per_hour: pd.DataFrame,
+    plays_per_hour: List[tuple],
+    k_top: int = 5,
+    song_col: str = "trackName",
+    artist_column: str = "artistName",
+    join_word: str = "",
+) -> dict:
+    """Given the result of `get_top_songs_per_hour`, return a dictionary mapping
+    each one of the `k_top` hours with more plays with its top song + artist."""
+    # sorted copy, the caller's list is left untouched
+    plays_per_hour = sorted(plays_per_hour, key=lambda x: x[1], reverse=True)
 
     top_hours = [hour for hour, _ in plays_per_hour[:k_top]]
+
+    top_songs = top_songs_per_hour.drop_duplicates("hour").set_index("hour")
+
     top_songs_for_each_hour = dict()
 
     for hour in top_hours:
-        data_by_hour = data[data[timestamp_col].dt.hour == hour]
-        top_song = data_by_hour[song_col].value_counts(ascending=False).index[0]
-        artist = data[data[song_col] == top_song].iloc[0].to_dict()[artist_column]
-
-        top_songs_for_each_hour[hour] = f"{top_song} {join_word} {artist}"
+        song = top_songs.loc[hour]
+        top_songs_for_each_hour[hour] = (
+            f"{song[song_col]} {join_word} {song[artist_column]}"
+        )
 
     return top_songs_for_each_hour
 
 
-def calculate_human_total_play(data: pd.DataFrame, column_name="msPlayed") -> dict:
-    total_ms = data[column_name].sum()
+def split_ms_in_days_hours_minutes(total_ms: int) -> dict:
+    """Split a duration in milliseconds into whole days, hours and minutes."""
     ms_per_day = TOTAL_SECONDS_PER_DAY * 1000
     ms_per_hour = TOTAL_SECONDS_PER_HOUR * 1000
     ms_per_minute = TOTAL_SECONDS_PER_MINUTE * 1000
@@ -148,6 +484,10 @@ def calculate_human_total_play(data: pd.DataFrame, column_name="msPlayed") -> di
     return {"days": total_days, "hours": total_hours, "minutes": total_minutes}
 
 
+def calculate_human_total_play(data: pd.DataFrame, column_name="msPlayed") -> dict:
+    return split_ms_in_days_hours_minutes(data[column_name].sum())
+
+
 def get_period(data: pd.DataFrame, column_name: str = "endTime") -> str:
     """Get from data the minimum date and maximum dates as a period as formatted string."""
     return (
@@ -156,13 +496,244 @@ def get_period(data: pd.DataFrame, column_name: str = "endTime") -> str:
     )
 
 
+def _count_distinct(values: pd.Series) -> int:
+    """Count the distinct values of a column. Categorical columns are counted over
+    their integer codes instead of hashing the values."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        counts = np.bincount(codes[codes >= 0], minlength=len(values.cat.categories))
+
+        return int(np.count_nonzero(counts))
+
+    return values.unique().size
+
+
+@dataclass
+class WrapStats:
+    """Summary statistics of a streaming history, see `StatsEngine`."""
+
+    total_plays: int
+    total_ms: int
+    # skip threshold in ms -> plays skipped, see `is_skipped`
+    skips: Dict[int, int]
+    unique_songs: int
+    unique_artists: int
+    start: pd.Timestamp
+    end: pd.Timestamp
+
+    def skip_percentage(self, ms_tolerance: int = SKIP_MS_TOLERANCE) -> float:
+        return (self.skips[ms_tolerance] / self.total_plays) * 100.0
+
+    def avg_plays_per_day(self, ms_tolerance: int = SKIP_MS_TOLERANCE) -> float:
+        return (self.total_plays - self.skips[ms_tolerance]) / DAYS_PER_YEAR
+
+    @property
+    def human_total_play(self) -> dict:
+        return split_ms_in_days_hours_minutes(self.total_ms)
+
+    @property
+    def period(self) -> str:
+        """Same as `get_period`, the months of the first and the last play."""
+        return f"{self.start.strftime('%b/%Y')}  -  {self.end.strftime('%b/%Y')}"
+
+
+class StatsEngine:
+    """Compute all the summary statistics of a streaming history in a single pass
+    over each column involved.
+
+    The skips of every threshold are counted at once: each play is assigned to the
+    bucket between two consecutive thresholds, and the counts of the buckets are
+    accumulated. The plays with a known `skipped` flag are counted by their flag for
+    every threshold instead, see `is_skipped`.
+    """
+
+    def __init__(
+        self,
+        skip_thresholds: Iterable[int] = (SKIP_MS_TOLERANCE,),
+        timestamp_column: str = "endLocalTime",
+        ms_column: str = "msPlayed",
+        song_column: str = "trackName",
+        artist_column: str = "artistName",
+        skipped_column: str = SKIPPED_COL_NAME,
+    ):
+        self.skip_thresholds = sorted(set(skip_thresholds))
+        self.timestamp_column = timestamp_column
+        self.ms_column = ms_column
+        self.skipped_column = skipped_column
+        self.song_column = song_column
+        self.artist_column = artist_column
+
+    def compute(self, data: pd.DataFrame) -> WrapStats:
+        ms_played = data[self.ms_column].to_numpy()
+        flags, known = _known_skip_flags(data, self.skipped_column)
+
+        if flags is None:
+            flagged_skips, unflagged_ms = 0, ms_played
+        else:
+            flagged_skips, unflagged_ms = int(flags[known].sum()), ms_played[~known]
+
+        # number of thresholds lower or equal than the time played
+        buckets = np.searchsorted(self.skip_thresholds, unflagged_ms, side="right")
+        skips = flagged_skips + np.cumsum(
+            np.bincount(buckets, minlength=len(self.skip_thresholds))
+        )
+
+        timestamps = data[self.timestamp_column]
+
+        return WrapStats(
+            total_plays=data.shape[0],
+            total_ms=int(ms_played.sum(dtype=np.int64)),
+            skips={
+                threshold: int(skips[i])
+                for i, threshold in enumerate(self.skip_thresholds)
+            },
+            unique_songs=_count_distinct(data[self.song_column]),
+            unique_artists=_count_distinct(data[self.artist_column]),
+            start=timestamps.min(),
+            end=timestamps.max(),
+        )
+
+
+def _figure_to_array(fig: "Figure", **savefig_kwargs) -> np.ndarray:
+    """Render the figure as `savefig` does with the same arguments, but return the
+    RGB pixels taken from the Agg canvas instead of encoding them as an image."""
+    with open(os.devnull, "wb") as sink:
+        fig.savefig(sink, format="raw", **savefig_kwargs)
+
+    return np.ascontiguousarray(np.asarray(fig.canvas.renderer.buffer_rgba())[..., :3])
+
+
+class RenderContext:
+    """Owns the matplotlib figures of the charts rendered in a process.
+
+    Every render runs inside its own `rc_context`, so the changes to the rcParams
+    made while plotting are undone when it ends, and draws on a figure taken from a
+    pool of figures of the same size. The figures of the pool are not registered in
+    pyplot, they are cleared when a render ends and reset to the current rcParams
+    when they are reused, so a long-lived worker keeps a fixed number of figures
+    (and their Agg buffers) no matter how many wraps it renders.
+
+    Args:
+        - style (Optional[str], default=None): Matplotlib style applied to every
+        render, e.g. "dark_background". By default the global style is used.
+        - rc (Optional[dict], default=None): rcParams applied to every render.
+        - max_figures_per_size (int, default=2): Figures kept in the pool for each
+        figure size.
+    """
+
+    def __init__(
+        self,
+        style: Optional[str] = None,
+        rc: Optional[dict] = None,
+        max_figures_per_size: int = 2,
+    ):
+        self.style = style
+        self.rc = dict(rc or {})
+        self.max_figures_per_size = max_figures_per_size
+        self._pool: Dict[tuple, List["Figure"]] = {}
+
+    @contextmanager
+    def figure(
+        self,
+        figsize: Tuple[float, float],
+        facecolor: Optional[str] = None,
+        pooled: bool = True,
+    ) -> Iterator["Figure"]:
+        """Figure of `figsize` inches to render a chart, with isolated rcParams.
+        Figures that are going to be shown are not `pooled`, they are created and
+        closed through pyplot instead."""
+        import matplotlib
+        import matplotlib.pyplot as plt
+        import matplotlib.style
+
+        with matplotlib.style.context(self.style or []), matplotlib.rc_context(self.rc):
+            if pooled:
+                fig = self._acquire(tuple(figsize))
+            else:
+                fig = plt.figure(figsize=figsize)
+
+            if facecolor is not None:
+                fig.set_facecolor(facecolor)
+
+            try:
+                yield fig
+            finally:
+                if pooled:
+                    self._release(tuple(figsize), fig)
+                else:
+                    plt.close(fig)
+
+    def clear(self):
+        """Drop the figures of the pool."""
+        self._pool.clear()
+
+    def _acquire(self, figsize: tuple) -> "Figure":
+        from matplotlib import rcParams
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        figures = self._pool.get(figsize)
+
+        if not figures:
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+            return fig
+
+        # a reused figure gets the properties a new one would take from rcParams
+        fig = figures.pop()
+        fig.set_dpi(rcParams["figure.dpi"])
+        fig.set_facecolor(rcParams["figure.facecolor"])
+        fig.set_edgecolor(rcParams["figure.edgecolor"])
+        fig.subplotpars.update(
+            **{
+                name: rcParams[f"figure.subplot.{name}"]
+                for name in ("left", "right", "bottom", "top", "wspace", "hspace")
+            }
+        )
+
+        return fig
+
+    def _release(self, figsize: tuple, fig: "Figure"):
+        fig.clear()
+        figures = self._pool.setdefault(figsize, [])
+
+        if len(figures) < self.max_figures_per_size:
+            figures.append(fig)
+
+
+_render_context = RenderContext()
+
+
+def get_render_context() -> RenderContext:
+    """Render context shared by the charts rendered in this process."""
+    return _render_context
+
+
+def _finish_figure(
+    fig: "Figure", save_path: Optional[str], as_array: bool, **savefig_kwargs
+) -> Optional[np.ndarray]:
+    """Return the figure as an RGB array, write it to `save_path` or show it."""
+    if as_array:
+        return _figure_to_array(fig, **savefig_kwargs)
+
+    if save_path:
+        fig.savefig(save_path, **savefig_kwargs)
+    else:
+        import matplotlib.pyplot as plt
+
+        plt.show()
+
+
 def create_polar_graph(
     data: List[tuple],
     plot_title: str,
     label_map_fn: Callable = lambda x: x,
     save_path: Optional[str] = None,
     title_font_size: int = 14,
-):
+    as_array: bool = False,
+) -> Optional[np.ndarray]:
+    from matplotlib import cm
+
     labels = list()
     values = list()
     max_value = 0
@@ -177,59 +748,56 @@ def create_polar_graph(
     angles = np.linspace(start=0, stop=2 * np.pi, num=len(labels), endpoint=False)
 
     # Set the figure size
-    plt.figure(figsize=(8, 8))
-
-    # Set the axes, 111 to create a single plot
-    ax = plt.subplot(111, polar=True)
-    ax.grid(visible=True, alpha=0.7, linewidth=1.5)
-
-    # set color style
-    color_map = cm.get_cmap("winter")
-
-    # Set the bar plot
-    ax.bar(
-        angles,
-        values,
-        width=(2 * np.pi) / len(labels),
-        bottom=0.0,
-        color=color_map(list(np.array(values) / max_value)),
-    )
+    with get_render_context().figure(
+        figsize=(8, 8), pooled=as_array or bool(save_path)
+    ) as fig:
+        # Set the axes, 111 to create a single plot
+        ax = fig.add_subplot(111, polar=True)
+        ax.grid(visible=True, alpha=0.7, linewidth=1.5)
+
+        # set color style
+        color_map = cm.get_cmap("winter")
+
+        # Set the bar plot
+        ax.bar(
+            angles,
+            values,
+            width=(2 * np.pi) / len(labels),
+            bottom=0.0,
+            color=color_map(list(np.array(values) / max_value)),
+        )
 
-    # set labels
-    ax.set_xticks(angles)
-    ax.set_xticklabels([])
-    ax.set_yticklabels([])
-
-    # Add the values over the slices
-    for i, value in enumerate(values):
-        angle = angles[i]
-        label = labels[i]
-        plt.text(
-            x=angle,
-            y=value - 100,
-            s=f"{label}: {value}",
-            ha="center",
-            va="center",
-            fontweight="semibold",
-            fontsize="medium",
+        # set labels
+        ax.set_xticks(angles)
+        ax.set_xticklabels([])
+        ax.set_yticklabels([])
+
+        # Add the values over the slices
+        for i, value in enumerate(values):
+            angle = angles[i]
+            label = labels[i]
+            ax.text(
+                x=angle,
+                y=value - 100,
+                s=f"{label}: {value}",
+                ha="center",
+                va="center",
+                fontweight="semibold",
+                fontsize="medium",
+            )
+
+        # Set the title and the font size
+        ax.set_title(
+            label=plot_title,
+            fontsize=title_font_size,
+            pad=20,
+            color=WHITE_COLOR,
+            weight="bold",
         )
 
-    # Set the title and the font size
-    plt.title(
-        label=plot_title,
-        fontsize=title_font_size,
-        pad=20,
-        color=WHITE_COLOR,
-        weight="bold",
-    )
+        fig.tight_layout()
 
-    plt.tight_layout()
-
-    if save_path:
-        plt.savefig(save_path)
-    else:
-        # Show the plot
-        plt.show()
+        return _finish_figure(fig, save_path, as_array)
 
 
 def create_bar_graph(
@@ -239,37 +807,39 @@ def create_bar_graph(
     x_label: str,
     save_path: Optional[str] = None,
     title_font_size: int = 14,
-):
-    max_value = max(y)
+    as_array: bool = False,
+) -> Optional[np.ndarray]:
+    from matplotlib import cm
 
-    # Set the figure size, width and heigh in inches
-    plt.rcParams["figure.figsize"] = (10, 10)
+    max_value = max(y)
 
     # set color palette
     color_map = cm.get_cmap("winter")
 
-    # create plot
-    fig, ax = plt.subplots()
+    # create plot, width and heigh in inches
+    with get_render_context().figure(
+        figsize=(10, 10), pooled=as_array or bool(save_path)
+    ) as fig:
+        ax = fig.subplots()
 
-    ax.bar(x=x, height=y, tick_label=x, color=color_map(list(np.array(y) / max_value)))
+        ax.bar(
+            x=x, height=y, tick_label=x, color=color_map(list(np.array(y) / max_value))
+        )
 
-    # add title and labels
-    plt.title(
-        label=plot_title,
-        fontsize=title_font_size,
-        pad=20,
-        color=WHITE_COLOR,
-        weight="bold",
-    )
-    ax.set_xlabel(xlabel=x_label)
-    ax.set_ylabel(ylabel="Plays")
+        # add title and labels
+        ax.set_title(
+            label=plot_title,
+            fontsize=title_font_size,
+            pad=20,
+            color=WHITE_COLOR,
+            weight="bold",
+        )
+        ax.set_xlabel(xlabel=x_label)
+        ax.set_ylabel(ylabel="Plays")
 
-    fig.tight_layout()
+        fig.tight_layout()
 
-    if save_path:
-        plt.savefig(save_path)
-    else:
-        plt.show()
+        return _finish_figure(fig, save_path, as_array)
 
 
 def create_simple_plot(
@@ -280,126 +850,92 @@ def create_simple_plot(
     y_label: str = "plays",
     save_path: Optional[str] = None,
     title_font_size: int = 14,
-):
+    as_array: bool = False,
+) -> Optional[np.ndarray]:
     # Set the figure size
-    plt.figure(figsize=(8, 8))
-
-    # plot
-    plt.plot(x, y, color=GREEN_BLUE_HEXA_COLOR, linewidth=3)
-    plt.xticks(x)
-    plt.grid(True, linewidth=1, alpha=0.4)
-
-    # title and labels
-    plt.title(
-        label=plot_title,
-        fontsize=title_font_size,
-        pad=20,
-        color=WHITE_COLOR,
-        weight="bold",
-    )
-    plt.xlabel(xlabel=x_label)
-    plt.ylabel(ylabel=y_label)
+    with get_render_context().figure(
+        figsize=(8, 8), pooled=as_array or bool(save_path)
+    ) as fig:
+        ax = fig.add_subplot()
+
+        # plot
+        ax.plot(x, y, color=GREEN_BLUE_HEXA_COLOR, linewidth=3)
+        ax.set_xticks(x)
+        ax.grid(True, linewidth=1, alpha=0.4)
+
+        # title and labels
+        ax.set_title(
+            label=plot_title,
+            fontsize=title_font_size,
+            pad=20,
+            color=WHITE_COLOR,
+            weight="bold",
+        )
+        ax.set_xlabel(xlabel=x_label)
+        ax.set_ylabel(ylabel=y_label)
 
-    plt.tight_layout()
+        fig.tight_layout()
 
-    if save_path:
-        plt.savefig(save_path)
-    else:
-        plt.show()
+        return _finish_figure(fig, save_path, as_array)
 
 
 def create_and_save_text_card(
     title: str,
     text_lines: str,
     img_size: tuple,
-    save_path: str,
+    save_path: Optional[str],
     title_font_size: int = 20,
     content_font_size: int = 14,
-) -> None:
-    dots_per_inch = 200
-    width = img_size[1] / 100  # Divide by DPI to get size in inches
-    height = img_size[0] / 100  # Divide by DPI to get size in inches
-
-    # Create a new figure and axis
-    fig, ax = plt.subplots(figsize=(width, height), dpi=dots_per_inch)
+    as_array: bool = False,
+) -> Optional[np.ndarray]:
+    """Create card as an image, with a title on top and a line below for each text
+    line. Drawn with Pillow, see `wrapy.cards`."""
+    from wrapy.cards import render_text_card
 
     assert len(text_lines) < 10, "text_lines must be contains less than 10 strings"
 
-    # Remove axis and ticks
-    ax.axis("off")
-
-    # Define the initial Y position and their delta
-    y = 0.85
-    delta = 0.10
-
-    # Add the title with center alignment
-    ax.text(
-        x=0.5,
-        y=y,
-        s=title,
-        ha="center",
-        fontsize=title_font_size,
-        color=GREEN_BLUE_HEXA_COLOR,
-        weight="bold",
+    image = render_text_card(
+        title, text_lines, img_size, title_font_size, content_font_size
     )
-    # Update the Y position for the next line
-    y -= 0.15
 
-    # Add each line of text
-    for line in text_lines:
-        ax.text(x=0.5, y=y, s=line, ha="center", fontsize=content_font_size)
-        y -= delta
+    if as_array:
+        return np.asarray(image)
 
-    plt.savefig(save_path, bbox_inches="tight")
-    plt.close(fig)
+    image.save(save_path)
 
 
 def create_and_save_title_card(
     title: str,
-    save_path: str,
+    save_path: Optional[str],
     img_size: tuple,
     font_size: int = 16,
-    background_img: Optional[Image.Image] = None,
-) -> None:
-    """Create card as an image, containing only a title centered."""
-    dots_per_inch = 100
-    width = img_size[1] / dots_per_inch  # Divide by DPI to get size in inches
-    height = img_size[0] / dots_per_inch  # Divide by DPI to get size in inches
-
-    # Create a new figure and axis
-    fig, ax = plt.subplots(figsize=(width, height), dpi=dots_per_inch)
-    # remove internal margins / borders
-    fig.subplots_adjust(left=0, right=1, top=1, bottom=0)
-
-    # Remove axis and ticks
-    ax.axis("off")
-
-    if background_img is not None:
-        bg = background_img.resize((img_size[1], img_size[0]))
-        # [xmin, xmax, ymin, ymax] / 0 is the left botton border and 1 is right/upper
-        ax.imshow(bg, extent=[0, 1, 0, 1], aspect="auto")
-
-    # Add the title with center alignment
-    ax.text(
-        x=0.5,
-        y=0.5,
-        s=title,
-        ha="center",
-        fontsize=font_size,
-        color=WHITE_COLOR,
-        weight="bold",
-    )
+    background_img: Optional[Union[str, "Image.Image"]] = None,
+    as_array: bool = False,
+) -> Optional[np.ndarray]:
+    """Create card as an image, containing only a title centered. The background
+    image can be given as a path, so it's loaded and scaled only once."""
+    from wrapy.cards import render_title_card
 
-    plt.savefig(save_path, dpi=dots_per_inch)
-    plt.close(fig)
+    image = render_title_card(title, img_size, font_size, background_img)
+
+    if as_array:
+        return np.asarray(image)
+
+    image.save(save_path)
 
 
 def generate_n_star_viz(
-    data: pd.DataFrame, img_size: tuple, title: str, save_path: str
-) -> None:
+    data: pd.DataFrame,
+    img_size: tuple,
+    title: str,
+    save_path: Optional[str],
+    as_array: bool = False,
+) -> Optional[np.ndarray]:
     """Create an image with an n star color coded from the artists
     from the tops songs listened to. The number of spikes is equal to the number of records.
     """
+    from PIL import Image, ImageDraw, ImageFont
+
     n = data.shape[0]
     color_padding_dark = 70
     color_padding_light = 10
@@ -457,96 +993,318 @@ def generate_n_star_viz(
     # Step 5: Draw the text on the image
     draw.text((100, 200), title, fill=WHITE_COLOR, font=font)
 
+    if as_array:
+        return np.asarray(image)
+
     image.save(save_path)
 
 
+@dataclass
+class TransitionCounts:
+    """Transitions (song → next song) between the most played songs, see
+    `get_transition_counts`. It's a sparse matrix in coordinate format, the
+    sources and targets of `edges` are rows of `songs`."""
+
+    # song, artist and plays of the top songs, the row position is the node id
+    songs: pd.DataFrame
+    # source, target and weight of every transition seen at least once
+    edges: pd.DataFrame
+
+    def to_matrix(self) -> np.ndarray:
+        """Return the transitions as a dense (k, k) matrix of counts."""
+        k_songs = self.songs.shape[0]
+        matrix = np.zeros((k_songs, k_songs), dtype=np.int64)
+        matrix[self.edges["source"], self.edges["target"]] = self.edges["weight"]
+
+        return matrix
+
+
+def get_song_groups(
+    data: pd.DataFrame,
+    song_column: str = "trackName",
+    artist_column: str = "artistName",
+) -> Tuple[np.ndarray, pd.DataFrame]:
+    """Group the plays by (song, artist). Returns the group of every play (-1 for the
+    plays without song or artist) and the groups, in order of first appearance,
+    with their plays."""
+    song_codes, songs = _factorize(data[song_column])
+    artist_codes, artists = _factorize(data[artist_column])
+
+    play_groups, (group_songs, group_artists), counts = _count_code_groups(
+        [song_codes, artist_codes], [len(songs), len(artists)]
+    )
+
+    groups = pd.DataFrame(
+        {
+            song_column: songs[group_songs],
+            artist_column: artists[group_artists],
+            "plays": counts,
+        }
+    )
+
+    return play_groups, groups
+
+
+def count_top_transitions(
+    play_groups: np.ndarray, groups: pd.DataFrame, k_top: int = 15
+) -> TransitionCounts:
+    """Count the transitions between the `k_top` most played `groups`, given the
+    group of every play in chronological order (-1 for the plays without group).
+    The plays of the other groups in between are ignored."""
+    top_groups = top_k_indices(groups["plays"].to_numpy(), k_top)
+    k_songs = top_groups.size
+
+    top_songs = groups.iloc[top_groups].reset_index(drop=True)
+
+    # node id of every group, -1 for the groups out of the top
+    group_nodes = np.full(len(groups) + 1, -1, dtype=np.int64)
+    group_nodes[top_groups] = np.arange(k_songs)
+
+    # the last position maps the plays without group to -1 too
+    play_nodes = group_nodes[play_groups]
+    play_nodes = play_nodes[play_nodes >= 0]
+
+    transition_keys = play_nodes[:-1] * k_songs + play_nodes[1:]
+    edge_ids, edge_keys = pd.factorize(transition_keys, sort=True)
+    weights = np.bincount(edge_ids, minlength=len(edge_keys))
+    sources, targets = np.divmod(edge_keys, max(k_songs, 1))
+
+    edges = pd.DataFrame({"source": sources, "target": targets, "weight": weights})
+
+    return TransitionCounts(songs=top_songs, edges=edges)
+
+
+def get_transition_counts(
+    data: pd.DataFrame,
+    k_top: int = 15,
+    timestamp_col: str = "endTime",
+    song_column: str = "trackName",
+    artist_column: str = "artistName",
+) -> TransitionCounts:
+    """Count the transitions between the `k_top` most played songs. A transition is
+    a play of a top song followed by a play of a top song, the plays of the other
+    songs in between are ignored.
+
+    The plays are ordered by timestamp (a stable sort, skipped when they are already
+    sorted) and mapped to node ids through the integer codes of the songs, then the
+    consecutive pairs of node ids are counted in a single pass. The ties of the top
+    songs are broken by their first play. The input DataFrame is not modified.
+    """
+    play_groups, groups = get_song_groups(data, song_column, artist_column)
+
+    timestamps = data[timestamp_col]
+    if not timestamps.is_monotonic_increasing:
+        # over the integer nanoseconds, `to_numpy` of a timezone aware column gives
+        # an array of Timestamp objects
+        play_groups = play_groups[np.argsort(timestamps.array.asi8, kind="stable")]
+
+        # number the groups again in order of first play, so the ties of the top
+        # songs don't depend on the order of the rows
+        valid = play_groups >= 0
+        play_groups[valid], group_order = pd.factorize(play_groups[valid])
+        groups = groups.iloc[group_order].reset_index(drop=True)
+
+    return count_top_transitions(play_groups, groups, k_top)
+
+
 def gen_top_k_graph(
     data: pd.DataFrame,
     img_size: tuple,
     title: str,
-    save_path: str,
+    save_path: Optional[str],
     k_top: int = 15,
     song_column: str = "trackName",
     artist_column: str = "artistName",
-) -> None:
-    song_id_key = "song_id"
-    data[song_id_key] = data[song_column] + "\n" + data[artist_column]
+    supersample: int = GRAPH_SUPERSAMPLE,
+    layout: str = "auto",
+    as_array: bool = False,
+) -> Optional[np.ndarray]:
+    transitions = get_transition_counts(
+        data,
+        k_top=k_top,
+        song_column=song_column,
+        artist_column=artist_column,
+    )
 
-    data["endTime"] = pd.to_datetime(data["endTime"])
-    data = data.sort_values("endTime")
+    return draw_transition_graph(
+        transitions,
+        img_size=img_size,
+        title=title,
+        save_path=save_path,
+        song_column=song_column,
+        artist_column=artist_column,
+        supersample=supersample,
+        layout=layout,
+        as_array=as_array,
+    )
 
-    top_k = data[song_id_key].value_counts().head(k_top).index
 
-    df_top = data[data[song_id_key].isin(top_k)].copy()
-    # (song → next_song)
-    df_top.loc[:, "next_song"] = df_top[song_id_key].shift(-1)
+_graph_layout_cache: "OrderedDict[tuple, dict]" = OrderedDict()
 
-    df_edges = df_top[df_top["next_song"].isin(top_k)][[song_id_key, "next_song"]]
 
-    transition_counts = (
-        df_edges.groupby([song_id_key, "next_song"]).size().reset_index(name="weight")
-    )
+def _shells(nodes: List[str], first_shell_size: int = 8) -> List[List[str]]:
+    """Split the nodes in concentric shells, each one twice the size of the
+    previous one, so the first nodes are in the inner shell."""
+    shells = []
+    start, size = 0, first_shell_size
+
+    while start < len(nodes):
+        shells.append(nodes[start : start + size])
+        start, size = start + size, size * 2
+
+    return shells
+
+
+def get_graph_layout(G: "nx.DiGraph", layout: str = "auto") -> dict:
+    """Positions of the nodes of the graph, cached by the layout and the set of
+    nodes, so the graphs of the same songs share them no matter their edges, e.g.
+    a wrap rendered again or the wraps of several periods.
+
+    The spring layout is seeded, and the circular and shell layouts place the
+    nodes in their order in the graph, so the positions are deterministic. With
+    "auto" the spring layout is used up to `GRAPH_SPRING_LAYOUT_MAX_NODES` nodes,
+    the shell layout above it, since the spring layout is slow and unreadable for
+    many nodes.
+    """
+    import networkx as nx
+
+    if layout not in GRAPH_LAYOUTS:
+        raise ValueError(f"Unknown layout {layout!r}, use one of {GRAPH_LAYOUTS}")
+
+    nodes = list(G.nodes())
+
+    if layout == "auto":
+        layout = "spring" if len(nodes) <= GRAPH_SPRING_LAYOUT_MAX_NODES else "shell"
+
+    key = (layout, frozenset(nodes))
+
+    if key in _graph_layout_cache:
+        _graph_layout_cache.move_to_end(key)
+        return _graph_layout_cache[key]
+
+    if layout == "spring":
+        pos = nx.spring_layout(G, k=1.1, seed=42)
+    elif layout == "circular":
+        pos = nx.circular_layout(G)
+    else:
+        pos = nx.shell_layout(G, nlist=_shells(nodes))
+
+    _graph_layout_cache[key] = pos
+
+    if len(_graph_layout_cache) > GRAPH_LAYOUT_CACHE_SIZE:
+        _graph_layout_cache.popitem(last=False)
+
+    return pos
+
+
+def draw_transition_graph(
+    transitions: TransitionCounts,
+    img_size: tuple,
+    title: str,
+    save_path: Optional[str],
+    song_column: str = "trackName",
+    artist_column: str = "artistName",
+    supersample: int = GRAPH_SUPERSAMPLE,
+    layout: str = "auto",
+    as_array: bool = False,
+) -> Optional[np.ndarray]:
+    """Draw the transitions between the top songs as a directed graph of
+    `img_size` (height, width) pixels. With a `supersample` factor above 1 it's
+    rendered that many times larger and downscaled, smoother but slower. See
+    `get_graph_layout` for the layouts."""
+    import networkx as nx
+    from matplotlib import cm
+    from PIL import Image
+
+    labels = (
+        transitions.songs[song_column].astype(str)
+        + "\n"
+        + transitions.songs[artist_column].astype(str)
+    ).to_numpy()
+
+    edges = pd.DataFrame(
+        {
+            "source": labels[transitions.edges["source"]],
+            "target": labels[transitions.edges["target"]],
+            "weight": transitions.edges["weight"],
+        }
+    ).sort_values(["source", "target"])
 
     # create graph
     G = nx.DiGraph()
 
-    for _, row in transition_counts.iterrows():
-        G.add_edge(row[song_id_key], row["next_song"], weight=row["weight"])
+    G.add_weighted_edges_from(edges.itertuples(index=False, name=None))
 
     # Create a unique color per node
     nodes = list(G.nodes())
     num_nodes = len(nodes)
 
-    colors = plt.cm.tab10(np.linspace(0, 1, num_nodes))  # hasta 20 colores
+    colors = cm.tab10(np.linspace(0, 1, num_nodes))  # hasta 20 colores
     color_map = dict(zip(nodes, colors))
 
     # List colors in the same order that the nodes in the graph
     node_colors = [color_map[n] for n in nodes]
 
-    # plot graph
+    # plot graph, sized in inches at 100 DPI and rendered at the DPI that gives
+    # the target pixels times the supersample factor
     px_h, px_w = img_size
     dpi = 100
-    fig = plt.figure(figsize=(px_w / dpi, px_h / dpi), facecolor="black")
-
-    pos = nx.spring_layout(G, k=1.1, seed=42)
-
-    nx.draw(
-        G,
-        pos,
-        with_labels=True,
-        node_color=node_colors,
-        node_size=10_000,
-        font_size=14,
-        arrows=True,
-        arrowstyle="-|>",
-        arrowsize=12,
-        edge_color="white",
-        font_color="white",
-    )
+    pos = get_graph_layout(G, layout)
+
+    with get_render_context().figure(
+        figsize=(px_w / dpi, px_h / dpi),
+        facecolor="black",
+        pooled=as_array or bool(save_path),
+    ) as fig:
+        ax = fig.add_axes((0, 0, 1, 1))
+
+        nx.draw(
+            G,
+            pos,
+            ax=ax,
+            with_labels=True,
+            node_color=node_colors,
+            node_size=10_000,
+            font_size=14,
+            arrows=True,
+            arrowstyle="-|>",
+            arrowsize=12,
+            edge_color="white",
+            font_color="white",
+        )
 
-    # ---- edge labels (weight) ----
-    edge_labels = nx.get_edge_attributes(G, "weight")
+        # ---- edge labels (weight) ----
+        edge_labels = nx.get_edge_attributes(G, "weight")
 
-    ax = plt.gca()
+        # Get Y limits (usually from 0 to 1 or -1 to 1)
+        y_min, y_max = ax.get_ylim()
+        # move a bit the graph from the top
+        ax.set_ylim(y_min, y_max * 1.2)
 
-    # Get Y limits (usually from 0 to 1 or -1 to 1)
-    y_min, y_max = ax.get_ylim()
-    # move a bit the graph from the top
-    ax.set_ylim(y_min, y_max * 1.2)
+        nx.draw_networkx_edge_labels(
+            G,
+            pos,
+            edge_labels=edge_labels,
+            font_size=12,
+            ax=ax,
+        )
 
-    nx.draw_networkx_edge_labels(
-        G,
-        pos,
-        edge_labels=edge_labels,
-        font_size=12,
-    )
+        fig.suptitle(
+            title,
+            fontsize=28,
+            color=GREEN_BLUE_HEXA_COLOR,
+            weight="bold",
+            y=0.93,  # keep top margin
+        )
 
-    fig.suptitle(
-        title,
-        fontsize=28,
-        color=GREEN_BLUE_HEXA_COLOR,
-        weight="bold",
-        y=0.93,  # keep top margin
-    )
+        if supersample == 1 or not (as_array or save_path):
+            return _finish_figure(fig, save_path, as_array, dpi=dpi, facecolor="black")
+
+        image = Image.fromarray(
+            _figure_to_array(fig, dpi=dpi * supersample, facecolor="black")
+        ).resize((px_w, px_h), Image.Resampling.BOX)
 
-    plt.savefig(save_path, dpi=300, facecolor="black")
+    if as_array:
+        return np.asarray(image)
+
+    image.save(save_path)
@@ -0,0 +1,244 @@
+"""Timing of the stages of a wrap.
+
+The stages are wrapped in named spans, `with span("render"): ...`, which measure
+the wall and CPU time of the stage and optionally the peak of memory allocated
+(traced with `tracemalloc`, which slows the run down). Spans opened inside another
+span are named after it, e.g. "render.plays_per_hour".
+
+Nothing is measured unless an `Instrumentation` is active, see `instrumented`. The
+spans are then a shared no-op context, so they can stay in the code. The spans
+are written as JSON with `save_instrumentation`, and one stage can be profiled
+with cProfile or pyinstrument.
+"""
+
+import importlib.util
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+from wrapy.constants import PROFILERS, TIMINGS_FILE_NAME
+from wrapy.custom_exceptions import ValidationError
+
+
+class Span(NamedTuple):
+    # name of the stage, prefixed by the names of the spans it's inside of
+    name: str
+    wall_seconds: float
+    cpu_seconds: float
+    # since the instrumentation started, unknown for the spans measured in other
+    # processes
+    start_seconds: Optional[float] = None
+    # memory allocated on top of the one in use when the span started
+    peak_bytes: Optional[int] = None
+
+
+class Instrumentation:
+    """Spans measured while it's active.
+
+    Args:
+        - trace_memory (bool, default=False): Measure the peak of memory of every
+        span with `tracemalloc`.
+        - profile_stage (Optional[str], default=None): Name of the span to profile,
+        e.g. "render" or "video.encode". When it runs several times, the profile
+        covers all of them.
+        - profiler (str, default="cprofile"): "cprofile", saved as a `.prof` file
+        to open with pstats or snakeviz, or "pyinstrument", saved as HTML.
+    """
+
+    def __init__(
+        self,
+        trace_memory: bool = False,
+        profile_stage: Optional[str] = None,
+        profiler: str = "cprofile",
+    ):
+        if profiler not in PROFILERS:
+            raise ValidationError(
+                f"Unknown profiler {profiler}, use one of {PROFILERS}"
+            )
+
+        if (
+            profile_stage
+            and profiler == "pyinstrument"
+            and importlib.util.find_spec("pyinstrument") is None
+        ):
+            raise ValidationError("pyinstrument is not installed")
+
+        self.trace_memory = trace_memory
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.spans: List[Span] = []
+        self._profile = None
+        self._stack: List[str] = []
+        # peaks of memory of the open spans, updated when a nested span ends
+        self._peaks: List[int] = []
+        self._started_at = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        path = ".".join(self._stack + [name])
+        profile = self._start_profile() if path == self.profile_stage else None
+
+        if self.trace_memory:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak_bytes)
+            # the peak of the span is measured from here
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+
+        self._stack.append(name)
+        started_at, cpu_started_at = time.perf_counter(), time.process_time()
+
+        try:
+            yield
+        finally:
+            wall_seconds = time.perf_counter() - started_at
+            cpu_seconds = time.process_time() - cpu_started_at
+            self._stack.pop()
+
+            span_peak_bytes = None
+            if self.trace_memory:
+                peak_bytes = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                span_peak_bytes = peak_bytes - current_bytes
+
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak_bytes)
+
+            if profile is not None:
+                self._stop_profile(profile)
+
+            self.spans.append(
+                Span(
+                    name=path,
+                    wall_seconds=wall_seconds,
+                    cpu_seconds=cpu_seconds,
+                    start_seconds=started_at - self._started_at,
+                    peak_bytes=span_peak_bytes,
+                )
+            )
+
+    def record(self, name: str, wall_seconds: float, cpu_seconds: float):
+        """Add a span measured elsewhere, e.g. in a worker process, as part of the
+        span open now."""
+        self.spans.append(
+            Span(
+                name=".".join(self._stack + [name]),
+                wall_seconds=wall_seconds,
+                cpu_seconds=cpu_seconds,
+            )
+        )
+
+    def _start_profile(self) -> Any:
+        if self.profiler == "cprofile":
+            import cProfile
+
+            self._profile = self._profile or cProfile.Profile()
+            self._profile.enable()
+        else:
+            from pyinstrument import Profiler
+
+            self._profile = self._profile or Profiler()
+            self._profile.start()
+
+        return self._profile
+
+    def _stop_profile(self, profile: Any):
+        if self.profiler == "cprofile":
+            profile.disable()
+        else:
+            profile.stop()
+
+    def save(self, output_dir: str) -> str:
+        """Write the spans as JSON in the output dir, and the profile next to it.
+        Returns the path of the JSON file."""
+        timings = {
+            "total_seconds": time.perf_counter() - self._started_at,
+            "trace_memory": self.trace_memory,
+            "spans": [span._asdict() for span in self.spans],
+        }
+
+        if self._profile is not None:
+            profile_name = f"profile_{self.profile_stage}"
+
+            if self.profiler == "cprofile":
+                profile_path = os.path.join(output_dir, f"{profile_name}.prof")
+                self._profile.dump_stats(profile_path)
+            else:
+                profile_path = os.path.join(output_dir, f"{profile_name}.html")
+                with open(profile_path, "w") as profile_file:
+                    profile_file.write(self._profile.output_html())
+
+            timings["profile"] = {
+                "stage": self.profile_stage,
+                "profiler": self.profiler,
+                "path": profile_path,
+            }
+
+        timings_path = os.path.join(output_dir, TIMINGS_FILE_NAME)
+        with open(timings_path, "w") as timings_file:
+            json.dump(timings, timings_file, indent=2)
+
+        return timings_path
+
+
+_NULL_SPAN = nullcontext()
+_active: Optional[Instrumentation] = None
+
+
+def get_instrumentation() -> Optional[Instrumentation]:
+    """Instrumentation active in this process, if any."""
+    return _active
+
+
+@contextmanager
+def instrumented(instrumentation: Optional[Instrumentation]) -> Iterator[None]:
+    """Make the instrumentation the active one while in the context. With None the
+    spans are not measured."""
+    global _active
+
+    previous, _active = _active, instrumentation
+    try:
+        yield
+    finally:
+        _active = previous
+
+        if instrumentation is not None and instrumentation.trace_memory:
+            import tracemalloc
+
+            tracemalloc.stop()
+
+
+def span(name: str):
+    """Measure the stage inside the context when an instrumentation is active."""
+    if _active is None:
+        return _NULL_SPAN
+
+    return _active.span(name)
+
+
+def save_instrumentation(output_dir: str) -> Optional[str]:
+    """Write the timings of the active instrumentation in the output dir."""
+    if _active is None:
+        return None
+
+    return _active.save(output_dir)
+
+
+def measure_call(function: Callable, **kwargs) -> Tuple[Any, float, float]:
+    """Call the function and return its result with its wall and CPU time, to
+    measure a task run in a worker process."""
+    started_at, cpu_started_at = time.perf_counter(), time.process_time()
+    result = function(**kwargs)
+
+    return (
+        result,
+        time.perf_counter() - started_at,
+        time.process_time() - cpu_started_at,
+    )
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import fields, is_dataclass
+from functools import partial
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from wrapy.instrumentation import get_instrumentation, measure_call, span
+
+
+def _to_json(value: Any) -> Any:
+    """Turn the inputs of a render job into plain JSON values."""
+    if isinstance(value, pd.DataFrame):
+        return value.to_dict(orient="split")
+    if isinstance(value, pd.Series):
+        return {"index": value.index.tolist(), "values": value.tolist()}
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, partial):
+        return [_to_json(value.func), value.args, value.keywords]
+    if is_dataclass(value):
+        return {field.name: getattr(value, field.name) for field in fields(value)}
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if callable(value):
+        return f"{value.__module__}.{value.__qualname__}"
+
+    raise TypeError(f"Can't digest values of type {type(value)}")
+
+
+class RenderJob(NamedTuple):
+    """A chart or card of a wrap, rendered by calling `function(**kwargs)`. The
+    image is written to `kwargs["save_path"]`, or returned as an RGB array when the
+    job runs with `as_array`."""
+
+    name: str
+    function: Callable
+    kwargs: dict
+
+    @property
+    def save_path(self) -> str:
+        return self.kwargs["save_path"]
+
+    def run(self, as_array: bool = False) -> Optional[np.ndarray]:
+        return self.function(**self.kwargs, as_array=as_array)
+
+    def digest(self) -> str:
+        """Hash of the function and the inputs of the job, the output path excluded.
+        Two jobs with the same digest render the same image."""
+        inputs = {
+            name: value for name, value in self.kwargs.items() if name != "save_path"
+        }
+        payload = json.dumps([self.function, inputs], default=_to_json, sort_keys=True)
+
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def run_render_jobs(
+    jobs: List[RenderJob],
+    workers: Optional[int] = None,
+    serial: bool = False,
+    initializer: Optional[Callable] = None,
+    as_arrays: bool = False,
+) -> List[Optional[np.ndarray]]:
+    """Render the jobs, each one as an independent task of a pool of processes. The
+    rendering libraries are CPU bound and not thread safe, so processes are used,
+    and only the small inputs of each job are sent to them.
+
+    Returns the RGB arrays of the images in the order of the jobs when `as_arrays`
+    is set, nothing is written to disk then. Otherwise each job writes its image and
+    None is returned for it. Each job is a span of the active instrumentation, if
+    any, measured in the worker when it runs in a pool.
+
+    Args:
+        - jobs (List[RenderJob]): The charts and cards to render.
+        - workers (Optional[int], default=None): Number of processes, defaults to the
+        number of CPUs.
+        - serial (bool, default=False): Render the jobs one after another in the
+        current process, useful for debugging or when it's already a worker.
+        - initializer (Optional[Callable], default=None): Called once in every
+        process before rendering, e.g. to set the plot styles.
+        - as_arrays (bool, default=False): Return the images instead of writing them.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+
+    if serial or workers < 2:
+        images = []
+
+        for job in jobs:
+            with span(job.name):
+                images.append(job.run(as_arrays))
+
+        return images
+
+    instrumentation = get_instrumentation()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        if instrumentation is None:
+            futures = [
+                executor.submit(job.function, **job.kwargs, as_array=as_arrays)
+                for job in jobs
+            ]
+
+            # raise the first error of the jobs, if any
+            return [future.result() for future in futures]
+
+        futures = [
+            executor.submit(
+                measure_call, job.function, **job.kwargs, as_array=as_arrays
+            )
+            for job in jobs
+        ]
+        images = []
+
+        for job, future in zip(jobs, futures):
+            image, wall_seconds, cpu_seconds = future.result()
+            instrumentation.record(job.name, wall_seconds, cpu_seconds)
+            images.append(image)
+
+        return images
+
+
+def write_frames(
+    frames: Dict[str, np.ndarray], executor: ThreadPoolExecutor
+) -> List[Future]:
+    """Write the RGB arrays as PNG images in the threads of the executor, keyed by
+    their paths. The PNG encoder releases the GIL, so the images are written while
+    the main thread keeps working, e.g. making the video."""
+    return [
+        executor.submit(Image.fromarray(frame).save, path)
+        for path, frame in frames.items()
+    ]
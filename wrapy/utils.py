@@ -1,44 +1,325 @@
+import calendar
 import json
 import os
-from datetime import date, datetime
-from typing import Any, List, Optional, Tuple
+import re
+from datetime import date, datetime, timedelta
+from itertools import islice
+from operator import itemgetter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+)
 
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 
-from wrapy.constants import DEFAULT_DATA_DIR, LIMIT_DATE_FORMAT
+from wrapy.constants import (
+    ACCOUNT_HISTORY_FIELDS,
+    CALENDAR_FIELD_ACCESSORS,
+    DEFAULT_DATA_DIR,
+    END_LOCAL_TIME_COL_NAME,
+    EXTENDED_HISTORY_DATE_FORMAT,
+    EXTENDED_HISTORY_FIELDS,
+    HISTORY_CHUNK_SIZE,
+    HISTORY_DATE_FORMAT,
+    HISTORY_FILE_PREFIXES,
+    HISTORY_LOAD_CHUNK_SIZE,
+    JSON_READ_BLOCK_SIZE,
+    LIMIT_DATE_FORMAT,
+    LOCAL_CALENDAR_COLUMNS,
+    LOCAL_DATE_COL_NAME,
+    SKIPPED_COL_NAME,
+)
 
 
-def load_streaming_history_data(file_path: Optional[str] = None) -> pd.DataFrame:
+class HistorySchema(NamedTuple):
+    """Fields of the records of a streaming history export."""
+
+    name: str
+    # column of the loaded history -> field of the records
+    fields: Dict[str, str]
+    date_format: str
+
+
+HISTORY_SCHEMAS = [
+    HistorySchema("extended", EXTENDED_HISTORY_FIELDS, EXTENDED_HISTORY_DATE_FORMAT),
+    HistorySchema("account", ACCOUNT_HISTORY_FIELDS, HISTORY_DATE_FORMAT),
+]
+
+
+def detect_history_schema(record: dict) -> HistorySchema:
+    """Schema of the export the record comes from."""
+    for schema in HISTORY_SCHEMAS:
+        if all(field in record for field in schema.fields.values()):
+            return schema
+
+    raise ValueError(f"Unknown streaming history record, fields: {sorted(record)}")
+
+
+def _detect_text_schema(text: str) -> HistorySchema:
+    """Schema of the records of the JSON text of a file, or its beginning, from its
+    first record. A file without records is taken as an account data export."""
+    start = text.find("{")
+
+    if start < 0:
+        return HISTORY_SCHEMAS[-1]
+
+    first_record, _ = json.JSONDecoder().raw_decode(text, start)
+
+    return detect_history_schema(first_record)
+
+
+def _records_to_frame(records: List[tuple], schema: HistorySchema) -> pd.DataFrame:
+    """Build the typed columns of the records projected by the fields of the
+    schema, see `_load_streaming_history_file`."""
+    positions = {column: i for i, column in enumerate(schema.fields)}
+    track_position = positions["trackName"]
+
+    if schema.name == "extended":
+        records = [record for record in records if record[track_position] is not None]
+
+    columns = {
+        column: [record[position] for record in records]
+        for column, position in positions.items()
+        if column != "msPlayed"
+    }
+    ms_position = positions["msPlayed"]
+    ms_played = np.fromiter(
+        (record[ms_position] for record in records),
+        dtype=np.int32,
+        count=len(records),
+    )
+
+    if SKIPPED_COL_NAME in columns:
+        skipped = pd.array(columns[SKIPPED_COL_NAME], dtype="boolean")
+    else:
+        skipped = pd.arrays.BooleanArray(
+            np.zeros(len(records), dtype=bool), np.ones(len(records), dtype=bool)
+        )
+
+    return pd.DataFrame(
+        {
+            "endTime": pd.to_datetime(
+                columns["endTime"], format=schema.date_format, utc=True
+            ),
+            "artistName": pd.Categorical(columns["artistName"]),
+            "trackName": pd.Categorical(columns["trackName"]),
+            "msPlayed": ms_played,
+            SKIPPED_COL_NAME: skipped,
+        }
+    )
+
+
+def _iter_history_records(json_file: TextIO) -> Tuple[HistorySchema, Iterator[tuple]]:
+    """Schema of the records of an open streaming history file and an iterator over
+    its records, read as a stream. Only the loaded fields of each record are kept,
+    as a tuple in the order of the columns of the schema, the dict with every field
+    is dropped as soon as it's parsed (the extended export has about twenty
+    fields)."""
+    schema = _detect_text_schema(json_file.read(JSON_READ_BLOCK_SIZE))
+    json_file.seek(0)
+
+    return schema, iter_json_array(
+        json_file, object_hook=itemgetter(*schema.fields.values())
+    )
+
+
+def _load_streaming_history_file(file_path: str) -> pd.DataFrame:
+    """Load a single streaming history JSON file, of any of the `HISTORY_SCHEMAS`
+    (detected from its first record), into typed columns. The file is read as a
+    stream, neither its text nor all its records are held at once.
+
+    The plays of the extended export without a track (podcast episodes and
+    audiobooks) are dropped. The `skipped` column is the flag of the extended
+    export, missing (NA) when it's unknown, always for the account export."""
+    with open(file_path) as json_file:
+        schema, records = _iter_history_records(json_file)
+        # the typed columns are built every chunk of records, so the records are
+        # never all held as Python objects
+        frames = [
+            _records_to_frame(chunk, schema)
+            for chunk in iter(
+                lambda: list(islice(records, HISTORY_LOAD_CHUNK_SIZE)), []
+            )
+        ]
+
+    return _concat_typed_frames(frames or [_records_to_frame([], schema)])
+
+
+# whitespace and commas between the items of a JSON array
+JSON_SEPARATOR_PATTERN = re.compile(r"[ \t\r\n,]*")
+
+
+def iter_json_array(
+    json_file: TextIO,
+    object_hook: Optional[Callable[[dict], Any]] = None,
+    block_size: int = JSON_READ_BLOCK_SIZE,
+) -> Iterator[Any]:
+    """Yield the items of the JSON array of the file one by one, decoding them from
+    blocks of `block_size` characters, so the whole file is never read at once. Only
+    the unparsed tail of the last block is kept in memory.
+
+    The complete objects of each block are decoded at once, as an array cut after
+    the last `}` of the block. When the cut isn't the end of an item (a `}` inside a
+    string or a nested object) that array is invalid, and the items of the block
+    are decoded one by one with `raw_decode`."""
+    decoder = json.JSONDecoder(object_hook=object_hook)
+    buffer = json_file.read(block_size)
+    position = len(buffer) - len(buffer.lstrip())
+
+    if buffer[position : position + 1] != "[":
+        raise ValueError(f"{json_file.name} is not a JSON array")
+
+    position += 1
+    new_block = True
+
+    while True:
+        # skip the whitespace and the comma between the items
+        position = JSON_SEPARATOR_PATTERN.match(buffer, position).end()
+
+        if position < len(buffer) and buffer[position] == "]":
+            return
+
+        if new_block:
+            new_block = False
+            items_end = buffer.rfind("}") + 1
+
+            if items_end > position:
+                try:
+                    items = decoder.decode(f"[{buffer[position:items_end]}]")
+                except json.JSONDecodeError:
+                    pass
+                else:
+                    yield from items
+                    position = items_end
+                    continue
+
+        if position < len(buffer):
+            try:
+                item, item_end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the item is cut at the end of the block
+                pass
+            else:
+                # an item is followed by a comma or the end of the array, one that
+                # reaches the end of the block may be cut, e.g. a number
+                if item_end < len(buffer):
+                    yield item
+                    position = item_end
+                    continue
+
+        block = json_file.read(block_size)
+
+        if not block:
+            raise ValueError(f"{json_file.name} ends before the end of the array")
+
+        buffer, position = buffer[position:] + block, 0
+        new_block = True
+
+
+def iter_streaming_history_chunks(
+    file_paths: List[str], chunk_size: int = HISTORY_CHUNK_SIZE
+) -> Iterator[pd.DataFrame]:
+    """Yield the plays of the streaming history files, in the order of the files,
+    in frames of at most `chunk_size` plays with the same typed columns as
+    `load_streaming_history_data`. The files are read as a stream, so the memory
+    used depends on the chunk size and not on the size of the files."""
+    for file_path in file_paths:
+        with open(file_path) as json_file:
+            schema, records = _iter_history_records(json_file)
+
+            while True:
+                chunk = list(islice(records, chunk_size))
+
+                if not chunk:
+                    break
+
+                yield _records_to_frame(chunk, schema)
+
+
+def _concat_typed_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate frames with the same columns, unifying the categories of the
+    categorical columns instead of falling back to object dtype."""
+    if len(frames) == 1:
+        return frames[0]
+
+    columns = dict()
+
+    for column_name, dtype in frames[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            columns[column_name] = union_categoricals(
+                [frame[column_name] for frame in frames]
+            )
+        else:
+            columns[column_name] = pd.concat(
+                [frame[column_name] for frame in frames], ignore_index=True
+            )
+
+    return pd.DataFrame(columns)
+
+
+def find_streaming_history_files(data_dir: str = DEFAULT_DATA_DIR) -> List[str]:
+    """Return the sorted paths of the streaming history files in the data dir, of
+    the account data export or of the extended streaming history (only the audio
+    files, not the video ones)."""
+    file_paths = []
+
+    for file_ in sorted(os.listdir(data_dir)):
+        if file_.startswith(HISTORY_FILE_PREFIXES) and file_.endswith(".json"):
+            file_paths.append(os.path.join(data_dir, file_))
+
+    if len(file_paths) == 0:
+        raise Exception(
+            f"Error trying to find streaming data in default dir ({data_dir})"
+        )
+
+    return file_paths
+
+
+def load_streaming_history_data(
+    file_path: Optional[str] = None, file_paths: Optional[List[str]] = None
+) -> pd.DataFrame:
     """Load a user's streaming history Spotify data from a specified file or
     the default directory and returns it as a pandas DataFrame.
 
+    Each file is parsed on its own into typed columns: `endTime` as a UTC datetime,
+    `artistName` and `trackName` as categoricals, `msPlayed` as int32 and `skipped`
+    as a nullable boolean, so the whole history is never held as Python objects at
+    once. The account data export and the extended streaming history are both
+    supported, the schema of each file is detected from its records.
+
     Args:
         file_path (Optional[str], default=None): The path of the JSON file containing the
         streaming history data. If not provided, the function will attempt to load the
         data from a file in the default data directory.
+        file_paths (Optional[List[str]], default=None): The paths of several JSON
+        files to load together, used instead of the default directory.
 
     Returns:
         pd.DataFrame: A pandas DataFrame containing the streaming history data.
     """
-    if not file_path:
-        files_ = os.listdir(DEFAULT_DATA_DIR)
-        file_paths = []
+    if file_path:
+        file_paths = [file_path]
+    elif not file_paths:
+        file_paths = find_streaming_history_files()
 
-        for file_ in files_:
-            if file_.startswith("StreamingHistory"):
-                file_paths.append(os.path.join(DEFAULT_DATA_DIR, file_))
+    frames = [_load_streaming_history_file(file_path) for file_path in file_paths]
 
-        if len(file_paths) == 0:
-            raise Exception(
-                f"Error trying to find streaming data in default dir ({DEFAULT_DATA_DIR})"
-            )
+    return _concat_typed_frames(frames)
 
-    data = list()
-    for file_path in file_paths:
-        with open(file_path) as json_file:
-            data += json.load(json_file)
 
-    return pd.DataFrame.from_dict(data)
+def get_memory_footprint(data: pd.DataFrame) -> int:
+    """Return the number of bytes used by the DataFrame, including the values
+    referenced by object and categorical columns."""
+    return int(data.memory_usage(deep=True).sum())
 
 
 def map_int_day_to_weekday_name(days_week_map: dict, day_id: int) -> str:
@@ -52,7 +333,7 @@ def convert_column_utc_datetime_to_local_time(
     new_tz: str,
     column_name: str,
     new_column_name: str,
-    date_format: str = "%Y-%m-%d %H:%M",
+    date_format: str = HISTORY_DATE_FORMAT,
 ) -> pd.DataFrame:
     """Converts a pandas DataFrame column with datetime values in UTC to a specified
     local time zone, creating a new column with the converted values.
@@ -67,18 +348,47 @@ def convert_column_utc_datetime_to_local_time(
         - new_column_name (str): The name of the new column that will store the
         datetime values in the target timezone.
         - date_format (str, optional): The format of the datetime values in the
-        input column. Defaults to `%Y-%m-%d %H:%M`.
+        input column, ignored when the column was already parsed at load time.
+        Defaults to `%Y-%m-%d %H:%M`.
 
     Returns:
         pd.DataFrame: The modified DataFrame with the new column containing datetime values in the target timezone.
     """
-    data[column_name] = pd.to_datetime(data[column_name], format=date_format, utc=True)
+    if not pd.api.types.is_datetime64_any_dtype(data[column_name]):
+        data[column_name] = pd.to_datetime(
+            data[column_name], format=date_format, utc=True
+        )
 
     data[new_column_name] = data[column_name].dt.tz_convert(tz=new_tz)
 
     return data
 
 
+def add_local_calendar_columns(
+    data: pd.DataFrame, column_name: str = END_LOCAL_TIME_COL_NAME
+) -> pd.DataFrame:
+    """Add the hour, weekday and month of the local times of `column_name` as int8
+    columns, and their day as a date column without timezone, see
+    `LOCAL_CALENDAR_COLUMNS`. The functions of `wrapy.core` take the calendar
+    fields from these columns instead of extracting them from the timezone aware
+    timestamps every time."""
+    timestamps = data[column_name]
+
+    for field_name, calendar_column in LOCAL_CALENDAR_COLUMNS.items():
+        data[calendar_column] = (
+            getattr(timestamps.dt, CALENDAR_FIELD_ACCESSORS[field_name])
+            .to_numpy()
+            .astype(np.int8)
+        )
+
+    # the wall clock time truncated to the day, `.dt.date` makes Python objects. It's
+    # kept in nanoseconds, as the other datetimes, since Parquet has no unit of
+    # days or seconds and the cached histories would come back in another one
+    data[LOCAL_DATE_COL_NAME] = timestamps.dt.tz_localize(None).dt.normalize()
+
+    return data
+
+
 def separate_di_tuples_in_two_lists(tuples: List[Tuple[Any, Any]]) -> Tuple[list, list]:
     """Separates a list of 2-tuples into two separate lists, with the first
     elements in one list and the second elements in the other list.
@@ -102,16 +412,117 @@ def parse_str_to_date(date_str: str) -> date:
     return datetime.strptime(date_str, LIMIT_DATE_FORMAT).date()
 
 
+class Period(NamedTuple):
+    """Days of a wrap, from `start_date` to `end_date`, both whole days included."""
+
+    label: str
+    start_date: date
+    end_date: date
+
+
+def parse_period(period_str: str) -> Period:
+    """Create a period from a year (`2023`), a quarter (`2023-Q1`), a month
+    (`2023-03`) or a range of days (`2023-03-15:2023-04-15`)."""
+    if ":" in period_str:
+        start_str, end_str = period_str.split(":", 1)
+        start_date, end_date = parse_str_to_date(start_str), parse_str_to_date(end_str)
+
+        if start_date > end_date:
+            raise ValueError(f"The period {period_str} ends before it starts")
+
+        return Period(f"{start_date}_{end_date}", start_date, end_date)
+
+    year_str, _, part = period_str.partition("-")
+    year = int(year_str)
+
+    if not part:
+        first_month, last_month = 1, 12
+    elif part.upper().startswith("Q"):
+        quarter = int(part[1:])
+        if not 1 <= quarter <= 4:
+            raise ValueError(f"Unknown quarter {period_str}")
+        first_month, last_month = 3 * quarter - 2, 3 * quarter
+    else:
+        first_month = last_month = int(part)
+        if not 1 <= first_month <= 12:
+            raise ValueError(f"Unknown month {period_str}")
+
+    return Period(
+        period_str.upper(),
+        date(year, first_month, 1),
+        date(year, last_month, calendar.monthrange(year, last_month)[1]),
+    )
+
+
+def sort_data_by_time(
+    data: pd.DataFrame, column_name: str = END_LOCAL_TIME_COL_NAME
+) -> pd.DataFrame:
+    """Sort the plays by the timestamps of `column_name`, the plays at the same time
+    keep their order. The data is returned as it is when it's already sorted, as
+    the exports usually are."""
+    if data[column_name].is_monotonic_increasing:
+        return data
+
+    order = np.argsort(data[column_name].array.asi8, kind="stable")
+
+    return data.take(order).reset_index(drop=True)
+
+
+def _dates_to_timestamps(timestamps: pd.Series, dates: List[date]) -> pd.DatetimeIndex:
+    """Midnight of each date in the timezone of the timestamps."""
+    timezone_name = timestamps.dt.tz
+    assert timestamps.dtype == pd.core.dtypes.dtypes.DatetimeTZDtype(tz=timezone_name)
+
+    return pd.DatetimeIndex(
+        [pd.Timestamp(ts_input=date_, tz=timezone_name) for date_ in dates]
+    )
+
+
+def find_dates_positions(
+    data: pd.DataFrame, column_name: str, windows: List[Tuple[date, date]]
+) -> List[slice]:
+    """Find the positions of the plays of each (start_date, end_date) window, with
+    two binary searches per window over the timestamps of `column_name`, which must
+    be sorted, see `sort_data_by_time`. The windows are taken as in
+    `filter_data_by_dates`."""
+    timestamps = data[column_name]
+    starts = timestamps.searchsorted(
+        _dates_to_timestamps(timestamps, [start_date for start_date, _ in windows]),
+        side="left",
+    )
+    stops = timestamps.searchsorted(
+        _dates_to_timestamps(
+            timestamps, [end_date + timedelta(days=1) for _, end_date in windows]
+        ),
+        side="left",
+    )
+
+    return [slice(start, stop) for start, stop in zip(starts, stops)]
+
+
+def slice_data_by_dates(
+    data: pd.DataFrame, column_name: str, windows: List[Tuple[date, date]]
+) -> List[pd.DataFrame]:
+    """Same as `filter_data_by_dates` for each (start_date, end_date) window at once,
+    over data sorted by `column_name`. The plays of each window are a slice of
+    `data`, no mask is evaluated and the rows are not copied."""
+    return [
+        data.iloc[positions]
+        for positions in find_dates_positions(data, column_name, windows)
+    ]
+
+
 def filter_data_by_dates(
     data: pd.DataFrame, column_name: str, start_date: date, end_date: date
 ) -> pd.DataFrame:
-    """Filter data by the column_name given and the start_date and end_date"""
-    timezone_name = data[column_name].dt.tz
-    assert data[column_name].dtype == pd.core.dtypes.dtypes.DatetimeTZDtype(
-        tz=timezone_name
-    )
+    """Filter data by the column_name given and the start_date and end_date, both
+    days included, like the days of a period (see `parse_period`). Sorted data is
+    sliced with a binary search, see `slice_data_by_dates`."""
+    if data[column_name].is_monotonic_increasing:
+        return slice_data_by_dates(data, column_name, [(start_date, end_date)])[0]
 
-    start_date = pd.Timestamp(ts_input=start_date, tz=timezone_name)
-    end_date = pd.Timestamp(ts_input=end_date, tz=timezone_name)
+    start, stop = _dates_to_timestamps(
+        data[column_name], [start_date, end_date + timedelta(days=1)]
+    )
 
-    return data[(data[column_name] >= start_date) & (data[column_name] <= end_date)]
+    return data[(data[column_name] >= start) & (data[column_name] < stop)]
@@ -1,25 +1,49 @@
-from typing import List, Optional
+import os
+import subprocess
+import tempfile
+from typing import Iterable, Iterator, List, Optional, Sequence, Union
 
 import cv2
 import numpy as np
-from moviepy.editor import AudioFileClip, ImageClip, concatenate_videoclips
+from imageio_ffmpeg import get_ffmpeg_exe
+from moviepy.editor import AudioFileClip, VideoClip
 
-from wrapy.constants import FPS, IMAGE_DURATION_SECS, TRANSTITION_DURATION_SECS
+from wrapy.constants import (
+    DEFAULT_VIDEO_BACKEND,
+    FPS,
+    IMAGE_DURATION_SECS,
+    TRANSTITION_DURATION_SECS,
+    VIDEO_BACKENDS,
+    VIDEO_CODEC,
+    VIDEO_CRF,
+    VIDEO_PRESET,
+)
+from wrapy.custom_exceptions import VideoEncodingError
+
+# timescale shared by the segments, so they can be joined without re-encoding
+SEGMENT_TIMESCALE = FPS * 512
 
 
 class VideoMaker:
-    def __init__(self, image_filepaths: List[str], image_size: tuple):
+    def __init__(self, images: Sequence[Union[str, np.ndarray]], image_size: tuple):
+        """The images of the video, in order, are given as file paths or as RGB
+        arrays already in memory."""
         self.images = [
-            self.__prepare_image(cv2.imread(img), image_size) for img in image_filepaths
+            self.__prepare_image(self.__load_image(img), image_size) for img in images
         ]
 
+    def __load_image(self, image: Union[str, np.ndarray]) -> np.ndarray:
+        if isinstance(image, str):
+            return cv2.cvtColor(src=cv2.imread(image), code=cv2.COLOR_BGR2RGB)
+
+        return image
+
     def __prepare_image(self, img: np.ndarray, dims: tuple) -> np.ndarray:
         """Resize the image to the target dims maintaining their aspect ratio and then
         fill the the remaining space with black color."""
         height, width = img.shape[:2]
         target_height = dims[0]
         target_width = dims[1]
-        img = cv2.cvtColor(src=img, code=cv2.COLOR_BGR2RGB)
 
         scale = min(target_width / width, target_height / height)
         new_width, new_height = int(scale * width), int(scale * height)
@@ -45,21 +69,88 @@ class VideoMaker:
 
         return resized_img_with_border
 
-    def make(self, output_path: str, audio_path: Optional[str] = None) -> None:
-        clips = []
+    @property
+    def transition_frames(self) -> int:
+        return int(TRANSTITION_DURATION_SECS * FPS)
+
+    @property
+    def duration(self) -> float:
+        """Duration in seconds of the whole video, every image is followed by a
+        transition to the next one, except the last image."""
+        n_images = len(self.images)
+
+        return (
+            n_images * IMAGE_DURATION_SECS
+            + (n_images - 1) * self.transition_frames / FPS
+        )
+
+    @property
+    def total_frames(self) -> int:
+        return int(round(self.duration * FPS))
+
+    def make_frame(self, t: float) -> np.ndarray:
+        """Return the frame of the video at the time `t` in seconds. The images are
+        returned as they are and the transition frames are blended on demand, so
+        nothing besides the source images is kept in memory."""
+        image_frames = IMAGE_DURATION_SECS * FPS
+        # each image is followed by its transition to the next image
+        segment_frames = image_frames + self.transition_frames
+
+        # small tolerance for the float error of t = frame / FPS
+        frame = t * FPS + 1e-6
+        i = min(int(frame // segment_frames), len(self.images) - 1)
+        frame_in_segment = frame - i * segment_frames
 
-        for i in range(len(self.images) - 1):
-            prev_img = self.images[i]
-            next_img = self.images[i + 1]
+        if i == len(self.images) - 1 or frame_in_segment < image_frames:
+            return self.images[i]
 
-            clip = ImageClip(prev_img).set_duration(IMAGE_DURATION_SECS)
-            transition = self.__create_transition(prev_img, next_img)
+        transition_frame = min(
+            int(frame_in_segment - image_frames), self.transition_frames - 1
+        )
+
+        return self.__blend(i, transition_frame)
+
+    def __blend(self, i: int, transition_frame: int) -> np.ndarray:
+        """Frame of the transition from the image `i` to the next one."""
+        alpha = transition_frame / self.transition_frames
+
+        return cv2.addWeighted(self.images[i], 1 - alpha, self.images[i + 1], alpha, 0)
+
+    def iter_frames(self) -> Iterator[np.ndarray]:
+        """Generate every frame of the video, in order, at the FPS of the video."""
+        for frame in range(self.total_frames):
+            yield self.make_frame(frame / FPS)
 
-            clips.extend([clip, transition])
+    def make(
+        self,
+        output_path: str,
+        audio_path: Optional[str] = None,
+        backend: str = DEFAULT_VIDEO_BACKEND,
+        codec: str = VIDEO_CODEC,
+        preset: str = VIDEO_PRESET,
+        crf: int = VIDEO_CRF,
+    ) -> None:
+        """Encode the video as MP4 with the given backend: `moviepy`, `ffmpeg` to
+        pipe the raw frames straight into an ffmpeg process, or `segments` to encode
+        each image once and only the transitions frame by frame."""
+        if backend == "moviepy":
+            self.__make_with_moviepy(output_path, audio_path, codec, preset, crf)
+        elif backend == "ffmpeg":
+            self.__make_with_ffmpeg(output_path, audio_path, codec, preset, crf)
+        elif backend == "segments":
+            self.__make_with_segments(output_path, audio_path, codec, preset, crf)
+        else:
+            raise ValueError(f"Unknown video backend '{backend}', use {VIDEO_BACKENDS}")
 
-        # add the last image without transition
-        clips.append(ImageClip(self.images[-1]).set_duration(IMAGE_DURATION_SECS))
-        video = concatenate_videoclips(clips)
+    def __make_with_moviepy(
+        self,
+        output_path: str,
+        audio_path: Optional[str],
+        codec: str,
+        preset: str,
+        crf: int,
+    ) -> None:
+        video = VideoClip(self.make_frame, duration=self.duration)
 
         # add audio, cut to the video duration
         if audio_path:
@@ -67,15 +158,171 @@ class VideoMaker:
             video = video.set_audio(audio.set_duration(video.duration))
 
         # save video
-        video.write_videofile(output_path, fps=FPS)
+        video.write_videofile(
+            output_path,
+            fps=FPS,
+            codec=codec,
+            preset=preset,
+            ffmpeg_params=["-crf", str(crf)],
+        )
+
+    def __make_with_ffmpeg(
+        self,
+        output_path: str,
+        audio_path: Optional[str],
+        codec: str,
+        preset: str,
+        crf: int,
+    ) -> None:
+        """Stream the raw RGB frames into the stdin of an ffmpeg process. The audio,
+        cut to the video duration, is read and encoded by ffmpeg itself."""
+        command = self.__raw_input_command()
+        command += self.__audio_args(audio_path)
+        command += self.__video_codec_args(codec, preset, crf)
+        command += ["-movflags", "+faststart", output_path]
+
+        self.__run_ffmpeg(command, self.iter_frames())
+
+    def __make_with_segments(
+        self,
+        output_path: str,
+        audio_path: Optional[str],
+        codec: str,
+        preset: str,
+        crf: int,
+    ) -> None:
+        """Encode each image as a still segment of two frames, the first and last
+        frames of its time on screen (tuned for still images with libx264), and
+        each transition frame by frame. Then the
+        segments are joined by the concat demuxer without re-encoding them, so the
+        encoding time depends on the number of images and not on the duration.
+
+        Every segment is encoded with the same settings and timescale, as the
+        stream copy requires, and its duration is set in the concat list because
+        the duration of the last frame of a segment is not kept in the file."""
+        codec_args = self.__video_codec_args(codec, preset, crf)
+        codec_args += ["-video_track_timescale", str(SEGMENT_TIMESCALE)]
+        # x264 tuning for still images, other encoders don't have it. It changes how
+        # the bits are spent, not the stream parameters, so the segments can still
+        # be joined by stream copy
+        still_args = ["-tune", "stillimage"] if codec == "libx264" else []
+        # the second frame of a still segment is shown at its last frame time
+        last_still_frame_secs = IMAGE_DURATION_SECS - 1 / FPS
+
+        with tempfile.TemporaryDirectory() as segments_dir:
+            concat_list = []
+
+            for i, image in enumerate(self.images):
+                segment_name = f"image_{i}.mp4"
+                self.__run_ffmpeg(
+                    self.__raw_input_command()
+                    + ["-vf", f"setpts=N*{last_still_frame_secs}/TB"]
+                    + ["-fps_mode", "vfr"]
+                    + codec_args
+                    + still_args
+                    + [os.path.join(segments_dir, segment_name)],
+                    [image, image],
+                )
+                concat_list.append((segment_name, IMAGE_DURATION_SECS))
+
+                if i == len(self.images) - 1:
+                    break
+
+                segment_name = f"transition_{i}.mp4"
+                self.__run_ffmpeg(
+                    self.__raw_input_command()
+                    + codec_args
+                    + [os.path.join(segments_dir, segment_name)],
+                    (
+                        self.__blend(i, transition_frame)
+                        for transition_frame in range(self.transition_frames)
+                    ),
+                )
+                concat_list.append((segment_name, self.transition_frames / FPS))
+
+            concat_list_path = os.path.join(segments_dir, "segments.txt")
+            with open(concat_list_path, "w") as concat_list_file:
+                for segment_name, duration in concat_list:
+                    concat_list_file.write(
+                        f"file '{segment_name}'\nduration {duration}\n"
+                    )
+
+            command = [get_ffmpeg_exe(), "-y", "-loglevel", "error"]
+            command += ["-f", "concat", "-i", concat_list_path]
+            command += self.__audio_args(audio_path)
+            command += ["-c:v", "copy", "-movflags", "+faststart", output_path]
+
+            self.__run_ffmpeg(command)
+
+    def __raw_input_command(self) -> List[str]:
+        """Command of an ffmpeg process that reads raw RGB frames from stdin."""
+        height, width = self.images[0].shape[:2]
+
+        return [
+            get_ffmpeg_exe(),
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-s",
+            f"{width}x{height}",
+            "-framerate",
+            str(FPS),
+            "-i",
+            "-",
+        ]
+
+    def __audio_args(self, audio_path: Optional[str]) -> List[str]:
+        """Arguments to add the audio, cut to the video duration, as second input."""
+        if not audio_path:
+            return []
+
+        return [
+            "-t",
+            f"{self.duration:.3f}",
+            "-i",
+            audio_path,
+            "-map",
+            "0:v",
+            "-map",
+            "1:a",
+            "-c:a",
+            "aac",
+        ]
+
+    def __video_codec_args(self, codec: str, preset: str, crf: int) -> List[str]:
+        return [
+            "-c:v",
+            codec,
+            "-preset",
+            preset,
+            "-crf",
+            str(crf),
+            "-pix_fmt",
+            "yuv420p",
+        ]
+
+    def __run_ffmpeg(
+        self, command: List[str], frames: Iterable[np.ndarray] = ()
+    ) -> None:
+        """Run the ffmpeg command writing the frames into its stdin."""
+        process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stderr=subprocess.PIPE
+        )
 
-    def __create_transition(self, prev_img: np.ndarray, next_img: np.ndarray):
-        transition_frames = int(TRANSTITION_DURATION_SECS * FPS)
-        transition_video = []
+        try:
+            for frame in frames:
+                process.stdin.write(np.ascontiguousarray(frame).data)
+            process.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg exited early, its error is reported below
+            pass
 
-        for i in range(transition_frames):
-            alpha = i / transition_frames
-            frame = cv2.addWeighted(prev_img, 1 - alpha, next_img, alpha, 0)
-            transition_video.append(ImageClip(frame).set_duration(1 / FPS))
+        stderr = process.stderr.read().decode(errors="replace")
+        process.stderr.close()
 
-        return concatenate_videoclips(transition_video)
+        if process.wait() != 0:
+            raise VideoEncodingError(f"ffmpeg failed to encode the video: {stderr}")